@@ -0,0 +1,91 @@
+"""Общая подготовка для бенчмарков: фиктивный токен, временная папка данных, генерация пользователей"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+
+os.environ.setdefault("TOKEN", "123456:BENCHMARK")
+sys.path.insert(0, str(ROOT))
+
+# Данные бота пишутся относительно cwd — уводим их во временную папку
+DATA_DIR = tempfile.mkdtemp(prefix="haybot-bench-")
+os.chdir(DATA_DIR)
+
+import bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Chat, Message  # noqa: E402
+
+bot.logger.setLevel("WARNING")
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+
+def make_users(n: int, seed: int = 42) -> dict:
+    """Синтетическая таблица пользователей в формате users.json"""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    users = {}
+
+    for i in range(n):
+        uid = str(100_000_000 + i)
+        messages = int(rnd.paretovariate(1.2)) - 1
+        commands = int(rnd.paretovariate(2.0)) - 1
+        last_active = now - timedelta(days=rnd.expovariate(1 / 20))
+        users[uid] = {
+            'name': f"User{i}",
+            'username': f"user_{i}" if i % 3 else '',
+            'points': messages // 10 * bot.config.POINTS_PER_10_MESSAGES + commands * bot.config.POINTS_PER_COMMAND,
+            'messages': messages,
+            'commands': commands,
+            'joined': (last_active - timedelta(days=rnd.randint(0, 365))).isoformat(),
+            'last_active': last_active.isoformat()
+        }
+
+    return users
+
+
+def make_manager(users: dict, chat_id: int = 0) -> "bot.FastDataManager":
+    """Менеджер данных поверх таблицы в формате users.json, без чтения файлов"""
+    manager = bot.FastDataManager(chat_id)
+    manager.users = {int(uid): bot.UserRecord.from_json(data) for uid, data in users.items()}
+    manager._rebuild_indexes()
+    return manager
+
+
+class StubSession(BaseSession):
+    """Сессия Bot API, которая записывает вызовы вместо отправки"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: list = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        if isinstance(method, SendMessage):
+            return Message(message_id=len(self.calls), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type='supergroup'), text=method.text)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def measure(func, repeat: int) -> float:
+    """Среднее время одного вызова в миллисекундах"""
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) * 1000 / repeat
+
+
+def parse_sizes(argv) -> tuple:
+    return tuple(int(a) for a in argv[1:]) or SIZES
@@ -0,0 +1,138 @@
+"""Сквозной нагрузочный прогон: процесс бота целиком против заглушки Bot API.
+
+Поднимает benchmarks/mock_api.py, запускает бот отдельным процессом
+(main(): polling, middleware, очередь трекинга, исходящая очередь,
+автосохранение) с BOT_API_URL на заглушку и подаёт поток апдейтов с
+заданной частотой. Итог — задержка от появления апдейта до ответа бота,
+устойчивая пропускная способность и CPU процесса бота, JSON.
+
+Лимиты исходящей очереди в боте сняты, как в bench_pipeline (иначе всё
+упрётся в 30 сообщений в секунду); --telegram-limits оставляет боевые.
+Плановые посты отключены — их сообщения путали бы сопоставление ответов.
+С --backlog бот стартует с очередью простоя и сначала догоняет её.
+
+Запуск: python benchmarks/bench_e2e.py [--rate N] [--updates N] [--chats N] [--users N]
+        [--latency MS] [--retry-rate F] [--backlog N] [--backlog-age SEC]
+        [--throttle] [--telegram-limits] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import signal
+import socket
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from mock_api import MockBotAPI, UpdateStream, add_arguments
+
+HOST = "127.0.0.1"
+
+
+def run_bot(args):
+    """Дочерний процесс: бот как в бою, только с другими лимитами"""
+    from _common import bot
+    from bench_pipeline import lift_limits
+
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    bot.config.METRICS_ENABLED = False
+    bot.config.RUN_JOBS = False
+    if not args.telegram_limits:
+        lift_limits(args.throttle)
+    asyncio.run(bot.main())
+
+
+def process_cpu(pid: int) -> float:
+    """CPU процесса в секундах из /proc (Linux); без /proc — 0"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(')', 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def bench(args) -> dict:
+    api = MockBotAPI(UpdateStream(args.rate, args.updates, args.chats, args.users),
+                     args.latency / 1000, args.retry_rate, args.retry_after)
+    api.preload(args.backlog, args.backlog_age)
+    port = free_port()
+    runner = await api.serve(HOST, port)
+
+    flags = [flag for flag, on in (('--throttle', args.throttle), ('--telegram-limits', args.telegram_limits)) if on]
+    env = {**os.environ, 'BOT_API_URL': f"http://{HOST}:{port}", 'RUN_JOBS': "0"}
+    proc = await asyncio.create_subprocess_exec(sys.executable, str(Path(__file__).resolve()), '--bot', *flags, env=env)
+
+    try:
+        await asyncio.wait_for(api.polling.wait(), 60)
+        # Импорт и старт бота в замер CPU не входят
+        cpu_started = process_cpu(proc.pid)
+        report = await api.run(args.idle_timeout)
+        cpu = process_cpu(proc.pid) - cpu_started
+    finally:
+        if proc.returncode is None:
+            # Остановка как по Ctrl-C: бот дошлёт очередь и сохранит данные
+            proc.send_signal(signal.SIGINT)
+            await proc.wait()
+        await runner.cleanup()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    report['bot_cpu_sec'] = round(cpu, 2)
+    report['bot_cpu_us_per_update'] = round(cpu * 1e6 / max(report['acked'], 1), 1)
+    report['bot_max_rss_mb'] = round(usage.ru_maxrss / 1024, 1)
+
+    return {
+        'benchmark': 'e2e',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'chats': args.chats,
+        'users': args.users,
+        'latency_ms': args.latency,
+        'retry_rate': args.retry_rate,
+        'throttle': args.throttle,
+        'telegram_limits': args.telegram_limits,
+        **report
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--throttle', action='store_true', help="оставить антифлуд на входе")
+    parser.add_argument('--telegram-limits', action='store_true', help="оставить все боевые лимиты")
+    parser.add_argument('--output', help="куда записать JSON (по умолчанию — stdout)")
+    parser.add_argument('--bot', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bot:
+        run_bot(args)
+        return
+
+    report = asyncio.run(bench(args))
+    print(f"{report['updates_per_sec']:,.0f} upd/s из {args.rate:,.0f} | "
+          f"ответ p50 {report['reply_latency_ms'].get('p50', 0):.1f} ms, "
+          f"p99 {report['reply_latency_ms'].get('p99', 0):.1f} ms | "
+          f"CPU {report['bot_cpu_us_per_update']:.0f} µs/апдейт", file=sys.stderr)
+    if report['catch_up_sec'] is not None:
+        print(f"догон {report['backlog']:,} за {report['catch_up_sec']:.2f} с — "
+              f"{report['catch_up_per_sec']:,.0f} upd/s", file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Потоковый экспорт против сериализации всей таблицы при 10k / 100k / 1M пользователей.
+
+Для CSV и JSON Lines (gzip) — время, размер и пик памяти (tracemalloc).
+Строка «dump» — прежний способ: json.dumps всей таблицы в одну строку.
+Запуск: python benchmarks/bench_export.py [размеры...]
+"""
+import json
+import sys
+import tracemalloc
+from time import perf_counter
+
+from _common import bot, make_manager, make_users, parse_sizes
+
+
+def traced(func) -> tuple:
+    """(результат, мс, пик памяти в МБ); время — без tracemalloc, он замедляет в разы"""
+    started = perf_counter()
+    result = func()
+    elapsed = (perf_counter() - started) * 1000
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def stream(db, fmt: str) -> int:
+    return sum(len(chunk) for chunk in bot.export_chunks(bot.export_lines(db, fmt)))
+
+
+def dump(db) -> int:
+    data = json.dumps({str(uid): user.to_json() for uid, user in db.users.items()}, ensure_ascii=False)
+    return len(data.encode())
+
+
+def run(n: int):
+    db = make_manager(make_users(n))
+    for kind, func in (('csv', lambda: stream(db, 'csv')), ('jsonl', lambda: stream(db, 'jsonl')),
+                       ('dump', lambda: dump(db))):
+        size, elapsed, peak = traced(func)
+        print(f"{n:>9,} | {kind:>5} | {elapsed:>8.0f} | {size / 1024 / 1024:>7.1f} | {peak:>8.1f}")
+
+
+def main():
+    print(f"{'users':>9} | {'kind':>5} | {'ms':>8} | {'MB':>7} | {'peak MB':>8}")
+    for n in parse_sizes(sys.argv):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Ответ inline-режима (@bot top / @bot me) при 10k / 100k / 1M пользователей.
+
+«hit» — рейтинг не менялся, статьи берутся из кэша; «miss» — очки лидера
+изменились, статьи пересобираются; «build» — сборка статей на каждый
+запрос, как было бы без кэша. «me» — статья профиля при неизменных очках.
+Запуск: python benchmarks/bench_inline.py [размеры...]
+"""
+import random
+import sys
+from time import time
+
+from aiogram.types import User
+
+from _common import bot, make_users, make_manager, measure, parse_sizes
+
+
+def run(n: int):
+    users = make_users(n)
+    uids = [int(uid) for uid in users]
+    rnd = random.Random(7)
+    db = make_manager(users)
+    now = int(time())
+    for _ in range(n):
+        db._windows.add(rnd.choice(uids), rnd.randint(1, 3), now - rnd.randrange(30 * 86400))
+
+    hit_ms = measure(lambda: bot.get_inline_top(db), 2000)
+
+    leader = db.get_top_users(1)[0][0]
+
+    def changed():
+        db.track_command(leader)
+        return bot.get_inline_top(db)
+
+    miss_ms = measure(changed, 200)
+
+    def build():
+        limit = bot.config.MAX_TOP_USERS
+        boards = {None: [(uid, u, u.points) for uid, u in db.get_top_users(limit)]}
+        for window in bot.config.TOP_WINDOWS:
+            boards[window] = db.get_window_top(window, limit)
+        return bot._render_inline_top(boards)
+
+    build_ms = measure(build, 200)
+
+    me = [User(id=uid, is_bot=False, first_name="User") for uid in rnd.sample(uids, 100)]
+    for user in me:
+        bot.get_inline_profile(db, user)
+    me_ms = measure(lambda: bot.get_inline_profile(db, rnd.choice(me)), 2000)
+
+    print(f"{n:>9,} | {hit_ms:>8.4f} | {miss_ms:>8.3f} | {build_ms:>8.3f} | {me_ms:>8.4f}")
+
+
+def main():
+    print(f"{'users':>9} | {'hit ms':>8} | {'miss ms':>8} | {'build ms':>8} | {'me ms':>8}")
+    for n in parse_sizes(sys.argv):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Микробенчмарк поиска ключевых слов на типичном армяно-русско-латинском чате.
+
+Сравнивает прежнее пересечение set(text.split()) с KEYWORDS и
+скомпилированный KeywordMatcher: время на сообщение и число найденных
+совпадений (фразы и слова с пунктуацией старый способ пропускает).
+
+Сообщение без ключевых слов KeywordMatcher отсекает по кускам split(),
+уже встречавшимся в таких сообщениях, — дешевле прежнего lower() + set.
+NFKC, casefold и разбиение по границам слов достаются только сообщениям
+с новыми словами или с первым словом ключа (строка «без кэша слов» —
+худший случай, когда знакомых кусков нет вовсе).
+Запуск: python benchmarks/bench_keywords.py [число сообщений]
+"""
+import random
+import sys
+from time import perf_counter
+
+from _common import bot
+
+WORDS = [
+    'բարև', 'ինչպես', 'ես', 'խաղ', 'ընկեր', 'շատ', 'լավ', 'ով', 'գիտի', 'այսօր', 'վաղը', 'խաղանք',
+    'привет', 'кто', 'играет', 'сегодня', 'новая', 'игра', 'скидка', 'аккаунт', 'турецкий', 'как', 'дела',
+    'ok', 'gg', 'fifa', 'cod', 'ps5', 'online', 'lol', 'bro', 'ապեր', 'ախպեր', 'хаха', 'да', 'нет',
+]
+KEYWORD_SNIPPETS = [
+    'бот?', 'купить', 'ps plus', 'PS Plus-ը', 'топ!', 'ամենաակտիվ', 'haybot', 'psplus', 'Բոտ,', 'подписка?',
+]
+PUNCTUATION = ['', '', '', '?', '!', ',', '...', ')))']
+
+
+def make_corpus(n: int, seed: int = 11) -> list:
+    rnd = random.Random(seed)
+    corpus = []
+
+    for _ in range(n):
+        words = [rnd.choice(WORDS) + rnd.choice(PUNCTUATION) for _ in range(rnd.randint(1, 14))]
+        if rnd.random() < 0.15:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(KEYWORD_SNIPPETS))
+        text = ' '.join(words)
+        corpus.append(text.capitalize() if rnd.random() < 0.5 else text)
+
+    return corpus
+
+
+def legacy_match(text: str):
+    text_set = set(text.lower().split())
+    for key in ('top', 'buy', 'bot'):
+        if bot.KEYWORDS[key] & text_set:
+            return key
+    return None
+
+
+def run(corpus: list, name: str, match) -> None:
+    start = perf_counter()
+    hits = sum(1 for text in corpus if match(text))
+    elapsed = perf_counter() - start
+    print(f"{name:<16} | {elapsed * 1e6 / len(corpus):>8.2f} µs/msg | {hits:>7,} совпадений")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    corpus = make_corpus(n)
+
+    start = perf_counter()
+    matcher = bot.KeywordMatcher(bot.KEYWORDS, bot.KEYWORD_PRIORITY)
+    print(f"компиляция: {(perf_counter() - start) * 1000:.2f} мс, сообщений: {n:,}")
+
+    run(corpus, "set & KEYWORDS", legacy_match)
+    run(corpus, "KeywordMatcher", matcher.best)
+
+    # Худший случай: каждое слово сообщения матчер видит впервые
+    bot.config.KEYWORDS_CACHE_SIZE = 0
+    run(corpus, "без кэша слов", bot.KeywordMatcher(bot.KEYWORDS, bot.KEYWORD_PRIORITY).best)
+
+
+if __name__ == "__main__":
+    main()
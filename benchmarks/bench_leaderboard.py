@@ -0,0 +1,54 @@
+"""Задержка /top и /profile при 10k / 100k / 1M пользователей.
+
+Сравнивает индекс рейтинга с прежним подходом (полная сортировка
+и линейный поиск места). Запуск: python benchmarks/bench_leaderboard.py [размеры...]
+"""
+import random
+import sys
+from time import perf_counter
+
+from _common import bot, make_users, make_manager, measure, parse_sizes
+
+
+def legacy_top(users: dict, limit: int) -> list:
+    return sorted(users.items(), key=lambda x: x[1]['points'], reverse=True)[:limit]
+
+
+def legacy_rank(users: dict, uid: str) -> int:
+    ranked = sorted(users.items(), key=lambda x: x[1]['points'], reverse=True)
+    for i, (user_id, _) in enumerate(ranked, 1):
+        if user_id == uid:
+            return i
+
+
+def run(n: int):
+    users = make_users(n)
+    uids = list(users)
+    rnd = random.Random(7)
+
+    start = perf_counter()
+    db = make_manager(users)
+    build_ms = (perf_counter() - start) * 1000
+
+    # Мимо кэша экранов — меряем саму отрисовку
+    top_ms = measure(lambda: bot._render_top(db), 200)
+    profile_ms = measure(lambda: bot._render_profile(db, int(rnd.choice(uids))), 200)
+    command_ms = measure(lambda: db.track_command(int(rnd.choice(uids))), 2000)
+
+    legacy_repeat = max(1, 100_000 // n)
+    legacy_top_ms = measure(lambda: legacy_top(users, bot.config.MAX_TOP_USERS), legacy_repeat)
+    legacy_rank_ms = measure(lambda: legacy_rank(users, rnd.choice(uids)), legacy_repeat)
+
+    print(f"{n:>9,} | {build_ms:>9.1f} | {top_ms:>8.3f} | {profile_ms:>10.3f} | "
+          f"{command_ms:>9.4f} | {legacy_top_ms:>10.1f} | {legacy_rank_ms:>11.1f}")
+
+
+def main():
+    print(f"{'users':>9} | {'build ms':>9} | {'/top ms':>8} | {'/profile ms':>10} | "
+          f"{'track ms':>9} | {'old top ms':>10} | {'old rank ms':>11}")
+    for n in parse_sizes(sys.argv):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Пропускная способность конвейера апдейтов: middleware, обработчики, callbacks.
+
+Синтетические Message и CallbackQuery в реалистичной пропорции проходят
+через dp.feed_update с сессией-заглушкой, которая записывает вызовы
+Bot API вместо отправки. Лимиты сняты — меряется стоимость обработки,
+а не ожидание бакетов (--throttle оставляет боевой антифлуд на входе).
+Результат — JSON для сравнения между версиями.
+
+Запуск: python benchmarks/bench_pipeline.py [размеры...] [--updates N] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+from datetime import datetime
+from time import perf_counter
+
+import aiogram
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from _common import ROOT, StubSession, bot, make_manager, make_users
+from mock_api import CALLBACKS, COMMANDS, KEYWORD_TEXTS, MIX, TEXTS, percentiles
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+GROUP_ID = -1001000000000
+
+
+def make_updates(uids: list, count: int, seed: int = 1) -> list:
+    """Готовые Update заранее — построение pydantic-моделей не входит в замер"""
+    rnd = random.Random(seed)
+    kinds, weights = zip(*MIX.items())
+    chat = Chat(id=GROUP_ID, type='supergroup')
+    users = {}
+    updates = []
+
+    for update_id in range(1, count + 1):
+        uid = rnd.choice(uids)
+        user = users.get(uid) or users.setdefault(uid, User(id=uid, is_bot=False, first_name=f"User{uid}"))
+        kind = rnd.choices(kinds, weights)[0]
+
+        if kind == 'callback':
+            # Сообщения с клавиатурой — из небольшого пула, как живые экраны в чате
+            message = Message(message_id=rnd.randint(1, 500), date=datetime.now(), chat=chat, text="…")
+            updates.append((kind, Update(update_id=update_id, callback_query=CallbackQuery(
+                id=str(update_id), from_user=user, chat_instance="bench",
+                data=rnd.choice(CALLBACKS), message=message))))
+            continue
+
+        text = {'text': TEXTS, 'keyword': KEYWORD_TEXTS, 'command': COMMANDS}[kind]
+        updates.append((kind, Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), chat=chat, from_user=user,
+            text=rnd.choice(text)))))
+
+    # Как при polling: апдейт уже привязан к боту, иначе feed_update пересобирает его через dump
+    return [(kind, Update.model_validate(update.model_dump(), context={"bot": bot.bot}))
+            for kind, update in updates]
+
+
+def lift_limits(throttle: bool):
+    """Снимает лимиты, пересоздавая объекты из Config.
+
+    Лимиты исходящей очереди снимаются всегда — иначе замер упирается в
+    20 сообщений в минуту на группу. Антифлуд на входе — только без --throttle.
+    """
+    unlimited = (1e9, 1e9)
+    bot.config.OUTBOX_GLOBAL_LIMIT = bot.config.OUTBOX_GROUP_LIMIT = bot.config.OUTBOX_PRIVATE_LIMIT = unlimited
+    bot.outbox = bot.Outbox()
+
+    if not throttle:
+        bot.config.RATE_LIMITS_USER = {kind: unlimited for kind in bot.config.RATE_LIMITS_USER}
+        bot.config.RATE_LIMITS_CHAT = {kind: unlimited for kind in bot.config.RATE_LIMITS_CHAT}
+        bot.rate_limit = bot.RateLimitMiddleware()
+        bot.keyword_replies = bot.RateLimiter(1e9, 1e9)
+
+
+async def run(n: int, count: int) -> dict:
+    users = make_users(n)
+    bot.open_chats().loaded[GROUP_ID] = make_manager(users, GROUP_ID)
+    bot.screens = bot.RenderCache(bot.config.RENDER_CACHE_SIZE)
+    bot.ingest = bot.Ingest()
+    session = bot.bot.session = StubSession()
+
+    updates = make_updates([int(uid) for uid in users], count)
+    feed = bot.dp.feed_update
+    tg_bot = bot.bot
+
+    # Прогрев: ленивые структуры aiogram, кэш клавиатур
+    for _, update in updates[:200]:
+        await feed(tg_bot, update)
+
+    rejected = dict(bot.rate_limit.rejected)
+    latency = {kind: [] for kind in MIX}
+    start = perf_counter()
+    for kind, update in updates:
+        began = perf_counter()
+        await feed(tg_bot, update)
+        latency[kind].append(perf_counter() - began)
+    # Остаток очереди трекинга — тоже часть работы
+    bot.ingest.flush()
+    elapsed = perf_counter() - start
+
+    total = [sample for samples in latency.values() for sample in samples]
+    return {
+        'users': n,
+        'updates': count,
+        'updates_per_sec': round(count / elapsed, 1),
+        'latency_ms': percentiles(total),
+        'by_kind': {kind: {'count': len(samples), **percentiles(samples)}
+                    for kind, samples in latency.items() if samples},
+        'api_calls': len(session.calls),
+        'throttled': {kind: count - rejected[kind] for kind, count in bot.rate_limit.rejected.items()},
+        'render_cache': bot.screens.stats,
+        'ingest': {'applied': bot.ingest.applied, 'batches': bot.ingest.batches, 'dropped': bot.ingest.dropped}
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def bench(sizes: tuple, count: int, throttle: bool) -> dict:
+    # Строка лога aiogram на каждый апдейт заглушила бы всё остальное
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    lift_limits(throttle)
+    bot.setup_dispatcher()
+
+    results = []
+    for n in sizes:
+        result = await run(n, count)
+        print(f"{n:>9,} users | {result['updates_per_sec']:>9,.0f} upd/s | "
+              f"p50 {result['latency_ms']['p50']:.3f} ms | p95 {result['latency_ms']['p95']:.3f} ms | "
+              f"p99 {result['latency_ms']['p99']:.3f} ms")
+        results.append(result)
+
+    return {
+        'benchmark': 'pipeline',
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'aiogram': aiogram.__version__,
+        'throttle': throttle,
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--updates', type=int, default=20_000)
+    parser.add_argument('--output', help="куда записать JSON (по умолчанию — stdout)")
+    parser.add_argument('--throttle', action='store_true', help="оставить боевые лимиты")
+    args = parser.parse_args()
+
+    report = asyncio.run(bench(tuple(args.sizes), args.updates, args.throttle))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Память на пользователя и CPU на сообщение: dict с ISO-строками против UserRecord.
+
+Прежнее представление — словарь из users.json как есть (ключи-строки,
+ISO-даты), его track_message и get_active_count воспроизведены ниже.
+«rec» — то же изменение строки на UserRecord, сравнивать с «dict» стоит его.
+«track» — полный FastDataManager.track_message: правила начисления, рейтинг,
+окна за период, индекс активности и учёт изменений для журнала; прежний
+путь этого не делал, поэтому он дороже «dict».
+Запуск: python benchmarks/bench_records.py [размеры...]
+"""
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import time
+
+from _common import bot, make_users, make_manager, measure, parse_sizes
+
+
+def legacy_track_message(users: dict, user_cache: dict, user_id: int, username: str, first_name: str):
+    uid = str(user_id)
+    user = user_cache.get(uid) or users[uid]
+    user_cache[uid] = user
+    user['messages'] += 1
+    user['last_active'] = datetime.now().isoformat()
+    if username and not user['username']:
+        user['username'] = username
+    if first_name and not user['name']:
+        user['name'] = first_name
+    if user['messages'] % 10 == 0:
+        user['points'] += bot.config.POINTS_PER_10_MESSAGES
+
+
+def record_track_message(users: dict, user_id: int, username: str, first_name: str):
+    user = users[user_id]
+    user.messages += 1
+    user.last_active = int(time())
+    if username and not user.username:
+        user.username = username
+    if first_name and not user.name:
+        user.name = sys.intern(first_name)
+    if user.messages % 10 == 0:
+        user.points += bot.config.POINTS_PER_10_MESSAGES
+
+
+def legacy_active_count(users: dict, days: int) -> int:
+    threshold = datetime.now() - timedelta(days=days)
+    return sum(1 for u in users.values() if datetime.fromisoformat(u['last_active']) >= threshold)
+
+
+def record_active_count(users: dict, days: int) -> int:
+    threshold = int((datetime.now() - timedelta(days=days)).timestamp())
+    return sum(1 for u in users.values() if u.last_active >= threshold)
+
+
+def allocated(build) -> tuple:
+    """Результат build() и сколько байт он занял"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def run(n: int):
+    raw = make_users(n)
+    text = json.dumps(raw, ensure_ascii=False)
+
+    # Обе таблицы строятся из того же users.json, как при загрузке
+    legacy, legacy_bytes = allocated(lambda: json.loads(text))
+    records, record_bytes = allocated(
+        lambda: {int(uid): bot.UserRecord.from_json(u) for uid, u in json.loads(text).items()}
+    )
+
+    manager = make_manager(raw)
+    ids = [int(uid) for uid in raw]
+    rnd = random.Random(3)
+    cache = {}
+
+    legacy_us = measure(lambda: legacy_track_message(legacy, cache, rnd.choice(ids), "nick", "Name"), 50_000) * 1000
+    record_us = measure(lambda: record_track_message(records, rnd.choice(ids), "nick", "Name"), 50_000) * 1000
+    track_us = measure(lambda: manager.track_message(rnd.choice(ids), "nick", "Name"), 50_000) * 1000
+
+    legacy_scan = measure(lambda: legacy_active_count(legacy, 7), 3)
+    record_scan = measure(lambda: record_active_count(manager.users, 7), 3)
+
+    print(f"{n:>9,} | {legacy_bytes / n:>9.0f} | {record_bytes / n:>10.0f} | "
+          f"{legacy_us:>10.2f} | {record_us:>10.2f} | {track_us:>12.2f} | {legacy_scan:>10.1f} | {record_scan:>10.1f}")
+    del records
+
+
+def main():
+    print(f"{'users':>9} | {'dict B/u':>9} | {'record B/u':>10} | {'dict µs/msg':>10} | "
+          f"{'rec µs/msg':>10} | {'track µs/msg':>12} | {'dict scan ms':>10} | {'rec scan ms':>10}")
+    for n in parse_sizes(sys.argv) if len(sys.argv) > 1 else (10_000, 100_000):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
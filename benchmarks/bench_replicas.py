@@ -0,0 +1,141 @@
+"""Несколько реплик бота над одной папкой данных: скорость и сходимость.
+
+Каждая реплика — отдельный процесс со своим REPLICA_ID. Все стартуют с
+общего снимка, порциями учитывают сообщения и команды (часть — новых
+пользователей), пишут свой вклад и сливают чужие. В конце каждая
+сливает всё ещё раз, и их объединённые виды сравниваются между собой,
+с ожидаемыми суммами и с результатом merge-replicas.
+
+Запуск: python benchmarks/bench_replicas.py [--replicas N] [--users N] [--ops N] [--binary]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+from pathlib import Path
+from time import perf_counter
+
+CHAT_ID = -1001000000000
+ROUNDS = 20
+
+
+def view(manager) -> dict:
+    """Объединённый вид раздела: суммы, топы и места — то, что видят пользователи"""
+    from _common import bot
+    users = dict(manager.users.items())
+    return {
+        'users': len(users),
+        'messages': sum(u.messages for u in users.values()),
+        'commands': sum(u.commands for u in users.values()),
+        'points': sum(u.points for u in users.values()),
+        'total_messages': manager.state['total_messages'],
+        # Порядок равных очков зависит от порядка слияния — сравниваем сами очки
+        'top': [u.points for _, u in manager.get_top_users(10)],
+        'windows': {name: [points for _, _, points in manager.get_window_top(name, 10)]
+                    for name in bot.config.TOP_WINDOWS},
+        'ranks': [manager.get_user_rank(uid) for uid in sorted(users)[:100]]
+    }
+
+
+def replica(index: int, root: str, ops: int, base_uids: list, snapshot_format: str, barrier, results):
+    os.environ['REPLICA_ID'] = f"r{index}"
+    from _common import bot
+    bot.config.SNAPSHOT_FORMAT = snapshot_format
+
+    async def run():
+        manager = bot.FastDataManager(CHAT_ID, Path(root))
+        await manager.load()
+
+        rnd = random.Random(index)
+        new_uids = range(900_000_000 + index * 1_000_000, 900_000_000 + index * 1_000_000 + ops // 20)
+        counts = {'messages': 0, 'commands': 0}
+        busy = 0.0
+
+        for _ in range(ROUNDS):
+            started = perf_counter()
+            for _ in range(ops // ROUNDS):
+                uid = rnd.choice(base_uids) if rnd.random() < 0.8 else rnd.choice(new_uids)
+                if rnd.random() < 0.9:
+                    manager.track_message(uid, f"u{uid}", f"User{uid}")
+                    counts['messages'] += 1
+                else:
+                    manager.track_command(uid)
+                    counts['commands'] += 1
+            busy += perf_counter() - started
+
+            await manager.save_all()
+            await manager.merge_replicas()
+
+        # Все дописали свои вклады — последнее слияние видит всех
+        await asyncio.to_thread(barrier.wait)
+        await manager.merge_replicas()
+        results.put((index, counts, busy, view(manager)))
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--ops', type=int, default=50_000, help="операций на реплику")
+    parser.add_argument('--binary', action='store_true', help="общий снимок в users.bin")
+    args = parser.parse_args()
+
+    from _common import DATA_DIR, bot, make_manager, make_users
+
+    root = Path(DATA_DIR) / bot.config.CHATS_DIR / str(CHAT_ID)
+    root.mkdir(parents=True, exist_ok=True)
+    users = make_users(args.users)
+    base_uids = [int(uid) for uid in users]
+    snapshot_format = "binary" if args.binary else "json"
+    bot.config.SNAPSHOT_FORMAT = snapshot_format
+
+    if args.binary:
+        manager = make_manager(users)
+        manager._cow = {}
+        bot.BinarySnapshot.write(str(root / bot.config.SNAPSHOT_FILE),
+                                 manager._snapshot_rows(None, manager.users, ordered=True))
+    else:
+        (root / bot.config.USERS_FILE).write_text(json.dumps(users, ensure_ascii=False), encoding='utf-8')
+
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.replicas)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=replica, args=(i, str(root), args.ops, base_uids, snapshot_format, barrier, results))
+             for i in range(args.replicas)]
+    for proc in procs:
+        proc.start()
+    reports = sorted(results.get() for _ in procs)
+    for proc in procs:
+        proc.join()
+
+    expected_messages = sum(u['messages'] for u in users.values()) + sum(r[1]['messages'] for r in reports)
+    expected_commands = sum(u['commands'] for u in users.values()) + sum(r[1]['commands'] for r in reports)
+
+    print(f"{'replica':>7} | {'ops/s':>9} | {'users':>7} | {'messages':>9} | {'commands':>8} | {'points':>8}")
+    for index, counts, busy, merged in reports:
+        ops = counts['messages'] + counts['commands']
+        print(f"{'r' + str(index):>7} | {ops / busy:>9,.0f} | {merged['users']:>7} | {merged['messages']:>9} | "
+              f"{merged['commands']:>8} | {merged['points']:>8}")
+
+    views = [r[3] for r in reports]
+    converged = all(v == views[0] for v in views)
+    exact = views[0]['messages'] == expected_messages and views[0]['commands'] == expected_commands
+
+    # Свёртка вкладов в снимок даёт тот же вид
+    bot.open_chats().root = root.parent
+    bot.merge_replica_files()
+    folded = bot.FastDataManager(CHAT_ID, root)
+    folded._load_all()
+    compacted = view(folded) == views[0]
+
+    print(f"\nожидалось сообщений {expected_messages}, команд {expected_commands}")
+    print(f"реплики сошлись: {converged}, суммы точные: {exact}, merge-replicas совпал: {compacted}, "
+          f"файлов вкладов осталось: {len(list((root / bot.ReplicaLog.DIR).glob('*')))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Состав группы: входы, выходы и строки /stats при 10k / 100k / 1M участников.
+
+Входы раскиданы по последним 180 дням, четверть вошедших потом вышла.
+Сравнивает счётчики состава (число участников, отток и удержание за 30
+дней) с подсчётом тех же чисел обходом всех участников.
+Запуск: python benchmarks/bench_roster.py [размеры...]
+"""
+import random
+import sys
+from datetime import date
+from time import perf_counter
+
+from _common import bot, measure, parse_sizes
+
+PERIOD = 30
+
+
+def naive(members: dict, today: int) -> tuple:
+    """То же обходом: участник → (день входа, день выхода или 0)"""
+    first = today - PERIOD + 1
+    present = joins = leaves = joined = remaining = 0
+    for joined_day, left_day in members.values():
+        present += not left_day
+        joins += joined_day >= first
+        leaves += left_day >= first
+        if joined_day >= first - 6:
+            joined += 1
+            remaining += not left_day
+    start = present - joins + leaves
+    return present, leaves / start if start else 0.0, remaining / joined if joined else None
+
+
+def run(n: int):
+    rnd = random.Random(7)
+    today = date.today().toordinal()
+    events = []
+    for uid in range(n):
+        joined = today - rnd.randrange(180)
+        events.append((joined, 'join', uid))
+        if rnd.random() < 0.25:
+            events.append((min(joined + int(rnd.expovariate(1 / 20)), today), 'leave', uid))
+    events.sort()
+
+    roster = bot.MemberRoster()
+    members = {}
+    start = perf_counter()
+    for day, kind, uid in events:
+        if kind == 'join':
+            roster.join(uid, day)
+        else:
+            roster.leave(uid, day)
+    event_us = (perf_counter() - start) * 1e6 / len(events)
+    roster.sync(roster.count or 0, 0)
+
+    for day, kind, uid in events:
+        members[uid] = (day, 0) if kind == 'join' else (members[uid][0], day)
+
+    def stats():
+        return roster.count, roster.churn(PERIOD, today), roster.retention(PERIOD, today)
+
+    stats_ms = measure(stats, 2000)
+    naive_ms = measure(lambda: naive(members, today), max(1, 100_000 // n))
+
+    print(f"{n:>9,} | {event_us:>9.2f} | {stats_ms:>9.4f} | {naive_ms:>9.1f}")
+
+
+def main():
+    print(f"{'members':>9} | {'event us':>9} | {'stats ms':>9} | {'scan ms':>9}")
+    for n in parse_sizes(sys.argv):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
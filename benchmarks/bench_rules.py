@@ -0,0 +1,90 @@
+"""Правила начисления очков на сообщение при 10k / 100k / 1M пользователей.
+
+Поток: 70% текста, 20% медиа, 10% ответов, авторы — случайные.
+«legacy» — прежний жёсткий путь: проверка текста в middleware и очки за
+пройденный десяток. «default» — правила по умолчанию (то же начисление),
+«full» — три вида сообщений, потолок и пауза. Состояния правил ограничены
+POINTS_STATE_MAX_KEYS: при 1M авторов они вытесняются и создаются заново.
+Запуск: python benchmarks/bench_rules.py [размеры...]
+"""
+import random
+import sys
+from datetime import datetime
+from time import perf_counter, time
+
+from aiogram.types import Chat, Message, PhotoSize, User
+
+from _common import bot, make_users, make_manager, parse_sizes
+
+EVENTS = 300_000
+FULL = {
+    'messages': {'text': {'points': 1, 'every': 10}, 'media': {'points': 1, 'every': 3},
+                 'reply': {'points': 1, 'every': 2}},
+    'commands': {'default': 2, 'start': 0},
+    'limits': {'message': {'cooldown': 10, 'cap': 50}, 'command': {'cooldown': 60, 'cap': 20}}
+}
+
+
+def make_messages() -> list:
+    chat = Chat(id=0, type='supergroup')
+    author = User(id=1, is_bot=False, first_name="User")
+    photo = [PhotoSize(file_id="x", file_unique_id="x", width=1, height=1)]
+    original = Message(message_id=1, date=datetime.now(), chat=chat, text="hi")
+    return ([Message(message_id=2, date=datetime.now(), chat=chat, from_user=author, text="hello")] * 7
+            + [Message(message_id=3, date=datetime.now(), chat=chat, from_user=author, photo=photo)] * 2
+            + [Message(message_id=4, date=datetime.now(), chat=chat, from_user=author, text="yes",
+                       reply_to_message=original)])
+
+
+def legacy(messages: dict, message: Message, uid: int) -> int:
+    """Прежний путь: только текст без «/», очки за каждый пройденный десяток"""
+    text = message.text
+    if text and not text.startswith('/'):
+        before = messages[uid]
+        messages[uid] = before + 1
+        return ((before + 1) // 10 - before // 10) * bot.config.POINTS_PER_10_MESSAGES
+    return 0
+
+
+def evaluate(rules: 'bot.PointsRules', db, message: Message, uid: int, now: int) -> int:
+    kind = rules.kind(message)
+    return rules.message(db, uid, kind, now) if kind is not None else 0
+
+
+def per_message(func, events: list) -> float:
+    start = perf_counter()
+    for message, uid in events:
+        func(message, uid)
+    return (perf_counter() - start) * 1e6 / len(events)
+
+
+def run(n: int):
+    users = make_users(n)
+    uids = [int(uid) for uid in users]
+    db = make_manager(users)
+    rnd = random.Random(7)
+    pool = make_messages()
+    events = [(rnd.choice(pool), rnd.choice(uids)) for _ in range(EVENTS)]
+    now = int(time())
+
+    messages = {uid: user.messages for uid, user in db.users.items()}
+    legacy_us = per_message(lambda m, uid: legacy(messages, m, uid), events)
+
+    default = bot.PointsRules({})
+    default_us = per_message(lambda m, uid: evaluate(default, db, m, uid, now), events)
+
+    full = bot.PointsRules(FULL)
+    full_us = per_message(lambda m, uid: evaluate(full, db, m, uid, now), events)
+    states = len(full._states[db.chat_id])
+
+    print(f"{n:>9,} | {legacy_us:>9.3f} | {default_us:>10.3f} | {full_us:>9.3f} | {states:>8,}")
+
+
+def main():
+    print(f"{'users':>9} | {'legacy us':>9} | {'default us':>10} | {'full us':>9} | {'states':>8}")
+    for n in parse_sizes(sys.argv):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Время старта раздела чата от числа пользователей: users.json против users.bin.
+
+Для каждого формата — когда раздел может отвечать (таблица пользователей
+готова), когда готовы индексы рейтинга и активности и насколько при этом
+замирал цикл событий (самая длинная пауза тикера с шагом 1 мс).
+Строка «sync» — прежняя загрузка целиком в цикле, как было при импорте.
+
+Запуск: python benchmarks/bench_startup.py [размеры...]
+"""
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from time import perf_counter
+
+from _common import DATA_DIR, bot, make_manager, make_users, parse_sizes
+
+
+async def ticker(stalls: list):
+    """Самая длинная пауза между тиками — сколько цикл не мог обслуживать апдейты"""
+    last = perf_counter()
+    while True:
+        await asyncio.sleep(0.001)
+        now = perf_counter()
+        stalls[0] = max(stalls[0], now - last)
+        last = now
+
+
+async def load(root: Path) -> dict:
+    manager = bot.FastDataManager(0, root)
+    marks = {}
+    stalls = [0.0]
+    tick = asyncio.create_task(ticker(stalls))
+    await asyncio.sleep(0.01)
+    stalls[0] = 0.0
+
+    started = perf_counter()
+    manager.start_loading()
+    for part in manager.READY_PARTS:
+        await manager.wait_ready(part)
+        marks[part] = (perf_counter() - started) * 1000
+
+    await manager._loader
+    tick.cancel()
+    manager.close()
+    return {**marks, 'stall': stalls[0] * 1000}
+
+
+def load_sync(root: Path) -> dict:
+    manager = bot.FastDataManager(0, root)
+    started = perf_counter()
+    manager._load_all()
+    elapsed = (perf_counter() - started) * 1000
+    return {'users': elapsed, 'leaderboard': elapsed, 'activity': elapsed, 'stall': elapsed}
+
+
+def report(n: int, kind: str, size: int, marks: dict):
+    print(f"{n:>9,} | {kind:>6} | {size / 1024 / 1024:>7.1f} | {marks['users']:>9.0f} | "
+          f"{marks['leaderboard']:>9.0f} | {marks['activity']:>9.0f} | {marks['stall']:>9.1f}")
+
+
+async def run(n: int):
+    root = Path(DATA_DIR) / f"startup-{n}"
+    root.mkdir(exist_ok=True)
+    users = make_users(n)
+
+    json_file = root / bot.config.USERS_FILE
+    json_file.write_text(json.dumps(users, ensure_ascii=False), encoding='utf-8')
+    bot.config.SNAPSHOT_FORMAT = "json"
+    report(n, 'sync', json_file.stat().st_size, load_sync(root))
+    report(n, 'json', json_file.stat().st_size, await load(root))
+
+    manager = make_manager(users)
+    manager._cow = {}
+    bin_file = root / bot.config.SNAPSHOT_FILE
+    bot.BinarySnapshot.write(str(bin_file), manager._snapshot_rows(None, manager.users, ordered=True))
+    os.remove(json_file)
+    bot.config.SNAPSHOT_FORMAT = "binary"
+    report(n, 'binary', bin_file.stat().st_size, await load(root))
+
+
+def main():
+    print(f"{'users':>9} | {'format':>6} | {'MB':>7} | {'users ms':>9} | {'top ms':>9} | "
+          f"{'active ms':>9} | {'stall ms':>9}")
+    for n in parse_sizes(sys.argv):
+        asyncio.run(run(n))
+
+
+if __name__ == "__main__":
+    main()
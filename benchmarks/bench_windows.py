@@ -0,0 +1,59 @@
+"""Рейтинги за период (сегодня / 7 / 30 дней) при 10k / 100k / 1M пользователей.
+
+Очки раскиданы по последним 30 дням. Сравнивает индексы окон с подсчётом
+сумм по дням для каждого пользователя и сортировкой, а также меряет смену
+суток — вычитание выпавшего из окон дня.
+Запуск: python benchmarks/bench_windows.py [размеры...]
+"""
+import random
+import sys
+from time import perf_counter, time
+
+from _common import bot, make_users, make_manager, measure, parse_sizes
+
+DAY = 86400
+
+
+def naive_top(days: dict, first_day: int, limit: int) -> list:
+    totals = {}
+    for day, points in days.items():
+        if day >= first_day:
+            for uid, value in points.items():
+                totals[uid] = totals.get(uid, 0) + value
+    return sorted(totals.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+
+def run(n: int):
+    users = make_users(n)
+    uids = [int(uid) for uid in users]
+    rnd = random.Random(7)
+    db = make_manager(users)
+    windows = db._windows
+    now = int(time())
+
+    start = perf_counter()
+    awards = n * 3
+    for _ in range(awards):
+        windows.add(rnd.choice(uids), rnd.randint(1, 3), now - int(rnd.expovariate(1 / 8) * DAY) % (30 * DAY))
+    award_us = (perf_counter() - start) * 1e6 / awards
+
+    week_ms = measure(lambda: bot._render_top(db, 'week'), 200)
+    rank_ms = measure(lambda: db.get_window_rank('month', rnd.choice(uids)), 2000)
+    naive_repeat = max(1, 100_000 // n)
+    naive_ms = measure(lambda: naive_top(windows._days, windows._today - 6, bot.config.MAX_TOP_USERS), naive_repeat)
+
+    start = perf_counter()
+    windows._roll(windows._today_end)
+    roll_ms = (perf_counter() - start) * 1000
+
+    print(f"{n:>9,} | {award_us:>9.2f} | {week_ms:>8.3f} | {rank_ms:>8.4f} | {roll_ms:>8.1f} | {naive_ms:>9.1f}")
+
+
+def main():
+    print(f"{'users':>9} | {'award us':>9} | {'week ms':>8} | {'rank ms':>8} | {'roll ms':>8} | {'scan ms':>9}")
+    for n in parse_sizes(sys.argv):
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных прогонов бота целиком.
+
+Бот направляется на неё переменной BOT_API_URL. getUpdates раздаёт
+сценарный поток апдейтов с заданной частотой (текст, ключевые слова,
+команды и callbacks в нескольких группах), sendMessage, editMessageText,
+answerCallbackQuery и прочие вызовы принимаются и сопоставляются с
+апдейтами, которые ждут ответа. По желанию — задержка на каждый вызов
+и доля ответов 429 с retry_after.
+
+Сопоставление: ответ на ключевое слово приходит reply на исходное
+сообщение, callback — правкой его сообщения или answerCallbackQuery,
+команда — sendMessage в тот же чат (по порядку внутри чата; точно, пока
+антифлуд на входе не отбрасывает команды).
+
+--backlog N кладёт в очередь до старта бота N сообщений, отправленных
+--backlog-age секунд назад, — очередь простоя, которую бот догоняет без
+ответов; в отчёте время и скорость догона.
+
+Отдельно: python benchmarks/mock_api.py [--port N] [--rate N] [--updates N] ...
+и затем BOT_API_URL=http://127.0.0.1:N python bot.py. Сквозной замер
+с запуском бота — benchmarks/bench_e2e.py.
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import deque
+from itertools import islice
+from time import monotonic, time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+# Доли апдейтов в потоке группы
+MIX = {
+    'text': 0.76,
+    'keyword': 0.06,
+    'command': 0.08,
+    'callback': 0.10
+}
+TEXTS = ["բարև բոլորին", "ok", "ինչ խաղ եք խաղում?", "👍", "кто сегодня онлайн", "gg wp"]
+KEYWORD_TEXTS = ["ps plus ունի՞ք", "где купить подписку", "кто в топе?", "бот, ты тут?"]
+COMMANDS = ["/top", "/profile", "/stats", "/start", "/buy"]
+CALLBACKS = ["top", "stats", "profile", "back", "buy"]
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': "Mock", 'username': "mock_bot"}
+FIRST_CHAT_ID = -1001000000000
+
+
+def percentiles(samples: list) -> dict:
+    """p50/p95/p99 в миллисекундах по выборке в секундах"""
+    samples = sorted(samples)
+    last = len(samples) - 1
+    if last < 0:
+        return {}
+    return {f"p{q}": round(samples[round(last * q / 100)] * 1000, 4) for q in (50, 95, 99)}
+
+
+class UpdateStream:
+    """Сценарный поток: count апдейтов с частотой rate в секунду по chats группам"""
+
+    def __init__(self, rate: float, count: int, chats: int = 100, users: int = 10_000, seed: int = 1):
+        self.rate = rate
+        self.count = count
+        self.chat_ids = [FIRST_CHAT_ID - i for i in range(chats)]
+        self.users = [{'id': 100_000_000 + i, 'is_bot': False, 'first_name': f"User{i}"} for i in range(users)]
+        self._rnd = random.Random(seed)
+        self._kinds, self._weights = zip(*MIX.items())
+
+    def make(self, update_id: int) -> tuple:
+        """(вид, апдейт в JSON Bot API)"""
+        rnd = self._rnd
+        kind = rnd.choices(self._kinds, self._weights)[0]
+        chat = {'id': rnd.choice(self.chat_ids), 'type': 'supergroup', 'title': "Mock"}
+        user = rnd.choice(self.users)
+        now = int(time())
+
+        if kind == 'callback':
+            # Сообщения с клавиатурой — из небольшого пула на чат, как живые экраны
+            message = {'message_id': rnd.randint(1, 500), 'date': now, 'chat': chat, 'text': "…"}
+            return kind, {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'from': user, 'chat_instance': "mock",
+                'data': rnd.choice(CALLBACKS), 'message': message}}
+
+        text = rnd.choice({'text': TEXTS, 'keyword': KEYWORD_TEXTS, 'command': COMMANDS}[kind])
+        message = {'message_id': update_id, 'date': now, 'chat': chat, 'from': user, 'text': text}
+        if kind == 'command':
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return kind, {'update_id': update_id, 'message': message}
+
+
+class MockBotAPI:
+    """Сервер Bot API в памяти: очередь getUpdates, приём ответов, сбор задержек"""
+
+    # Вызовы, которым может достаться инъекция 429
+    LIMITED = {'sendMessage', 'editMessageText', 'sendDocument'}
+
+    def __init__(self, stream: Optional[UpdateStream] = None, latency: float = 0.0,
+                 retry_rate: float = 0.0, retry_after: int = 1, seed: int = 2):
+        self.stream = stream
+        self.latency = latency
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self._rnd = random.Random(seed)
+        self.methods = {
+            'getMe': self.get_me,
+            'getUpdates': self.get_updates,
+            'sendMessage': self.send_message,
+            'editMessageText': self.edit_message_text,
+            'answerCallbackQuery': self.answer_callback_query,
+            'getChatMember': self.get_chat_member
+        }
+
+        # (update_id, апдейт, когда появился); подтверждённые offset'ом снимаются с головы
+        self.updates: deque = deque()
+        self.update_id = 0
+        self.message_id = 0
+        self._new = asyncio.Event()
+        self.polling = asyncio.Event()
+        self._delivered_id = 0
+        self._polling_since = 0.0
+        self.backlog = 0
+        self.caught_up: Optional[float] = None
+
+        # Апдейты, ждущие ответа
+        self._commands: Dict[int, deque] = {}
+        self._keywords: Dict[tuple, float] = {}
+        self._callbacks: Dict[str, float] = {}
+        self._screens: Dict[tuple, deque] = {}
+
+        self.calls: Dict[str, int] = {}
+        self.expected: Dict[str, int] = dict.fromkeys(MIX, 0)
+        self.replies: Dict[str, list] = {'command': [], 'keyword': [], 'callback': []}
+        self.delivery: list = []
+        self.produced = 0
+        self.acked = 0
+        self.injected = 0
+        self.unmatched = 0
+        self.max_backlog = 0
+
+    # ---------- сервер ----------
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post()) if request.can_read_body else {}
+
+        if method != 'getUpdates':
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if method in self.LIMITED and self._rnd.random() < self.retry_rate:
+                self.injected += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after}
+                }, status=429)
+
+        handler = self.methods.get(method)
+        result = await handler(params) if handler else True
+        return web.json_response({'ok': True, 'result': result})
+
+    # ---------- поток апдейтов ----------
+
+    def push(self, kind: str, update: dict):
+        created = monotonic()
+        self.updates.append((update['update_id'], update, created))
+        self.expected[kind] += 1
+        self.produced += 1
+
+        if kind == 'command':
+            chat_id = update['message']['chat']['id']
+            self._commands.setdefault(chat_id, deque()).append(created)
+        elif kind == 'keyword':
+            message = update['message']
+            self._keywords[(message['chat']['id'], message['message_id'])] = created
+        elif kind == 'callback':
+            query = update['callback_query']
+            self._callbacks[query['id']] = created
+            key = (query['message']['chat']['id'], query['message']['message_id'])
+            self._screens.setdefault(key, deque()).append(query['id'])
+
+    def preload(self, count: int, age: float):
+        """Очередь простоя: только сообщения (callbacks из неё бессмысленны), ответа на них не ждём"""
+        created = monotonic()
+        while self.backlog < count:
+            kind, update = self.stream.make(self.update_id + 1)
+            if kind == 'callback':
+                continue
+            self.update_id += 1
+            update['message']['date'] -= int(age)
+            self.updates.append((self.update_id, update, created))
+            self.backlog += 1
+
+    async def produce(self):
+        """Выдаёт поток с постоянной частотой, не дожидаясь, успевает ли бот"""
+        stream = self.stream
+        started = monotonic()
+
+        while self.produced < stream.count:
+            due = min(int((monotonic() - started) * stream.rate) + 1, stream.count)
+            while self.produced < due:
+                self.update_id += 1
+                self.push(*stream.make(self.update_id))
+            self.max_backlog = max(self.max_backlog, len(self.updates))
+            self._new.set()
+            await asyncio.sleep(0.005)
+
+    @property
+    def pending(self) -> int:
+        """Апдейты, на которые ответ ещё ожидается (ключевые слова троттлятся ботом — не в счёт)"""
+        return sum(len(queue) for queue in self._commands.values()) + len(self._callbacks)
+
+    async def run(self, idle_timeout: float = 5.0) -> dict:
+        """Прогон потока до конца: все апдейты подтверждены и ответы пришли (или затишье)"""
+        started = monotonic()
+        producer = asyncio.create_task(self.produce())
+        progress = (-1, -1)
+        idle_since = monotonic()
+
+        while True:
+            await asyncio.sleep(0.1)
+            done = producer.done() and self.acked >= self.produced + self.backlog
+            if done and not self.pending:
+                break
+            state = (self.acked, sum(len(samples) for samples in self.replies.values()))
+            if state != progress:
+                progress, idle_since = state, monotonic()
+            elif monotonic() - idle_since > idle_timeout:
+                break
+
+        finished = monotonic() if not self.pending else idle_since
+        return self.report(finished - started)
+
+    def report(self, elapsed: float) -> dict:
+        stream = self.stream
+        replied = sum(len(samples) for samples in self.replies.values())
+        latency = [sample for samples in self.replies.values() for sample in samples]
+        return {
+            'offered_per_sec': stream.rate,
+            'updates': self.produced,
+            'acked': self.acked,
+            'elapsed_sec': round(elapsed, 2),
+            'updates_per_sec': round(self.acked / elapsed, 1),
+            'replies_per_sec': round(replied / elapsed, 1),
+            'max_backlog': self.max_backlog,
+            'backlog': self.backlog,
+            'catch_up_sec': round(self.caught_up, 3) if self.caught_up is not None else None,
+            'catch_up_per_sec': round(self.backlog / self.caught_up, 1) if self.caught_up else None,
+            'delivery_ms': percentiles(self.delivery),
+            'reply_latency_ms': percentiles(latency),
+            'by_kind': {kind: {'expected': self.expected[kind], 'replied': len(samples), **percentiles(samples)}
+                        for kind, samples in self.replies.items()},
+            'no_reply': self.pending,
+            'unmatched': self.unmatched,
+            'injected_429': self.injected,
+            'calls': dict(sorted(self.calls.items()))
+        }
+
+    # ---------- методы Bot API ----------
+
+    def _message(self, chat_id: int, text: str = '', message_id: Optional[int] = None) -> dict:
+        if message_id is None:
+            self.message_id += 1
+            message_id = self.message_id
+        return {'message_id': message_id, 'date': int(time()), 'text': text,
+                'chat': {'id': chat_id, 'type': 'supergroup' if chat_id < 0 else 'private'}}
+
+    def _replied(self, kind: str, created: Optional[float]):
+        if created is None:
+            self.unmatched += 1
+        else:
+            self.replies[kind].append(monotonic() - created)
+
+    async def get_me(self, params: dict) -> dict:
+        return BOT_USER
+
+    async def get_chat_member(self, params: dict) -> dict:
+        return {'status': 'member', 'user': {'id': int(params['user_id']), 'is_bot': False, 'first_name': "User"}}
+
+    async def get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        timeout = float(params.get('timeout', 0))
+        if not self.polling.is_set():
+            self._polling_since = monotonic()
+            self.polling.set()
+
+        updates = self.updates
+        while updates and updates[0][0] < offset:
+            updates.popleft()
+            self.acked += 1
+        if self.caught_up is None and self.backlog and self.acked >= self.backlog:
+            self.caught_up = monotonic() - self._polling_since
+
+        if not updates and timeout:
+            self._new.clear()
+            try:
+                await asyncio.wait_for(self._new.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        batch = []
+        now = monotonic()
+        for update_id, update, created in islice(updates, limit):
+            if update_id > self._delivered_id:
+                self._delivered_id = update_id
+                self.delivery.append(now - created)
+            batch.append(update)
+        return batch
+
+    async def send_message(self, params: dict) -> dict:
+        chat_id = int(params['chat_id'])
+        reply_to = params.get('reply_to_message_id')
+        if 'reply_parameters' in params:
+            reply_to = json.loads(params['reply_parameters'])['message_id']
+
+        if reply_to is not None:
+            self._replied('keyword', self._keywords.pop((chat_id, int(reply_to)), None))
+        else:
+            queue = self._commands.get(chat_id)
+            self._replied('command', queue.popleft() if queue else None)
+        return self._message(chat_id, params.get('text', ''))
+
+    async def edit_message_text(self, params: dict) -> dict:
+        chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+        # Самый старый callback этого сообщения, на который ещё не ответили
+        queue = self._screens.get((chat_id, message_id))
+        created = None
+        while queue and created is None:
+            created = self._callbacks.pop(queue.popleft(), None)
+        self._replied('callback', created)
+        return self._message(chat_id, params.get('text', ''), message_id)
+
+    async def answer_callback_query(self, params: dict) -> bool:
+        self._replied('callback', self._callbacks.pop(params['callback_query_id'], None))
+        return True
+
+
+async def serve_forever(args):
+    api = MockBotAPI(UpdateStream(args.rate, args.updates, args.chats, args.users),
+                     args.latency / 1000, args.retry_rate, args.retry_after)
+    api.preload(args.backlog, args.backlog_age)
+    await api.serve(args.host, args.port)
+    print(f"Bot API: http://{args.host}:{args.port} — запусти бота с BOT_API_URL=http://{args.host}:{args.port}")
+
+    await api.polling.wait()
+    print(json.dumps(await api.run(args.idle_timeout), ensure_ascii=False, indent=2))
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--rate', type=float, default=1000, help="апдейтов в секунду")
+    parser.add_argument('--updates', type=int, default=20_000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка каждого вызова, мс")
+    parser.add_argument('--retry-rate', type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--backlog', type=int, default=0, help="сообщений в очереди простоя до старта бота")
+    parser.add_argument('--backlog-age', type=float, default=600, help="сколько секунд назад они отправлены")
+    parser.add_argument('--idle-timeout', type=float, default=5.0, help="сколько ждать без прогресса, с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8081)
+    add_arguments(parser)
+    asyncio.run(serve_forever(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
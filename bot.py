@@ -1,19 +1,43 @@
+import argparse
 import asyncio
+import csv
 import os
+import sys
 import json
 import logging
-from datetime import datetime, timedelta
+import re
+import signal
+import heapq
+import sqlite3
+import struct
+import mmap
+import unicodedata
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta
+from hmac import compare_digest
 from pathlib import Path
-from typing import Dict, Optional
-from functools import wraps
-from time import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from operator import attrgetter
+from bisect import bisect_left, insort
+from itertools import islice
+from time import monotonic, perf_counter, time
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F, BaseMiddleware
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, TelegramObject
+from aiogram.filters import JOIN_TRANSITION, LEAVE_TRANSITION, ChatMemberUpdatedFilter, Command, CommandObject
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputFile, InputTextMessageContent,
+    TelegramObject
+)
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ChatMemberStatus, ParseMode
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendDocument, SendMessage, TelegramMethod
 from dotenv import load_dotenv
 
 # ==============================
@@ -37,8 +61,12 @@ if not TOKEN:
     logger.error("❌ Токен не найден! Создай файл .env с TOKEN=твой_токен")
     exit()
 
+# Свой сервер Bot API: локальный telegram-bot-api или заглушка benchmarks/mock_api.py
+API_URL = os.getenv("BOT_API_URL", "")
+session = AiohttpSession(api=TelegramAPIServer.from_base(API_URL)) if API_URL else None
+
 storage = MemoryStorage()
-bot = Bot(TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=storage)
 
 
@@ -48,59 +76,859 @@ dp = Dispatcher(storage=storage)
 
 class Config:
     CHAT_ID: int = -1003257278638
-    CHECK_EVERY: int = 3600
     FB_POST_EVERY_DAYS: int = 2
     BOT_REMINDER_EVERY_DAYS: int = 4
+    # Cron вместо интервала, например "0 19 * * 1,4"; пусто — раз в N дней
+    FB_POST_CRON: str = ""
+    BOT_REMINDER_CRON: str = ""
+    # Опоздание, после которого catch_up='skip' пропускает запуск; предел догона для 'all'
+    JOBS_MISFIRE_GRACE: int = 300
+    JOBS_MAX_CATCH_UP: int = 10
+    JOBS_MAX_SLEEP: int = 300
+    
     SAVE_INTERVAL: int = 60
     MAX_TOP_USERS: int = 10
+    # Рейтинги за скользящие окна: имя → длина в календарных днях (1 — только сегодня)
+    TOP_WINDOWS: Dict[str, int] = {'day': 1, 'week': 7, 'month': 30}
     POINTS_PER_10_MESSAGES: int = 1
     POINTS_PER_COMMAND: int = 2
-    CACHE_TTL: int = 60
+    ACTIVITY_HISTORY_DAYS: int = 90
+    # Состав группы: период оттока и удержания в /stats; как часто сверять число участников с Telegram
+    ROSTER_STATS_DAYS: int = 30
+    ROSTER_SYNC_INTERVAL: int = 86400
     THROTTLE_TIME: int = 3
     
+    # Лимиты антифлуда по классам обработчиков: (токенов в секунду, запас)
+    RATE_LIMITS_USER: Dict[str, tuple] = {
+        'message': (1.0, 10),
+        'command': (0.2, 3),
+        'callback': (0.5, 5)
+    }
+    RATE_LIMITS_CHAT: Dict[str, tuple] = {
+        'message': (20.0, 60),
+        'command': (1.0, 10),
+        'callback': (5.0, 20)
+    }
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    
+    # Исходящие вызовы Bot API: (сообщений в секунду, запас)
+    OUTBOX_GLOBAL_LIMIT: tuple = (30.0, 30)
+    OUTBOX_GROUP_LIMIT: tuple = (20 / 60, 20)
+    OUTBOX_PRIVATE_LIMIT: tuple = (1.0, 3)
+    OUTBOX_CONCURRENCY: int = 8
+    OUTBOX_MAX_DEPTH: int = 10_000
+    OUTBOX_MAX_RETRIES: int = 3
+    OUTBOX_DRAIN_TIMEOUT: int = 10
+    
+    # Приветствия вошедшим за окно склеиваются в одно сообщение
+    WELCOME_COALESCE_WINDOW: float = 5.0
+    WELCOME_MAX_NAMES: int = 30
+    
+    # Приём апдейтов: "polling" или "webhook"
+    RUN_MODE: str = "polling"
+    # Апдейты, накопившиеся за простой, догоняются при старте, а не отбрасываются.
+    # Сообщения старше BACKLOG_CUTOFF секунд только учитываются — без ответов и приветствий
+    BACKLOG_CATCH_UP: bool = True
+    BACKLOG_CUTOFF: int = 300
+    BACKLOG_BATCH: int = 100
+    # Публичный https-адрес бота; пустой — set_webhook не вызывается (локальная отладка)
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_MAX_IN_FLIGHT: int = 100
+    WEBHOOK_ACCEPT_TIMEOUT: float = 5.0
+    WEBHOOK_DRAIN_TIMEOUT: int = 30
+    
+    # Prometheus /metrics; слушаем только локально. 9100 занят node_exporter'ом
+    METRICS_ENABLED: bool = True
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "9746"))
+    LOOP_LAG_INTERVAL: float = 0.5
+    
+    KEYWORDS_FILE: str = "keywords.json"
+    KEYWORDS_RELOAD_INTERVAL: int = 30
+    # Сколько слов сообщений (как их режет split) матчер помнит как заведомо без ключевых слов
+    KEYWORDS_CACHE_SIZE: int = 100_000
+    # Правила начисления очков; без файла — POINTS_PER_10_MESSAGES и POINTS_PER_COMMAND.
+    # Перечитывается вместе с KEYWORDS_FILE
+    POINTS_FILE: str = "points.json"
+    POINTS_STATE_MAX_KEYS: int = 100_000
+    
+    # Данные каждой группы — в CHATS_DIR/<chat_id>/, список групп — в CHATS_FILE, расписание — в JOBS_FILE,
+    # номер последнего учтённого апдейта — в UPDATES_FILE
+    CHATS_DIR: str = "chats"
+    CHATS_FILE: str = "chats.json"
+    JOBS_FILE: str = "jobs.json"
+    UPDATES_FILE: str = "updates.json"
+    CHAT_IDLE_TIMEOUT: int = 1800
+    
     STATE_FILE: str = "bot_state.json"
     USERS_FILE: str = "users.json"
+    # Формат снимка пользователей: "json" (USERS_FILE) или "binary" (SNAPSHOT_FILE, читается через mmap)
+    SNAPSHOT_FORMAT: str = "json"
+    SNAPSHOT_FILE: str = "users.bin"
+    # Сколько строк снимка индексировать за один проход цикла при загрузке
+    LOAD_CHUNK: int = 2000
+    
+    STORAGE_BACKEND: str = "json"
+    # Несколько процессов над одной папкой данных: у каждого свой REPLICA_ID,
+    # пусто — единственный владелец. Только для JSON-хранилища и режима webhook;
+    # на одном хосте каждой реплике — свои WEBHOOK_PORT и METRICS_PORT
+    REPLICA_ID: str = os.getenv("REPLICA_ID", "")
+    # Журнал вклада реплики больше этого — вклад переписывается целиком
+    REPLICA_COMPACT_BYTES: int = 4 * 1024 * 1024
+    # Плановые посты шлёт только одна из реплик
+    RUN_JOBS: bool = os.getenv("RUN_JOBS", "1") == "1"
+    SQLITE_FILE: str = "haybot.db"
+    SQLITE_CACHE_SIZE: int = 10_000
+    
+    RENDER_CACHE_SIZE: int = 10_000
+    # Inline-режим (@bot top / @bot me, включается в BotFather): сколько секунд Telegram держит ответ у себя
+    INLINE_TOP_CACHE_TIME: int = 60
+    INLINE_PROFILE_CACHE_TIME: int = 30
+    
+    # Трекинг сообщений: очередь событий и пакетное применение
+    INGEST_QUEUE_SIZE: int = 100_000
+    INGEST_MAX_BATCH: int = 10_000
+    INGEST_BATCH_DELAY: float = 0.05
+    # Пакет раздела, не применившийся столько раз подряд, отбрасывается (в dropped)
+    INGEST_MAX_RETRIES: int = 3
+    
+    JOURNAL_ENABLED: bool = True
+    JOURNAL_FILE: str = "users.journal"
+    JOURNAL_FLUSH_INTERVAL: int = 2
+    JOURNAL_COMPACT_BYTES: int = 8 * 1024 * 1024
     
     UK_MANAGERS: str = "@BE4HOCT6 @ash_avanesyan @VARDAN_XACHATRYAN"
     TR_MANAGERS: str = "@Hovo120193"
     SUPPORT_MANAGER: str = "@BE4HOCT6 @Hovo120193 @ash_avanesyan @VARDAN_XACHATRYAN"
+    
+    # Кроме администраторов группы, /export доступен этим id (через запятую)
+    ADMIN_IDS: frozenset = frozenset(int(uid) for uid in os.getenv("ADMIN_IDS", "").split(",") if uid.strip())
+    # Экспорт: сколько текста копить перед сжатием куска; gzip -1 — сжатие идёт в цикле событий,
+    # а уровень 6 экономит ~25% размера ценой в несколько раз большего времени сжатия
+    EXPORT_CHUNK_SIZE: int = 64 * 1024
+    EXPORT_COMPRESS_LEVEL: int = 1
 
 
 config = Config()
 
 
 # ==============================
-# 🛡️ АНТИФЛУД ДЕКОРАТОР
+# 🛡️ АНТИФЛУД
 # ==============================
 
-def throttle(limit: int = config.THROTTLE_TIME):
-    """Антифлуд декоратор"""
-    def decorator(func):
-        last_call = {}
-        
-        @wraps(func)
-        async def wrapper(message: types.Message, *args, **kwargs):
-            user_id = message.from_user.id
-            now = time()
-            
-            if user_id in last_call:
-                if now - last_call[user_id] < limit:
-                    logger.debug(f"Throttled user {user_id}")
-                    return
-            
-            last_call[user_id] = now
-            return await func(message, *args, **kwargs)
-        
-        return wrapper
-    return decorator
+class RateLimiter:
+    """Token bucket на ключ с TTL-вытеснением и ограничением числа ключей.
+
+    Бакет, не тронутый дольше capacity / rate секунд, уже полон и ничем
+    не отличается от отсутствующего — такие удаляются с начала LRU.
+    """
+
+    __slots__ = ('rate', 'capacity', 'ttl', 'max_keys', '_buckets')
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.ttl = capacity / rate
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key, now: float) -> bool:
+        buckets = self._buckets
+        bucket = buckets.get(key)
+
+        if bucket is None:
+            buckets[key] = [self.capacity - 1, now]
+            self._evict(now)
+            return True
+
+        buckets.move_to_end(key)
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+
+        bucket[0] = tokens - 1
+        return True
+
+    def retry_after(self, key, now: float) -> float:
+        """Через сколько секунд allow(key) вернёт True, ничего не расходуя"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0.0
+
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while len(buckets) > self.max_keys:
+            buckets.popitem(last=False)
+
+        # Пара записей за вызов — амортизированно O(1)
+        for _ in range(2):
+            oldest = next(iter(buckets.values()))
+            if now - oldest[1] < self.ttl:
+                break
+            buckets.popitem(last=False)
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Общий антифлуд для сообщений и callback-запросов.
+
+    Регистрируется как outer middleware, поэтому отбрасывает апдейт до
+    фильтров, обработчиков и TrackingMiddleware. Лимиты отдельные для
+    пользователя и для чата в каждом классе обработчиков.
+    """
+
+    def __init__(self):
+        self.limiters: Dict[tuple, RateLimiter] = {}
+        self.rejected: Dict[str, int] = {}
+
+        for scope, limits in (('user', config.RATE_LIMITS_USER), ('chat', config.RATE_LIMITS_CHAT)):
+            for kind, (rate, burst) in limits.items():
+                self.limiters[(scope, kind)] = RateLimiter(rate, burst, config.RATE_LIMIT_MAX_KEYS)
+                self.rejected[kind] = 0
+
+    @staticmethod
+    def classify(event: TelegramObject) -> Optional[str]:
+        if isinstance(event, types.CallbackQuery):
+            return 'callback'
+        if isinstance(event, types.Message):
+            # Служебные сообщения о входе/выходе не ограничиваем
+            if event.new_chat_members or event.left_chat_member:
+                return None
+            if event.text and event.text.startswith('/'):
+                return 'command'
+            return 'message'
+        return None
+
+    async def __call__(
+        self,
+        handler,
+        event: TelegramObject,
+        data: dict
+    ):
+        kind = self.classify(event)
+        if kind is None or event.from_user is None:
+            return await handler(event, data)
+
+        message = event.message if kind == 'callback' else event
+        chat_id = message.chat.id if message else event.from_user.id
+        now = monotonic()
+
+        if not (self.limiters[('user', kind)].allow(event.from_user.id, now)
+                and self.limiters[('chat', kind)].allow(chat_id, now)):
+            self.rejected[kind] += 1
+            logger.debug(f"Throttled {kind}: user {event.from_user.id}, chat {chat_id}")
+            return None
+
+        return await handler(event, data)
+
+
+rate_limit = RateLimitMiddleware()
+
+# Автоответ на ключевые слова — не чаще раза в THROTTLE_TIME секунд на пользователя
+keyword_replies = RateLimiter(1 / config.THROTTLE_TIME, 1, config.RATE_LIMIT_MAX_KEYS)
+
+
+# ==============================
+# 📤 ИСХОДЯЩИЕ СООБЩЕНИЯ
+# ==============================
+
+class OutgoingCall:
+    """Вызов Bot API в очереди"""
+
+    __slots__ = ('method', 'chat_id', 'lane', 'future', 'enqueued', 'attempts')
+
+    def __init__(self, method: TelegramMethod, lane: int, future: Optional[asyncio.Future]):
+        self.method = method
+        self.chat_id = getattr(method, 'chat_id', None)
+        self.lane = lane
+        self.future = future
+        self.enqueued = monotonic()
+        self.attempts = 0
+
+
+class Outbox:
+    """Единая очередь исходящих вызовов Bot API.
+
+    Лимиты — token bucket на чат (группы и личка отдельно) и общий на бота.
+    Полосы приоритета: ответы пользователям обгоняют приветствия, а те —
+    запланированные посты. В пределах чата порядок сохраняется: следующий
+    вызов уходит только после завершения предыдущего, разные чаты
+    отправляются параллельно. TelegramRetryAfter ставит чат на паузу и
+    возвращает вызов в начало его полосы.
+    """
+
+    INTERACTIVE, NOTICE, SCHEDULED = range(3)
+    # Сколько вызовов полосы просматривать в поисках чата, которому можно отправлять
+    SCAN_LIMIT = 64
+
+    def __init__(self):
+        self._lanes: List[deque] = [deque() for _ in range(3)]
+        self._global = RateLimiter(*config.OUTBOX_GLOBAL_LIMIT, max_keys=1)
+        self._groups = RateLimiter(*config.OUTBOX_GROUP_LIMIT, config.RATE_LIMIT_MAX_KEYS)
+        self._private = RateLimiter(*config.OUTBOX_PRIVATE_LIMIT, config.RATE_LIMIT_MAX_KEYS)
+        self._hold: Dict[int, float] = {}
+        self._busy: set = set()
+        self._tasks: set = set()
+        self._pending: Dict[tuple, tuple] = {}
+        self._slots = asyncio.Semaphore(config.OUTBOX_CONCURRENCY)
+        self._wake = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+        self.sent: int = 0
+        self.retries: int = 0
+        self.failed: int = 0
+        self.latency: deque = deque(maxlen=1024)
+
+    @property
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    def _limiter(self, chat_id: int) -> RateLimiter:
+        return self._groups if chat_id < 0 else self._private
+
+    def _chat_delay(self, chat_id: Optional[int], now: float) -> float:
+        hold = self._hold.get(chat_id)
+        if hold is not None:
+            if hold > now:
+                return hold - now
+            del self._hold[chat_id]
+
+        if chat_id is None:
+            return 0.0
+        return self._limiter(chat_id).retry_after(chat_id, now)
+
+    def _next_ready(self, now: float) -> tuple:
+        """Первый вызов, который можно отправить сейчас, или (None, сколько ждать)"""
+        wait = self._global.retry_after(None, now)
+        if wait > 0:
+            return None, wait
+
+        wait = None
+        for lane in self._lanes:
+            for i, call in enumerate(islice(lane, self.SCAN_LIMIT)):
+                if call.chat_id in self._busy:
+                    continue
+
+                delay = self._chat_delay(call.chat_id, now)
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+
+                del lane[i]
+                self._global.allow(None, now)
+                if call.chat_id is not None:
+                    self._limiter(call.chat_id).allow(call.chat_id, now)
+                return call, None
+
+        return None, wait
+
+    def _enqueue(self, method: TelegramMethod, lane: int, future: Optional[asyncio.Future]):
+        if self.depth >= config.OUTBOX_MAX_DEPTH:
+            raise asyncio.QueueFull(f"Очередь исходящих переполнена ({self.depth})")
+
+        self._lanes[lane].append(OutgoingCall(method, lane, future))
+        self._wake.set()
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self.run())
+
+    async def send(self, method: TelegramMethod, lane: int = INTERACTIVE):
+        """Ставит вызов в очередь и ждёт его результата"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(method, lane, future)
+        return await future
+
+    def post(self, method: TelegramMethod, lane: int = NOTICE):
+        """Ставит вызов в очередь без ожидания; ошибки только логируются"""
+        self._enqueue(method, lane, None)
+
+    def coalesce(self, key: tuple, value, build: Callable[[list], TelegramMethod],
+                 window: float, limit: int, lane: int = NOTICE):
+        """Копит значения под ключом window секунд и отправляет один вызов build(values)"""
+        pending = self._pending.get(key)
+        if pending is None:
+            handle = asyncio.get_running_loop().call_later(window, self._flush, key)
+            pending = self._pending[key] = ([], build, lane, handle)
+
+        pending[0].append(value)
+        if len(pending[0]) >= limit:
+            self._flush(key)
+
+    def _flush(self, key: tuple):
+        values, build, lane, handle = self._pending.pop(key)
+        handle.cancel()
+        self.post(build(values), lane)
+
+    async def run(self):
+        while True:
+            await self._slots.acquire()
+            call, wait = self._next_ready(monotonic())
+
+            if call is None:
+                self._slots.release()
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._busy.add(call.chat_id)
+            task = asyncio.create_task(self._deliver(call))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, call: OutgoingCall):
+        try:
+            result = await bot(call.method)
+        except TelegramRetryAfter as e:
+            self.retries += 1
+            call.attempts += 1
+            if call.attempts > config.OUTBOX_MAX_RETRIES:
+                self._finish(call, error=e)
+            else:
+                logger.warning(f"⏳ RetryAfter {e.retry_after}s для чата {call.chat_id}")
+                self._hold[call.chat_id] = monotonic() + e.retry_after
+                self._lanes[call.lane].appendleft(call)
+        except Exception as e:
+            self._finish(call, error=e)
+        else:
+            self._finish(call, result)
+        finally:
+            self._busy.discard(call.chat_id)
+            self._slots.release()
+            self._wake.set()
+
+    def _finish(self, call: OutgoingCall, result=None, error: Optional[Exception] = None):
+        self.latency.append(monotonic() - call.enqueued)
+        future = call.future
+
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+            if future is None:
+                logger.error(f"Ошибка отправки в {call.chat_id}: {error}")
+
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    async def drain(self, timeout: float):
+        """Отправляет накопленное перед остановкой, но не дольше timeout секунд"""
+        for key in list(self._pending):
+            self._flush(key)
+
+        deadline = monotonic() + timeout
+        while (self.depth or self._busy) and monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        if self.depth:
+            logger.warning(f"📤 Не отправлено при остановке: {self.depth}")
+
+    @property
+    def stats(self) -> Dict:
+        latency = sorted(self.latency)
+
+        def percentile(q: float) -> float:
+            return latency[int(q * (len(latency) - 1))] if latency else 0.0
+
+        return {'depth': [len(lane) for lane in self._lanes], 'in_flight': len(self._busy),
+                'sent': self.sent, 'retries': self.retries, 'failed': self.failed,
+                'latency_p50': percentile(0.5), 'latency_p95': percentile(0.95)}
+
+
+outbox = Outbox()
+
+
+# ==============================
+# 🧮 ПРАВИЛА НАЧИСЛЕНИЯ ОЧКОВ
+# ==============================
+
+class PointsRules:
+    """Правила начисления очков, разобранные при загрузке в таблицы.
+
+    points.json задаёт виды сообщений (text, media, reply) — сколько очков
+    за сколько сообщений, веса команд, паузу между начислениями и потолок
+    очков за окно для сообщений и для команд. Всё проверяется и
+    раскладывается по кортежам при загрузке: на сообщение остаются поиск в
+    словаре, пара сравнений и запись в список состояния.
+
+    Состояние пользователя — список из нескольких целых, место в нём
+    отводится только под то, что правила используют: счётчики до следующего
+    начисления по видам, время последнего начисления, номер окна и очки в
+    нём. Хранится по разделам, не больше POINTS_STATE_MAX_KEYS на раздел
+    (LRU). Новое состояние — после вытеснения, перезапуска или перезагрузки
+    правил — берёт счётчик текста из остатка от числа сообщений, как
+    раньше считались десятки.
+    """
+
+    KINDS = ('text', 'media', 'reply')
+    MEDIA = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note', 'sticker')
+    UNITS = {'text': "հաղորդագրություն", 'media': "մեդիա", 'reply': "պատասխան"}
+
+    __slots__ = ('kinds', 'commands', 'default_command', 'width', '_messages', '_commands', '_seed', '_states')
+
+    def __init__(self, data: dict):
+        self.width = 0
+        limits = data.get('limits', {})
+        self._messages = self._limits(limits.get('message', {}))
+        self._commands = self._limits(limits.get('command', {}))
+
+        self.kinds: Dict[str, tuple] = {}
+        messages = data.get('messages', {'text': {'points': config.POINTS_PER_10_MESSAGES, 'every': 10}})
+        for kind, rule in messages.items():
+            if kind not in self.KINDS:
+                raise ValueError(f"неизвестный вид сообщений: {kind}")
+            points, every = self._count(rule.get('points', 1)), self._count(rule.get('every', 1))
+            if every < 1:
+                raise ValueError(f"{kind}: every должно быть не меньше 1")
+            self.kinds[kind] = (points, every, self._slots(1) if every > 1 and points else None)
+
+        text = self.kinds.get('text')
+        self._seed = text if text is not None and text[2] is not None else None
+
+        commands = {name.lstrip('/').lower(): self._count(weight)
+                    for name, weight in data.get('commands', {}).items()}
+        self.default_command = commands.pop('default', config.POINTS_PER_COMMAND)
+        self.commands = commands
+        self._states: Dict[int, OrderedDict] = {}
+
+    def _slots(self, count: int) -> int:
+        first = self.width
+        self.width += count
+        return first
+
+    @staticmethod
+    def _count(value) -> int:
+        if not isinstance(value, int) or value < 0:
+            raise ValueError(f"ожидалось неотрицательное целое, получено {value!r}")
+        return value
+
+    def _limits(self, spec: dict) -> tuple:
+        """(пауза, место времени, потолок, окно, место окна) — места только под заданное"""
+        cooldown, cap = self._count(spec.get('cooldown', 0)), self._count(spec.get('cap', 0))
+        window = self._count(spec.get('window', 86400))
+        if cap and not window:
+            raise ValueError("window должно быть больше 0")
+        return (cooldown, self._slots(1) if cooldown else None,
+                cap, window, self._slots(2) if cap else None)
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'PointsRules':
+        """points.json: {"messages": {"text": {"points": 1, "every": 10}, ...},
+        "commands": {"default": 2, "start": 0}, "limits": {"message": {"cooldown": 0, "cap": 50, "window": 86400}}}"""
+        with open(filename, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def kind(self, message: types.Message) -> Optional[str]:
+        """Вид сообщения по правилам; None — не учитывается (команды, служебные, виды без правила)"""
+        kinds = self.kinds
+        text = message.text
+        if text is not None and text.startswith('/'):
+            return None
+
+        if 'reply' in kinds:
+            reply = message.reply_to_message
+            # В темах форума каждое сообщение «отвечает» на создание темы
+            if reply is not None and reply.forum_topic_created is None:
+                return 'reply'
+
+        if text is not None:
+            return 'text' if 'text' in kinds else None
+        if 'media' in kinds:
+            for field in self.MEDIA:
+                if getattr(message, field) is not None:
+                    return 'media'
+        return None
+
+    def _state(self, db: 'FastDataManager', user_id: int) -> list:
+        states = self._states.get(db.chat_id)
+        if states is None:
+            states = self._states[db.chat_id] = OrderedDict()
+
+        state = states.get(user_id)
+        if state is not None:
+            states.move_to_end(user_id)
+            return state
+
+        state = states[user_id] = [0] * self.width
+        if self._seed is not None:
+            user = db.peek_user(user_id)
+            if user is not None:
+                state[self._seed[2]] = user.messages % self._seed[1]
+        if len(states) > config.POINTS_STATE_MAX_KEYS:
+            states.popitem(last=False)
+        return state
+
+    @staticmethod
+    def _grant(state: list, limits: tuple, points: int, now: int) -> int:
+        cooldown, last, cap, window, span = limits
+        if cooldown:
+            if now - state[last] < cooldown:
+                return 0
+            state[last] = now
+        if cap:
+            current = now // window
+            if state[span] != current:
+                state[span] = current
+                state[span + 1] = 0
+            points = min(points, cap - state[span + 1])
+            if points <= 0:
+                return 0
+            state[span + 1] += points
+        return points
+
+    def message(self, db: 'FastDataManager', user_id: int, kind: str, now: int) -> int:
+        """Очки за одно сообщение вида kind"""
+        rule = self.kinds.get(kind)
+        if rule is None:
+            return 0
+
+        points, every, slot = rule
+        if not points or not self.width:
+            return points
+
+        state = self._state(db, user_id)
+        if slot is not None:
+            count = state[slot] + 1
+            if count < every:
+                state[slot] = count
+                return 0
+            state[slot] = 0
+        return self._grant(state, self._messages, points, now)
+
+    def command(self, db: 'FastDataManager', user_id: int, name: str, now: int) -> int:
+        """Очки за команду; команды с нулевым весом паузу и потолок не трогают"""
+        points = self.commands.get(name, self.default_command)
+        if not points or not self.width:
+            return points
+        return self._grant(self._state(db, user_id), self._commands, points, now)
+
+    def forget(self, chat_id: int):
+        """Раздел выгружен — его состояния больше не нужны"""
+        self._states.pop(chat_id, None)
+
+    def remaining(self, db: 'FastDataManager', user_id: int, messages: int) -> Optional[int]:
+        """Сколько текстовых сообщений до следующего начисления; None — за текст очков нет"""
+        rule = self.kinds.get('text')
+        if rule is None or not rule[0]:
+            return None
+
+        points, every, slot = rule
+        if slot is None:
+            return 1
+        state = self._states.get(db.chat_id, {}).get(user_id)
+        return every - (state[slot] if state is not None else messages % every)
+
+    def summary(self) -> str:
+        """Строки «сколько за что» для подвала топа"""
+        lines = [f"{every} {self.UNITS[kind]} = {points} միավոր"
+                 for kind, (points, every, _) in self.kinds.items() if points]
+        lines.append(f"1 հրաման = {self.default_command} միավոր")
+        return "\n".join([f"├ {line}" for line in lines[:-1]] + [f"└ {lines[-1]}"])
+
+
+points_rules = PointsRules({})
+_points_mtime: float = 0.0
+
+
+def reload_points_rules() -> bool:
+    """Перечитывает POINTS_FILE, если он изменился; при ошибке остаются старые правила.
+    Подвал топа и подсказка профиля зависят от правил — отрисованные тексты сбрасываются"""
+    global points_rules, _points_mtime
+
+    try:
+        mtime = os.stat(config.POINTS_FILE).st_mtime
+    except FileNotFoundError:
+        return False
+
+    if mtime == _points_mtime:
+        return False
+
+    try:
+        points_rules = PointsRules.from_file(config.POINTS_FILE)
+        screens.clear()
+        logger.info(f"🧮 Правила начисления загружены из {config.POINTS_FILE}")
+    except Exception as e:
+        logger.error(f"Ошибка загрузки {config.POINTS_FILE}: {e}")
+
+    _points_mtime = mtime
+    return True
 
 
 # ==============================
 # 🎯 MIDDLEWARE ДЛЯ АВТОТРЕКИНГА
 # ==============================
 
+class Ingest:
+    """Приём сообщений для трекинга: обработчик лишь кладёт событие в очередь.
+
+    Единственный писатель забирает накопившееся (до INGEST_MAX_BATCH),
+    считает очки по points_rules, складывает по разделу, дню отправки и
+    пользователю и применяет пакетом со временем последнего сообщения дня —
+    версия раздела и кэш экранов меняются раз на пакет, а сообщения догона
+    попадают в свои дни, а не в сегодняшний. Очки считаются здесь, а не при приёме:
+    новое состояние правил берёт счётчик из числа сообщений записи, и
+    все более ранние события пользователя к этому моменту уже в ней.
+    Полная очередь — событие отбрасывается и считается в dropped: до неё
+    поток уже срезан антифлудом. Читатели вызывают flush(), чтобы увидеть
+    всё принятое; пакет применяется целиком, без промежуточных состояний.
+    Очередь — deque с Event, как у Outbox: asyncio.Queue на каждый put
+    будит ожидающих и ведёт счётчик задач, а здесь это лишнее.
+
+    Если раздел не принял пакет, его события возвращаются в начало очереди
+    и повторяются на следующем проходе, остальные разделы не ждут (если
+    раздел успел применить часть пакета до ошибки, повтор учтёт её ещё раз —
+    это лучше потери). Вернувшиеся события несут уже посчитанные очки —
+    правила по ним второй раз не идут. После INGEST_MAX_RETRIES неудач
+    подряд события раздела отбрасываются.
+    """
+
+    def __init__(self):
+        self._queue: deque = deque()
+        self._wake = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._failures: Dict['FastDataManager', int] = {}
+        self.applied: int = 0
+        self.batches: int = 0
+        self.dropped: int = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def track(self, db: 'FastDataManager', user: types.User, kind: str, sent: int):
+        """Сообщение вида kind (по points_rules.kind); sent — время отправки для паузы и потолка правил"""
+        queue = self._queue
+        if len(queue) >= config.INGEST_QUEUE_SIZE:
+            self.dropped += 1
+            return
+
+        queue.append((db, user, kind, sent, None))
+        if len(queue) == 1:
+            # Очередь была пуста — будим писателя (и запускаем при первом событии)
+            self._wake.set()
+            if self._worker is None or self._worker.done():
+                self._worker = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self._wake.wait()
+            # Короткая выдержка собирает пакет побольше; читатели не ждут её — у них flush()
+            await asyncio.sleep(config.INGEST_BATCH_DELAY)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка применения пакета трекинга")
+                if not self._queue:
+                    self._wake.clear()
+
+    def flush(self) -> bool:
+        """Применяет всё, что уже в очереди, не уступая цикл.
+        Возвращённые после ошибки события ждут следующего прохода писателя — тогда False"""
+        queue = self._queue
+        while queue:
+            if not self._apply():
+                break
+        if not queue:
+            self._wake.clear()
+        return not queue
+
+    def _apply(self) -> bool:
+        """Один пакет; False — какой-то раздел его не принял"""
+        queue = self._queue
+        popleft = queue.popleft
+        events = [popleft() for _ in range(min(len(queue), config.INGEST_MAX_BATCH))]
+        # (раздел, день) → [uid → счётчики, время последнего сообщения]
+        batch: Dict[tuple, list] = {}
+        rules = points_rules
+        day = start = end = 0
+
+        for i, (db, user, kind, sent, points) in enumerate(events):
+            if points is None:
+                points = rules.message(db, user.id, kind, sent)
+                events[i] = (db, user, kind, sent, points)
+
+            if not start <= sent < end:
+                day, start, end = self._day(sent)
+            group = batch.get((db, day))
+            if group is None:
+                group = batch[db, day] = [{}, sent]
+            elif sent > group[1]:
+                group[1] = sent
+
+            counts = group[0]
+            entry = counts.get(user.id)
+            if entry is None:
+                counts[user.id] = [1, points, user.username or "", user.first_name or ""]
+            else:
+                entry[0] += 1
+                entry[1] += points
+
+        failed: Dict['FastDataManager', list] = {}
+        for key, (counts, now) in batch.items():
+            db = key[0]
+            try:
+                db.track_messages(counts, now)
+            except Exception:
+                logger.exception(f"Ошибка применения пакета трекинга в {db.chat_id}")
+                failed.setdefault(db, []).append(key[1])
+
+        for db, _ in batch:
+            if db not in failed:
+                self._failures.pop(db, None)
+
+        self.applied += len(events)
+        self.batches += 1
+        if not failed:
+            return True
+
+        retry = set()
+        for db, days in failed.items():
+            lost = sum(counts[0] for day in days for counts in batch[db, day][0].values())
+            self.applied -= lost
+            failures = self._failures[db] = self._failures.get(db, 0) + 1
+            if failures >= config.INGEST_MAX_RETRIES:
+                del self._failures[db]
+                self.dropped += lost
+                logger.error(f"Пакет трекинга {db.chat_id} отброшен после {failures} попыток: {lost} событий")
+            else:
+                retry.update((db, day) for day in days)
+
+        # Назад в начало очереди в прежнем порядке
+        returned = [event for event in events if event[0] in failed and (event[0], self._day(event[3])[0]) in retry]
+        queue.extendleft(reversed(returned))
+        return False
+
+    @staticmethod
+    def _day(ts: int) -> tuple:
+        """(ординал дня, его начало, начало следующего) — как у индексов по дням"""
+        day = date.fromtimestamp(ts)
+        start = datetime.combine(day, datetime.min.time())
+        return day.toordinal(), int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+
+ingest = Ingest()
+
+
 class TrackingMiddleware(BaseMiddleware):
-    """Middleware для автоматического трекинга сообщений"""
+    """Middleware для автоматического трекинга сообщений: вид по правилам и постановка в Ingest"""
     
     async def __call__(
         self,
@@ -110,222 +938,3064 @@ class TrackingMiddleware(BaseMiddleware):
     ):
         if isinstance(event, types.Message):
             if event.chat.type in ["group", "supergroup"]:
-                if event.text and not event.text.startswith('/'):
-                    db.track_message(
-                        event.from_user.id,
-                        event.from_user.username or "",
-                        event.from_user.first_name or ""
-                    )
+                kind = points_rules.kind(event)
+                if kind is not None:
+                    ingest.track(data['db'], event.from_user, kind, int(time()))
         
         return await handler(event, data)
 
 
 # ==============================
-# 💾 DATA MANAGER
+# 📡 МЕТРИКИ
 # ==============================
 
-class FastDataManager:
-    """Менеджер данных с кэшированием"""
-    
-    __slots__ = ('state', 'users', '_dirty', '_user_cache', '_top_cache', 
-                 '_top_cache_time', '_active_cache', '_active_cache_time', '_lock')
-    
+class Histogram:
+    """Гистограмма с фиксированными границами: observe — один bisect и два сложения"""
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def expose(self, name: str, labels: str = '') -> Iterator[str]:
+        """Строки Prometheus: накопительные бакеты, _sum и _count"""
+        prefix = f'{labels},' if labels else ''
+        suffix = f'{{{labels}}}' if labels else ''
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {total}'
+        total += self.counts[-1]
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {total}'
+        yield f'{name}_sum{suffix} {self.sum}'
+        yield f'{name}_count{suffix} {total}'
+
+
+class Metrics:
+    """Счётчики процесса в формате Prometheus.
+
+    В горячем пути только сложения и observe; всё остальное (антифлуд,
+    кэш экранов, очередь исходящих, сохранения) читается из самих
+    объектов в момент запроса /metrics.
+    """
+
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    SAVE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
     def __init__(self):
-        self.state: Dict = {}
-        self.users: Dict = {}
-        self._dirty: bool = False
-        self._user_cache: Dict = {}
-        self._top_cache: Optional[list] = None
-        self._top_cache_time: datetime = datetime.min
-        self._active_cache: Dict = {}
-        self._active_cache_time: datetime = datetime.min
-        self._lock = asyncio.Lock()
-        
-        self._load_all()
-    
-    def _load_all(self):
-        """Загружает все данные"""
-        state_data = self._load_json(config.STATE_FILE, {})
-        
-        now_iso = datetime.now().isoformat()
-        
-        self.state = {
-            'last_fb_post': state_data.get('last_fb_post', now_iso),
-            'last_bot_reminder': state_data.get('last_bot_reminder', now_iso),
-            'total_messages': state_data.get('total_messages', 0),
-            'new_members': state_data.get('new_members', 0),
-            'bot_started': state_data.get('bot_started', now_iso)
-        }
-        
-        for key in ['last_fb_post', 'last_bot_reminder', 'bot_started']:
-            self.state[key] = datetime.fromisoformat(self.state[key])
-        
-        self.users = self._load_json(config.USERS_FILE, {})
-        
-        logger.info(f"📅 Последний FB пост: {self.state['last_fb_post'].strftime('%d.%m.%Y %H:%M')}")
-        logger.info(f"📅 Последнее напоминание: {self.state['last_bot_reminder'].strftime('%d.%m.%Y %H:%M')}")
-    
-    @staticmethod
-    def _load_json(filename: str, default: dict) -> dict:
-        path = Path(filename)
-        if not path.exists():
-            return default
-        
+        self.updates: Dict[str, int] = {}
+        self.handlers: Dict[str, Histogram] = {}
+        self.saves: Dict[str, Histogram] = {}
+        self.save_bytes: int = 0
+        self.save_blocked_last: float = 0.0
+        self.loop_lag = Histogram(self.LATENCY_BUCKETS)
+        self.loop_lag_last: float = 0.0
+
+    def observe_handler(self, name: str, duration: float):
+        histogram = self.handlers.get(name)
+        if histogram is None:
+            histogram = self.handlers[name] = Histogram(self.LATENCY_BUCKETS)
+        histogram.observe(duration)
+
+    def observe_save(self, kind: str, duration: float, blocked: float, written: int):
+        histogram = self.saves.get(kind)
+        if histogram is None:
+            histogram = self.saves[kind] = Histogram(self.SAVE_BUCKETS)
+        histogram.observe(duration)
+        self.save_bytes += written
+        self.save_blocked_last = blocked
+
+    def expose(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        metric('haybot_updates_total', 'counter', 'Апдейты по типу')
+        lines.extend(f'haybot_updates_total{{type="{kind}"}} {count}' for kind, count in self.updates.items())
+
+        metric('haybot_handler_seconds', 'histogram', 'Время обработчика вместе с трекингом')
+        for name, histogram in self.handlers.items():
+            lines.extend(histogram.expose('haybot_handler_seconds', f'handler="{name}"'))
+
+        metric('haybot_throttled_total', 'counter', 'Апдейты, отброшенные антифлудом')
+        lines.extend(f'haybot_throttled_total{{kind="{kind}"}} {count}' for kind, count in rate_limit.rejected.items())
+
+        metric('haybot_render_cache_total', 'counter', 'Обращения к кэшу экранов')
+        lines.append(f'haybot_render_cache_total{{result="hit"}} {screens.hits}')
+        lines.append(f'haybot_render_cache_total{{result="miss"}} {screens.misses}')
+        metric('haybot_edits_total', 'counter', 'Правки сообщений по callback')
+        lines.append(f'haybot_edits_total{{result="sent"}} {screens.edits}')
+        lines.append(f'haybot_edits_total{{result="skipped"}} {screens.edits_skipped}')
+
+        metric('haybot_outbox_depth', 'gauge', 'Вызовы Bot API в очереди по полосам')
+        lines.extend(f'haybot_outbox_depth{{lane="{lane}"}} {len(queue)}' for lane, queue in enumerate(outbox._lanes))
+        metric('haybot_outbox_calls_total', 'counter', 'Вызовы Bot API из очереди')
+        lines.append(f'haybot_outbox_calls_total{{result="sent"}} {outbox.sent}')
+        lines.append(f'haybot_outbox_calls_total{{result="failed"}} {outbox.failed}')
+        lines.append(f'haybot_outbox_calls_total{{result="retry"}} {outbox.retries}')
+
+        metric('haybot_ingest_depth', 'gauge', 'События трекинга в очереди')
+        lines.append(f'haybot_ingest_depth {ingest.depth}')
+        metric('haybot_ingest_events_total', 'counter', 'События трекинга')
+        lines.append(f'haybot_ingest_events_total{{result="applied"}} {ingest.applied}')
+        lines.append(f'haybot_ingest_events_total{{result="dropped"}} {ingest.dropped}')
+        metric('haybot_ingest_batches_total', 'counter', 'Пакеты трекинга')
+        lines.append(f'haybot_ingest_batches_total {ingest.batches}')
+
+        metric('haybot_backlog_updates_total', 'counter', 'Апдейты, накопившиеся за простой, по пути обработки')
+        lines.append(f'haybot_backlog_updates_total{{path="fast"}} {backlog.fast}')
+        lines.append(f'haybot_backlog_updates_total{{path="normal"}} {backlog.normal}')
+        lines.append(f'haybot_backlog_updates_total{{path="duplicate"}} {backlog.duplicates}')
+        metric('haybot_backlog_seconds', 'gauge', 'Сколько длился догон до живого края')
+        lines.append(f'haybot_backlog_seconds {backlog.elapsed}')
+
+        metric('haybot_save_seconds', 'histogram', 'Длительность save_all')
+        for kind, histogram in self.saves.items():
+            lines.extend(histogram.expose('haybot_save_seconds', f'kind="{kind}"'))
+        metric('haybot_save_bytes_total', 'counter', 'Записано байт при сохранениях')
+        lines.append(f'haybot_save_bytes_total {self.save_bytes}')
+        metric('haybot_save_blocked_seconds', 'gauge', 'Сколько последнее сохранение занимало цикл событий')
+        lines.append(f'haybot_save_blocked_seconds {self.save_blocked_last}')
+
+        metric('haybot_loop_lag_seconds', 'histogram', 'Опоздание цикла событий')
+        lines.extend(self.loop_lag.expose('haybot_loop_lag_seconds'))
+        metric('haybot_loop_lag_last_seconds', 'gauge', 'Последнее измеренное опоздание цикла')
+        lines.append(f'haybot_loop_lag_last_seconds {self.loop_lag_last}')
+
+        if chats is not None:
+            metric('haybot_chats_loaded', 'gauge', 'Разделы чатов в памяти')
+            lines.append(f'haybot_chats_loaded {len(chats.loaded)}')
+            metric('haybot_users', 'gauge', 'Пользователей в загруженных разделах')
+            lines.append(f'haybot_users {chats.total_users}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Считает апдейты по типу — outer middleware на dp.update"""
+
+    async def __call__(
+        self,
+        handler,
+        event: TelegramObject,
+        data: dict
+    ):
+        updates = metrics.updates
+        kind = event.event_type
+        updates[kind] = updates.get(kind, 0) + 1
+        return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Гистограмма времени по обработчикам — inner middleware, видит выбранный handler"""
+
+    async def __call__(
+        self,
+        handler,
+        event: TelegramObject,
+        data: dict
+    ):
+        started = perf_counter()
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
+            return await handler(event, data)
+        finally:
+            metrics.observe_handler(data['handler'].callback.__name__, perf_counter() - started)
+
+
+# ==============================
+# 👤 ЗАПИСЬ ПОЛЬЗОВАТЕЛЯ
+# ==============================
+
+def to_epoch(value) -> int:
+    """Метка времени из JSON: число как есть, ISO-строка переводится в epoch"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return int(time())
+
+
+class UserRecord:
+    """Компактная запись пользователя: слоты, epoch-секунды, интернированные имена.
+
+    Интернируются только имена — они часто повторяются; username в Telegram
+    уникален, и интернирование лишь раздуло бы таблицу строк.
+    В JSON (снимок, экспорт) переводится через to_json / from_json,
+    формат users.json при этом не меняется.
+    """
+
+    __slots__ = ('name', 'username', 'points', 'messages', 'commands', 'joined', 'last_active')
+
+    def __init__(self, name: str = '', username: str = '', points: int = 0, messages: int = 0,
+                 commands: int = 0, joined: int = 0, last_active: int = 0):
+        self.name = sys.intern(name)
+        self.username = username
+        self.points = points
+        self.messages = messages
+        self.commands = commands
+        self.joined = joined
+        self.last_active = last_active
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'UserRecord':
+        return cls(
+            data.get('name', ''),
+            data.get('username', ''),
+            data.get('points', 0),
+            data.get('messages', 0),
+            data.get('commands', 0),
+            to_epoch(data.get('joined')),
+            to_epoch(data.get('last_active'))
+        )
+
+    @staticmethod
+    def row_to_json(row: tuple) -> dict:
+        name, username, points, messages, commands, joined, last_active = row
+        return {
+            'name': name,
+            'username': username,
+            'points': points,
+            'messages': messages,
+            'commands': commands,
+            'joined': datetime.fromtimestamp(joined).isoformat(),
+            'last_active': datetime.fromtimestamp(last_active).isoformat()
+        }
+
+    def to_json(self) -> dict:
+        return self.row_to_json(user_row(self))
+
+
+# Кортеж всех полей одним C-вызовом — атомарно относительно GIL
+user_row = attrgetter(*UserRecord.__slots__)
+
+
+# ==============================
+# 🏆 ИНДЕКС РЕЙТИНГА
+# ==============================
+
+class LeaderboardIndex:
+    """Инкрементальный индекс рейтинга: бакеты по очкам + дерево Фенвика.
+
+    Топ-N читается из бакетов от большего к меньшему, место пользователя
+    считается префиксной суммой по дереву — без сортировки всей таблицы.
+    Внутри одного значения очков — порядок попадания в бакет.
+    """
+
+    __slots__ = ('_points', '_buckets', '_values', '_tree')
+
+    def __init__(self):
+        self._points: Dict[int, int] = {}
+        self._buckets: Dict[int, Dict[int, None]] = {}
+        self._values: List[int] = []
+        self._tree: List[int] = [0] * 1025
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._points
+
+    def _tree_add(self, points: int, delta: int):
+        tree = self._tree
+        size = len(tree)
+        i = points + 1
+        while i < size:
+            tree[i] += delta
+            i += i & -i
+
+    def _tree_move(self, old: int, new: int):
+        """Один пользователь из old в new: пути обновления сходятся, общий хвост не трогается"""
+        tree = self._tree
+        size = len(tree)
+        i = old + 1
+        j = new + 1
+        while i != j:
+            if i < j:
+                if i >= size:
+                    break
+                tree[i] -= 1
+                i += i & -i
+            else:
+                if j >= size:
+                    break
+                tree[j] += 1
+                j += j & -j
+
+    def _grow(self, points: int):
+        """Расширяет дерево до степени двойки, покрывающей points"""
+        size = len(self._tree) - 1
+        while size <= points:
+            size *= 2
+
+        self._tree = [0] * (size + 1)
+        for value, bucket in self._buckets.items():
+            self._tree_add(value, len(bucket))
+
+    def update(self, uid: int, points: int):
+        """Ставит пользователю новое значение очков"""
+        points = max(points, 0)
+        old = self._points.get(uid)
+        if old == points:
+            return
+
+        if points >= len(self._tree) - 1:
+            self._grow(points)
+
+        if old is not None:
+            bucket = self._buckets[old]
+            del bucket[uid]
+            if not bucket:
+                del self._buckets[old]
+                del self._values[bisect_left(self._values, old)]
+
+        bucket = self._buckets.get(points)
+        if bucket is None:
+            bucket = self._buckets[points] = {}
+            insort(self._values, points)
+
+        bucket[uid] = None
+        self._points[uid] = points
+        if old is None:
+            self._tree_add(points, 1)
+        else:
+            self._tree_move(old, points)
+
+    def add(self, uid: int, delta: int):
+        """Прибавляет очки; пользователь без очков выбывает из индекса"""
+        points = self._points.get(uid, 0) + delta
+        if points > 0:
+            self.update(uid, points)
+        else:
+            self.remove(uid)
+    
+    def points(self, uid: int) -> int:
+        return self._points.get(uid, 0)
+    
+    def at_least(self, points: int) -> array:
+        """uid с очками не меньше points, от больших к меньшим"""
+        result = array('q')
+        values = self._values
+        for value in reversed(values[bisect_left(values, points):]):
+            result.extend(self._buckets[value])
+        return result
+    
+    def remove(self, uid: int):
+        old = self._points.pop(uid, None)
+        if old is None:
+            return
+
+        bucket = self._buckets[old]
+        del bucket[uid]
+        if not bucket:
+            del self._buckets[old]
+            del self._values[bisect_left(self._values, old)]
+        self._tree_add(old, -1)
+
+    def top(self, limit: int) -> List[int]:
+        """Первые limit пользователей за O(limit)"""
+        result = []
+        if limit <= 0:
+            return result
+
+        for value in reversed(self._values):
+            for uid in self._buckets[value]:
+                result.append(uid)
+                if len(result) >= limit:
+                    return result
+        return result
+
+    def count_above(self, points: int) -> int:
+        """Сколько пользователей имеют строго больше points очков"""
+        tree = self._tree
+        i = min(points + 1, len(tree) - 1)
+        not_above = 0
+        while i > 0:
+            not_above += tree[i]
+            i -= i & -i
+        return len(self._points) - not_above
+
+    def rank(self, uid: int) -> Optional[int]:
+        """Место пользователя за O(log P); одинаковые очки делят место"""
+        points = self._points.get(uid)
+        if points is None:
+            return None
+        return self.count_above(points) + 1
+
+
+# ==============================
+# 📅 РЕЙТИНГИ ЗА ПЕРИОД
+# ==============================
+
+class WindowedLeaderboard:
+    """Рейтинги за скользящие окна в календарных днях (сегодня, 7 и 30 дней).
+
+    Очки копятся по дням начисления: день → {uid: очки за день}. У каждого
+    окна свой LeaderboardIndex по сумме очков внутри окна. При смене суток
+    из индексов вычитаются только очки дня, выпавшего из окна, — топ и место
+    за период не требуют обхода пользователей.
+    """
+
+    __slots__ = ('windows', '_days', '_boards', '_span', '_today', '_today_start', '_today_end')
+
+    def __init__(self, windows: Dict[str, int]):
+        self.windows = windows
+        self._days: Dict[int, Dict[int, int]] = {}
+        self._boards = {name: LeaderboardIndex() for name in windows}
+        self._span = max(windows.values(), default=1)
+        self._today: int = 0
+        self._today_start: int = 0
+        self._today_end: int = 0
+        self._roll(int(time()))
+
+    @property
+    def first_day(self) -> int:
+        """Самый старый день, который ещё входит хоть в одно окно"""
+        return self._today - self._span + 1
+
+    def _roll(self, now: int):
+        """Смена суток: очки выпавших из окна дней вычитаются из его индекса"""
+        if self._today_start <= now < self._today_end:
+            return
+
+        previous = self._today
+        today = date.fromtimestamp(now)
+        start = datetime.combine(today, datetime.min.time())
+        self._today = today.toordinal()
+        self._today_start = int(start.timestamp())
+        self._today_end = int((start + timedelta(days=1)).timestamp())
+
+        for name, length in self.windows.items():
+            if self._today - previous >= length:
+                # Окно сдвинулось целиком — индекс проще начать заново
+                self._boards[name] = LeaderboardIndex()
+                continue
+            board = self._boards[name]
+            for day, points in self._days.items():
+                if previous - length < day <= self._today - length:
+                    for uid, value in points.items():
+                        board.add(uid, -value)
+
+        for day in [day for day in self._days if day < self.first_day]:
+            del self._days[day]
+
+    def apply(self, uid: int, day: int, delta: int):
+        """Прибавляет delta очков uid за день day (ординал); дни вне окон отбрасываются"""
+        if not delta or day < self.first_day:
+            return
+
+        points = self._days.get(day)
+        if points is None:
+            points = self._days[day] = {}
+        value = points.get(uid, 0) + delta
+        if value:
+            points[uid] = value
+        else:
+            del points[uid]
+
+        for name, length in self.windows.items():
+            if day > self._today - length:
+                self._boards[name].add(uid, delta)
+
+    def add(self, uid: int, points: int, now: int) -> int:
+        """Начисление в момент now; возвращает день, в который оно попало"""
+        if now >= self._today_end:
+            self._roll(now)
+        day = self._today if now >= self._today_start else date.fromtimestamp(now).toordinal()
+        self.apply(uid, day, points)
+        return day
+
+    def top(self, window: str, limit: int) -> List[tuple]:
+        """[(uid, очки за окно), ...] за O(limit)"""
+        self._roll(int(time()))
+        board = self._boards[window]
+        return [(uid, board.points(uid)) for uid in board.top(limit)]
+
+    def rank(self, window: str, uid: int) -> Optional[int]:
+        self._roll(int(time()))
+        return self._boards[window].rank(uid)
+
+    def points(self, window: str, uid: int) -> int:
+        self._roll(int(time()))
+        return self._boards[window].points(uid)
+
+    def value(self, day: int, uid: int) -> int:
+        """Очки uid за день day; 0 — если нет или день уже вне окон"""
+        return self._days.get(day, {}).get(uid, 0)
+
+    def cells(self) -> Iterator[tuple]:
+        """(день, uid, очки) по всем хранимым дням"""
+        for day, points in self._days.items():
+            for uid, value in points.items():
+                yield day, uid, value
+
+    def to_json(self, days: Optional[int] = None, uids: Optional[set] = None) -> Dict[str, Dict[str, int]]:
+        """{дата: {uid: очки}}; days — только последние дни, uids — только эти пользователи"""
+        first = self._today - days if days else 0
+        return {
+            date.fromordinal(day).isoformat(): {
+                str(uid): value for uid, value in points.items() if uids is None or uid in uids
+            }
+            for day, points in self._days.items() if day > first
+        }
+
+    def load_json(self, data: Dict[str, Dict[str, int]]):
+        """Значения из снимка или журнала — перекрывают текущие"""
+        for day, points in data.items():
+            day = date.fromisoformat(day).toordinal()
+            current = self._days.get(day, {})
+            for uid, value in points.items():
+                uid = int(uid)
+                self.apply(uid, day, value - current.get(uid, 0))
+
+
+# ==============================
+# 📈 ИНДЕКС АКТИВНОСТИ
+# ==============================
+
+class ActivityIndex:
+    """Инкрементальный индекс активности по календарным дням.
+
+    По каждому дню хранятся два счётчика: сколько пользователей были
+    активны в последний раз именно в этот день и сколько уникальных
+    пользователей было активно за день (DAU). «Активные за N дней» —
+    сумма N счётчиков, без обхода таблицы пользователей.
+    """
+
+    __slots__ = ('_last_day', '_dau', '_today', '_today_start', '_today_end')
+
+    def __init__(self):
+        self._last_day: Dict[int, int] = {}
+        self._dau: Dict[int, int] = {}
+        self._today: int = 0
+        self._today_start: int = 0
+        self._today_end: int = 0
+        self._roll(int(time()))
+
+    def _roll(self, now: int):
+        """Переход на новые сутки: сдвигает «сегодня» и чистит старые дни"""
+        if self._today_start <= now < self._today_end:
+            return
+
+        today = date.fromtimestamp(now)
+        start = datetime.combine(today, datetime.min.time())
+        self._today = today.toordinal()
+        self._today_start = int(start.timestamp())
+        self._today_end = int((start + timedelta(days=1)).timestamp())
+
+        horizon = self._today - config.ACTIVITY_HISTORY_DAYS
+        for counters in (self._last_day, self._dau):
+            for day in [day for day in counters if day <= horizon]:
+                del counters[day]
+
+    def _day(self, ts: int) -> int:
+        if self._today_start <= ts < self._today_end:
+            return self._today
+        return date.fromtimestamp(ts).toordinal()
+
+    def add(self, last_active: int):
+        """Пользователь при построении индекса"""
+        day = self._day(last_active)
+        if day > self._today - config.ACTIVITY_HISTORY_DAYS:
+            self._last_day[day] = self._last_day.get(day, 0) + 1
+
+    def finish_build(self):
+        """Сегодняшний DAU не меньше тех, кто уже был активен сегодня"""
+        today = self._today
+        self._dau[today] = max(self._dau.get(today, 0), self._last_day.get(today, 0))
+
+    def touch(self, prev: Optional[int], now: int):
+        """Активность пользователя; prev — его прошлый last_active (None — новый).
+        Сообщение из прошлых суток (догон) считается в свой день, если позже
+        пользователь активен не был"""
+        if now >= self._today_end:
+            self._roll(now)
+
+        if now >= self._today_start:
+            if prev is not None and prev >= self._today_start:
+                return
+            day = self._today
+        else:
+            day = self._day(now)
+            if day <= self._today - config.ACTIVITY_HISTORY_DAYS or prev is not None and self._day(prev) >= day:
+                return
+
+        if prev is not None:
+            prev_day = self._day(prev)
+            count = self._last_day.get(prev_day)
+            if count == 1:
+                del self._last_day[prev_day]
+            elif count:
+                self._last_day[prev_day] = count - 1
+
+        self._last_day[day] = self._last_day.get(day, 0) + 1
+        self._dau[day] = self._dau.get(day, 0) + 1
+
+    def merge(self, prev: Optional[int], last_active: int):
+        """Новый last_active от другой реплики — он может оказаться и не сегодняшним"""
+        if last_active >= self._today_start:
+            self.touch(prev, last_active)
+            return
+        
+        if prev is not None:
+            prev_day = self._day(prev)
+            count = self._last_day.get(prev_day)
+            if count == 1:
+                del self._last_day[prev_day]
+            elif count:
+                self._last_day[prev_day] = count - 1
+        self.add(last_active)
+    
+    def active_count(self, days: int) -> int:
+        """Активные за последние days календарных дней (0 и 1 — только сегодня)"""
+        self._roll(int(time()))
+        today = self._today
+        last_day = self._last_day
+        return sum(last_day.get(today - i, 0) for i in range(max(days, 1)))
+
+    def daily_history(self, days: int) -> List[tuple]:
+        """DAU за последние days дней: [(date, count), ...] от старых к новым"""
+        self._roll(int(time()))
+        today = self._today
+        return [(date.fromordinal(day), self._dau.get(day, 0)) for day in range(today - days + 1, today + 1)]
+
+    def history_json(self, days: Optional[int] = None) -> Dict[str, int]:
+        first = self._today - days if days else 0
+        return {date.fromordinal(day).isoformat(): count for day, count in self._dau.items() if day > first}
+
+    def load_history(self, data: Dict[str, int]):
+        for day, count in data.items():
+            self._dau[date.fromisoformat(day).toordinal()] = count
+    
+    def merge_history(self, data: Dict[str, int]):
+        """DAU другой реплики: по каждому дню берётся максимум"""
+        dau = self._dau
+        horizon = self._today - config.ACTIVITY_HISTORY_DAYS
+        for day, count in data.items():
+            day = date.fromisoformat(day).toordinal()
+            if day > horizon and count > dau.get(day, 0):
+                dau[day] = count
+
+
+# ==============================
+# 🚪 СОСТАВ ГРУППЫ
+# ==============================
+
+class MemberRoster:
+    """Состав группы по событиям входа и выхода — без обхода таблицы пользователей.
+
+    Для каждого, кто входил или выходил при боте, хранится одно число:
+    ординал дня входа, пока он в группе, или минус ординал дня выхода.
+    Рядом — входы и выходы по дням (отток за период — сумма нескольких
+    дней) и когорты по неделе входа: сколько вошло и сколько из них ещё
+    в группе. Повтор события (служебное сообщение и chat_member об одном
+    и том же входе) состояние не меняет. Бывшие в группе до бота хранятся
+    только числом base — его даёт getChatMemberCount.
+    """
+
+    __slots__ = ('_members', '_present', '_days', '_cohorts', 'base', 'synced', 'changed', 'resynced')
+
+    def __init__(self):
+        self._members: Dict[int, int] = {}
+        self._present: int = 0
+        # День → [входов, выходов]
+        self._days: Dict[int, List[int]] = {}
+        # Понедельник недели входа → [вошло, осталось]
+        self._cohorts: Dict[int, List[int]] = {}
+        self.base: Optional[int] = None
+        self.synced: int = 0
+        # uid, чьё состояние ещё не записано в журнал
+        self.changed: set = set()
+        # base сверен, а в журнал ещё не записан
+        self.resynced: bool = False
+
+    @staticmethod
+    def _week(day: int) -> int:
+        # Ординал 1 — понедельник
+        return day - (day - 1) % 7
+
+    def _day(self, day: int) -> List[int]:
+        counters = self._days.get(day)
+        if counters is None:
+            counters = self._days[day] = [0, 0]
+            horizon = day - config.ACTIVITY_HISTORY_DAYS
+            for old in [old for old in self._days if old <= horizon]:
+                del self._days[old]
+        return counters
+
+    @property
+    def count(self) -> Optional[int]:
+        """Участников сейчас; None — base ещё не получен"""
+        return None if self.base is None else self.base + self._present
+
+    def join(self, uid: int, day: int) -> bool:
+        state = self._members.get(uid)
+        if state is not None and state > 0:
+            return False
+
+        self._members[uid] = day
+        self._present += 1
+        self._day(day)[0] += 1
+        cohort = self._cohorts.get(self._week(day))
+        if cohort is None:
+            cohort = self._cohorts[self._week(day)] = [0, 0]
+        cohort[0] += 1
+        cohort[1] += 1
+        self.changed.add(uid)
+        return True
+
+    def leave(self, uid: int, day: int) -> bool:
+        state = self._members.get(uid)
+        if state is not None and state < 0:
+            return False
+
+        if state is None:
+            # Был в группе ещё до бота
+            if self.base:
+                self.base -= 1
+        else:
+            self._present -= 1
+            cohort = self._cohorts.get(self._week(state))
+            if cohort:
+                cohort[1] -= 1
+
+        self._members[uid] = -day
+        self._day(day)[1] += 1
+        self.changed.add(uid)
+        return True
+
+    def sync(self, count: int, now: int):
+        """Фактическое число участников: всё сверх известных боту — база"""
+        self.base = max(count - self._present, 0)
+        self.synced = now
+        self.resynced = True
+
+    def flow(self, days: int, today: int) -> tuple:
+        """(входов, выходов) за последние days дней"""
+        joins = leaves = 0
+        for day in range(today - days + 1, today + 1):
+            counters = self._days.get(day)
+            if counters:
+                joins += counters[0]
+                leaves += counters[1]
+        return joins, leaves
+
+    def churn(self, days: int, today: int) -> Optional[float]:
+        """Доля ушедших за период от состава на его начало"""
+        count = self.count
+        if count is None:
+            return None
+        joins, leaves = self.flow(days, today)
+        start = count - joins + leaves
+        return leaves / start if start > 0 else 0.0
+
+    def retention(self, days: int, today: int) -> Optional[float]:
+        """Доля ещё оставшихся из вошедших за последние days дней (по неделям входа)"""
+        first = self._week(today - days + 1)
+        joined = remaining = 0
+        for week, (count, left) in self._cohorts.items():
+            if week >= first:
+                joined += count
+                remaining += left
+        return remaining / joined if joined else None
+
+    def rows(self, uids: Optional[Iterable[int]] = None) -> List[tuple]:
+        """(uid, состояние) для записи; None — все"""
+        members = self._members
+        if uids is None:
+            return list(members.items())
+        return [(uid, members[uid]) for uid in uids if uid in members]
+
+    def to_json(self, uids: Optional[set] = None, members: bool = True) -> dict:
+        """uids — только эти участники, members=False — одни счётчики.
+
+        Дни и когорты пишутся целиком (не больше ACTIVITY_HISTORY_DAYS и по
+        одной на неделю): события приходят и задним числом — из очереди простоя.
+        """
+        data = {
+            'base': self.base,
+            'synced': self.synced,
+            'days': {date.fromordinal(day).isoformat(): counters for day, counters in self._days.items()},
+            'cohorts': {date.fromordinal(week).isoformat(): counters for week, counters in self._cohorts.items()}
+        }
+        if members:
+            source = self._members.items() if uids is None else self.rows(uids)
+            data['members'] = {str(uid): state for uid, state in source}
+        return data
+
+    def load_json(self, data: dict):
+        """Значения из снимка или журнала — перекрывают текущие"""
+        if 'base' in data:
+            self.base = data['base']
+            self.synced = data.get('synced', 0)
+        for day, counters in data.get('days', {}).items():
+            self._days[date.fromisoformat(day).toordinal()] = list(counters)
+        for week, counters in data.get('cohorts', {}).items():
+            self._cohorts[date.fromisoformat(week).toordinal()] = list(counters)
+        for uid, state in data.get('members', {}).items():
+            self.set(int(uid), state)
+
+    def set(self, uid: int, state: int):
+        old = self._members.get(uid)
+        self._present += (state > 0) - (old is not None and old > 0)
+        self._members[uid] = state
+
+
+# ==============================
+# 📒 ЖУРНАЛ ИЗМЕНЕНИЙ
+# ==============================
+
+class Journal:
+    """Append-only журнал поверх снимка: сегменты users.journal.<N>.
+
+    Запись — JSON-строка с абсолютными значениями строки пользователя
+    или состояния, поэтому повторное применение сегмента безопасно.
+    """
+
+    __slots__ = ('base', 'seq', 'size')
+
+    def __init__(self, base: str):
+        self.base = base
+        self.seq: int = 0
+        self.size: int = 0
+
+    def _path(self, seq: int) -> Path:
+        return Path(f"{self.base}.{seq}")
+
+    def segments(self) -> List[int]:
+        path = Path(self.base)
+        prefix = path.name + '.'
+        result = []
+
+        for segment in path.parent.glob(prefix + '*'):
+            suffix = segment.name[len(prefix):]
+            if suffix.isdigit():
+                result.append(int(suffix))
+        return sorted(result)
+
+    def read(self, first_seq: int) -> Iterator[list]:
+        """Записи всех сегментов начиная с first_seq"""
+        for seq in self.segments():
+            if seq < first_seq:
+                continue
+
+            with open(self._path(seq), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning(f"⚠️ Оборванная запись в {self._path(seq)}, остаток сегмента пропущен")
+                        break
+
+    def open_after(self, seq: int):
+        """Новые записи идут в свежий сегмент, старые не дописываются"""
+        segments = self.segments()
+        self.seq = max(segments[-1] + 1 if segments else 0, seq)
+        self.size = 0
+
+    def append(self, lines: List[str]) -> int:
+        if not lines:
+            return 0
+
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with open(self._path(self.seq), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(data)
+        return len(data)
+
+    def rotate(self) -> int:
+        """Закрывает текущий сегмент, возвращает номер следующего"""
+        if self.size:
+            self.seq += 1
+            self.size = 0
+        return self.seq
+
+    def drop_before(self, seq: int):
+        for old in self.segments():
+            if old < seq:
+                self._path(old).unlink(missing_ok=True)
+
+
+# ==============================
+# 📦 БИНАРНЫЙ СНИМОК
+# ==============================
+
+class BinarySnapshot:
+    """users.bin: снимок таблицы пользователей, который не нужно разбирать.
+
+    Заголовок (магия, версия формата, число строк), затем колонки int64
+    uid (по возрастанию), points, messages, commands, joined, last_active,
+    две колонки uint32 — концы строк name/username — и сами строки в UTF-8.
+    Файл отображается в память: колонки — memoryview поверх mmap, строка
+    пользователя ищется бинарным поиском по uid и собирается по запросу.
+    """
+
+    MAGIC = b'HAYU'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHQ')
+    INT_COLUMNS = ('uids', 'points', 'messages', 'commands', 'joined', 'last_active')
+
+    __slots__ = ('count', 'uids', 'points', 'messages', 'commands', 'joined', 'last_active',
+                 '_name_ends', '_username_ends', '_names', '_usernames', '_views', '_mmap')
+
+    def __init__(self, filename: str):
+        if sys.byteorder != 'little':
+            raise ValueError("Бинарный снимок поддерживается только на little-endian")
+
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, _, count = self.HEADER.unpack_from(self._mmap)
+            if magic != self.MAGIC:
+                raise ValueError(f"{filename}: не бинарный снимок")
+            if version != self.VERSION:
+                raise ValueError(f"{filename}: версия формата {version}, ожидалась {self.VERSION}")
+            self._map_columns(count)
+        except Exception:
+            self.close()
+            raise
+
+    def _map_columns(self, count: int):
+        self.count = count
+        view = memoryview(self._mmap)
+        self._views = [view]
+        offset = self.HEADER.size
+
+        def column(fmt: str, size: int) -> memoryview:
+            nonlocal offset
+            end = offset + size * count
+            if end > len(view):
+                raise ValueError("Бинарный снимок обрезан")
+            col = view[offset:end].cast(fmt)
+            self._views.append(col)
+            offset = end
+            return col
+
+        for name in self.INT_COLUMNS:
+            setattr(self, name, column('q', 8))
+        self._name_ends = column('I', 4)
+        self._username_ends = column('I', 4)
+
+        names_size = self._name_ends[-1] if count else 0
+        usernames_size = self._username_ends[-1] if count else 0
+        if offset + names_size + usernames_size > len(view):
+            raise ValueError("Бинарный снимок обрезан")
+        self._names = view[offset:offset + names_size]
+        self._usernames = view[offset + names_size:offset + names_size + usernames_size]
+        self._views += [self._names, self._usernames]
+
+    def close(self):
+        # mmap нельзя закрыть, пока на него смотрят memoryview
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def find(self, uid: int) -> int:
+        """Номер строки uid или -1"""
+        i = bisect_left(self.uids, uid)
+        return i if i < self.count and self.uids[i] == uid else -1
+
+    @staticmethod
+    def _text(blob: memoryview, ends: memoryview, i: int) -> str:
+        start = ends[i - 1] if i else 0
+        return str(blob[start:ends[i]], 'utf-8')
+
+    def row(self, i: int) -> tuple:
+        """Строка в порядке полей UserRecord"""
+        return (self._text(self._names, self._name_ends, i), self._text(self._usernames, self._username_ends, i),
+                self.points[i], self.messages[i], self.commands[i], self.joined[i], self.last_active[i])
+
+    def record(self, i: int) -> UserRecord:
+        return UserRecord(*self.row(i))
+
+    @classmethod
+    def write(cls, filename: str, rows: Iterable[tuple]) -> int:
+        """Пишет строки (uid, row), отсортированные по uid, и атомарно подменяет файл"""
+        if sys.byteorder != 'little':
+            raise ValueError("Бинарный снимок поддерживается только на little-endian")
+
+        columns = [array('q') for _ in cls.INT_COLUMNS]
+        uids, points, messages, commands, joined, last_active = columns
+        name_ends, username_ends = array('I'), array('I')
+        names, usernames = bytearray(), bytearray()
+
+        for uid, (name, username, pts, msgs, cmds, joined_at, active_at) in rows:
+            uids.append(uid)
+            points.append(pts)
+            messages.append(msgs)
+            commands.append(cmds)
+            joined.append(joined_at)
+            last_active.append(active_at)
+            names += name.encode('utf-8')
+            name_ends.append(len(names))
+            usernames += username.encode('utf-8')
+            username_ends.append(len(usernames))
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, len(uids))
+        chunks = [header, *columns, name_ends, username_ends, names, usernames]
+        return FastDataManager._atomic_write(filename, chunks, binary=True)
+
+
+class UserTable:
+    """Таблица пользователей поверх бинарного снимка, с интерфейсом dict.
+
+    Строки снимка превращаются в UserRecord при первом обращении и дальше
+    живут в live; новые пользователи попадают туда же и в added. Сам снимок
+    неизменяем — после записи нового таблица переключается на него (rebase).
+    """
+
+    __slots__ = ('snapshot', 'live', 'added')
+
+    def __init__(self, snapshot: BinarySnapshot):
+        self.snapshot = snapshot
+        self.live: Dict[int, UserRecord] = {}
+        self.added: set = set()
+
+    def get(self, uid: int, default=None):
+        user = self.live.get(uid)
+        if user is None:
+            i = self.snapshot.find(uid)
+            if i < 0:
+                return default
+            user = self.live[uid] = self.snapshot.record(i)
+        return user
+
+    def __getitem__(self, uid: int) -> UserRecord:
+        user = self.get(uid)
+        if user is None:
+            raise KeyError(uid)
+        return user
+
+    def __setitem__(self, uid: int, user: UserRecord):
+        if uid not in self.live and self.snapshot.find(uid) < 0:
+            self.added.add(uid)
+        self.live[uid] = user
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self.live or self.snapshot.find(uid) >= 0
+
+    def row(self, uid: int) -> Optional[tuple]:
+        """Поля строки без кэширования в live — для обходов вроде экспорта"""
+        user = self.live.get(uid)
+        if user is not None:
+            return user_row(user)
+        i = self.snapshot.find(uid)
+        return self.snapshot.row(i) if i >= 0 else None
+
+    def __len__(self) -> int:
+        return self.snapshot.count + len(self.added)
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self.snapshot.uids
+        yield from list(self.added)
+
+    keys = __iter__
+
+    def items(self) -> Iterator[tuple]:
+        """Все строки; не затронутые ранее читаются из снимка без кэширования"""
+        live = self.live
+        snapshot = self.snapshot
+        for i, uid in enumerate(snapshot.uids):
+            user = live.get(uid)
+            yield uid, user if user is not None else snapshot.record(i)
+        for uid in list(self.added):
+            yield uid, live[uid]
+
+    def rebase(self, snapshot: BinarySnapshot):
+        """Переход на свежий снимок; затронутые строки остаются в live"""
+        old, self.snapshot = self.snapshot, snapshot
+        self.added = {uid for uid in self.added if snapshot.find(uid) < 0}
+        old.close()
+
+
+# ==============================
+# 🔀 РЕПЛИКИ
+# ==============================
+
+class ReplicaLog:
+    """Вклад одной реплики в раздел чата — CRDT, который сливается без конфликтов.
+
+    Несколько процессов бота могут работать над одной папкой данных. Общий
+    снимок (users.json / users.bin с журналом) для них только читается,
+    а пишет каждый лишь свой вклад: G-счётчики этой реплики (очки,
+    сообщения, команды, total_messages, new_members, очки по дням для
+    рейтингов за период) и регистры — last_active сливается по max,
+    joined по min, DAU по дням по max.
+    Итог у всех реплик одинаков: снимок + сумма вкладов, в любом порядке
+    слияния. Команда merge-replicas сворачивает вклады в общий снимок.
+
+    Вклад — база replicas/<REPLICA_ID>.json с номером поколения и журнал
+    <REPLICA_ID>.<поколение>.log: сохранение дописывает строку с новыми
+    значениями только изменившихся записей и ячеек. Когда журнал вырастает
+    за REPLICA_COMPACT_BYTES, база переписывается целиком и начинается
+    следующее поколение. Соседи перечитывают базу лишь при смене поколения,
+    а из журнала — только хвост с прошлого раза.
+    """
+
+    DIR = "replicas"
+    EMPTY = (0, 0, 0, 0, 0, '', '')
+    # DAU в строке журнала — за последние дни; старые уже у соседей
+    HISTORY_DAYS = 2
+
+    __slots__ = ('replica_id', 'dir', 'users', 'state', 'windows', 'peers', 'generation', 'log_size',
+                 'changed', 'changed_windows', 'compact_due', '_seen')
+
+    def __init__(self, root: Path, replica_id: str):
+        self.replica_id = replica_id
+        self.dir = root / self.DIR
+        # uid → (points, messages, commands, last_active, joined, name, username); кортежи
+        # неизменяемы, поэтому для записи в потоке хватает поверхностной копии словаря
+        self.users: Dict[int, tuple] = {}
+        self.state: Dict[str, int] = {'total_messages': 0, 'new_members': 0}
+        # День (ординал) → {uid: очки этой реплики за день}
+        self.windows: Dict[int, Dict[int, int]] = {}
+        # Слитое состояние каждой чужой реплики (база + прочитанный журнал) — от него считается прирост
+        self.peers: Dict[str, dict] = {}
+        self.generation: int = 0
+        self.log_size: int = 0
+        # Изменилось с прошлого сохранения: uid и (день, uid)
+        self.changed: set = set()
+        self.changed_windows: set = set()
+        self.compact_due: bool = False
+        # replica_id → (отметка базы, поколение, прочитано байт журнала)
+        self._seen: Dict[str, tuple] = {}
+
+    def _file(self, replica_id: str) -> Path:
+        return self.dir / f"{replica_id}.json"
+
+    def _log(self, replica_id: str, generation: int) -> Path:
+        return self.dir / f"{replica_id}.{generation}.log"
+
+    def files(self, replica_id: str) -> List[Path]:
+        """База и все журналы реплики"""
+        return [self._file(replica_id), *self.dir.glob(f"{replica_id}.*.log")]
+
+    def add(self, uid: int, user: UserRecord, points: int = 0, messages: int = 0, commands: int = 0):
+        """Прирост счётчиков этой реплики; регистры берутся из объединённой записи"""
+        old_points, old_messages, old_commands, last_active, joined, name, username = self.users.get(uid, self.EMPTY)
+        self.users[uid] = (
+            old_points + points, old_messages + messages, old_commands + commands,
+            max(last_active, user.last_active), min(joined, user.joined) if joined else user.joined,
+            name or user.name, username or user.username
+        )
+        self.changed.add(uid)
+
+    def count(self, key: str, delta: int = 1):
+        self.state[key] += delta
+
+    def add_window(self, uid: int, day: int, points: int):
+        bucket = self.windows.get(day)
+        if bucket is None:
+            bucket = self.windows[day] = {}
+        bucket[uid] = bucket.get(uid, 0) + points
+        self.changed_windows.add((day, uid))
+
+    def _apply_own(self, data: dict):
+        """Строка своего журнала (или база) — новые значения поверх текущих"""
+        for uid, slot in data.get('users', {}).items():
+            self.users[int(uid)] = tuple(slot)
+        self.state.update(data.get('state', {}))
+        for day, points in data.get('window_points', {}).items():
+            bucket = self.windows.setdefault(date.fromisoformat(day).toordinal(), {})
+            for uid, value in points.items():
+                bucket[int(uid)] = value
+
+    def load_own(self) -> dict:
+        """Свой вклад после рестарта (база + журнал) — счётчики продолжаются с сохранённых значений"""
+        data = FastDataManager._load_json(str(self._file(self.replica_id)), {})
+        self.generation = data.get('generation', 0)
+        self._apply_own(data)
+        history = dict(data.get('daily_active', {}))
+
+        path = self._log(self.replica_id, self.generation)
+        lines, self.log_size = self._read_log(path, 0)
+        for line in lines:
+            self._apply_own(line)
+            history.update(line.get('daily_active', {}))
+        if path.exists() and path.stat().st_size > self.log_size:
+            # Строка, оборванная на записи, — иначе следующая допишется к её хвосту
+            os.truncate(path, self.log_size)
+
+        full = self.full_json(0, history)
+        self.changed.clear()
+        self.changed_windows.clear()
+        return full
+
+    def full_json(self, first_day: int, history: Dict[str, int]) -> dict:
+        """Весь вклад — для базы при свёртке; дни, выпавшие из всех окон, забываются"""
+        for day in [day for day in self.windows if day < first_day]:
+            del self.windows[day]
+        self.changed.clear()
+        self.changed_windows.clear()
+        return {
+            'replica': self.replica_id,
+            'state': dict(self.state),
+            'daily_active': history,
+            'window_points': {date.fromordinal(day).isoformat(): {str(uid): value for uid, value in points.items()}
+                              for day, points in self.windows.items()},
+            'users': {str(uid): slot for uid, slot in self.users.items()}
+        }
+
+    def delta_json(self, first_day: int, history: Dict[str, int]) -> dict:
+        """Строка журнала: новые значения того, что изменилось с прошлого сохранения"""
+        users, windows = self.users, self.windows
+        cells: Dict[str, Dict[str, int]] = {}
+        for day, uid in self.changed_windows:
+            if day >= first_day:
+                cells.setdefault(date.fromordinal(day).isoformat(), {})[str(uid)] = windows[day][uid]
+
+        data = {
+            'state': dict(self.state),
+            'daily_active': history,
+            'window_points': cells,
+            'users': {str(uid): users[uid] for uid in self.changed}
+        }
+        self.changed.clear()
+        self.changed_windows.clear()
+        return data
+
+    @staticmethod
+    def _read_log(path: Path, offset: int) -> tuple:
+        """Целые строки журнала с offset: ([строка, ...], новый offset)"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        end = chunk.rfind(b'\n') + 1
+        return [json.loads(line) for line in chunk[:end].splitlines() if line], offset + end
+
+    def _advance(self, replica_id: str, line: dict) -> dict:
+        """Строка чужого журнала поверх слитого состояния; возвращает прежние значения её ключей"""
+        peer = self.peers.setdefault(replica_id, {})
+        users = peer.setdefault('users', {})
+        windows = peer.setdefault('window_points', {})
+        prev = {'users': {}, 'window_points': {}, 'state': peer.get('state', {})}
+
+        for key, slot in line.get('users', {}).items():
+            if key in users:
+                prev['users'][key] = users[key]
+            users[key] = slot
+        for day, points in line.get('window_points', {}).items():
+            bucket = windows.setdefault(day, {})
+            prev['window_points'][day] = {key: bucket[key] for key in points if key in bucket}
+            bucket.update(points)
+        peer['state'] = {**prev['state'], **line.get('state', {})}
+        return prev
+
+    def poll(self) -> List[tuple]:
+        """Прирост чужих вкладов с прошлого раза: [(replica_id, новое, прежнее), ...] (в потоке)"""
+        changed = []
+        if not self.dir.exists():
+            return changed
+
+        # До первой свёртки у реплики есть только журнал
+        ids = {path.stem for path in self.dir.glob("*.json")}
+        ids.update(path.name.rsplit('.', 2)[0] for path in self.dir.glob("*.log"))
+        ids.discard(self.replica_id)
+
+        for replica_id in sorted(ids):
+            path = self._file(replica_id)
+            try:
+                stat = path.stat()
+                mark = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                mark = None
+            seen, generation, offset = self._seen.get(replica_id, (None, 0, 0))
+
+            if mark != seen:
+                # Новое поколение: база — полное состояние, прирост считается от всего слитого
+                data = FastDataManager._load_json(str(path), None)
+                if data is None:
+                    continue
+                changed.append((replica_id, data, self.peers.get(replica_id, {})))
+                # Копия: строки журнала меняют слитое, а база ещё ждёт слияния
+                self.peers[replica_id] = {
+                    'users': dict(data.get('users', {})),
+                    'window_points': {day: dict(points) for day, points in data.get('window_points', {}).items()},
+                    'state': dict(data.get('state', {}))
+                }
+                generation, offset = data.get('generation', 0), 0
+
+            lines, offset = self._read_log(self._log(replica_id, generation), offset)
+            for line in lines:
+                changed.append((replica_id, line, self._advance(replica_id, line)))
+            self._seen[replica_id] = (mark, generation, offset)
+        return changed
+
+    def append(self, data: dict) -> int:
+        """Дописывает строку в журнал своего поколения (в потоке)"""
+        self.dir.mkdir(exist_ok=True)
+        line = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+        with open(self._log(self.replica_id, self.generation), 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.log_size += len(line)
+        return len(line)
+
+    def compact(self, data: dict) -> int:
+        """Свёртка: база целиком со следующим поколением, старый журнал удаляется (в потоке)"""
+        self.dir.mkdir(exist_ok=True)
+        old = self._log(self.replica_id, self.generation)
+        data['generation'] = self.generation + 1
+        written = FastDataManager._atomic_write(str(self._file(self.replica_id)),
+                                                [json.dumps(data, ensure_ascii=False, separators=(',', ':'))])
+        self.generation += 1
+        self.log_size = 0
+        self.compact_due = False
+        old.unlink(missing_ok=True)
+        return written
+
+
+# ==============================
+# 💾 DATA MANAGER
+# ==============================
+
+class FastDataManager:
+    """Менеджер данных одного чата с кэшированием; файлы лежат в root.
+
+    Загружается в фоне (load): сначала таблица пользователей, потом индексы.
+    Обработчики ждут только нужную им часть — wait_ready('leaderboard') и т. п.
+    """
+    
+    READY_PARTS = ('users', 'leaderboard', 'activity')
+    # Участники состава пишутся в состояние; у SQLite — в свою таблицу
+    ROSTER_IN_STATE = True
+    
+    __slots__ = ('chat_id', 'root', 'state', 'users', 'save_stats', 'version', '_dirty', '_dirty_users',
+                 '_leaderboard', '_windows', '_activity', '_roster', '_journal', '_cow', '_lock',
+                 '_ready', '_waiters', '_building', '_snapshot_due', '_loader', '_oldest', 'replica')
+    
+    def __init__(self, chat_id: int = 0, root: Path = Path('.')):
+        self.chat_id = chat_id
+        self.root = root
+        self.state: Dict = self._state_from_json({})
+        self.users: Dict[int, UserRecord] = {}
+        self.save_stats: Dict = {'saves': 0, 'bytes_total': 0, 'kind': None,
+                                 'duration': 0.0, 'blocked': 0.0, 'bytes': 0, 'rows': 0}
+        # Растёт при каждом изменении данных — ключ кэша отрисованных экранов
+        self.version: int = 0
+        self._dirty: bool = False
+        self._dirty_users: set = set()
+        self._leaderboard = LeaderboardIndex()
+        self._windows = WindowedLeaderboard(config.TOP_WINDOWS)
+        self._activity = ActivityIndex()
+        self._roster = MemberRoster()
+        self._journal = Journal(self._path(config.JOURNAL_FILE))
+        self._cow: Optional[Dict] = None
+        self._lock = asyncio.Lock()
+        self._ready: set = set()
+        self._waiters: Dict[str, asyncio.Event] = {}
+        # Пока индекс строится по снимку: uid, начиная с которого строки ещё не учтены
+        self._building: Dict[str, int] = {}
+        self._snapshot_due: bool = False
+        self._loader: Optional[asyncio.Task] = None
+        # Самое раннее время событий с прошлой записи журнала (0 — не было): догон меняет и прошлые дни
+        self._oldest: int = 0
+        # Режим реплик: общий снимок только читается, свои изменения — в ReplicaLog
+        self.replica: Optional[ReplicaLog] = None
+        if config.REPLICA_ID and config.STORAGE_BACKEND == "json":
+            self.replica = ReplicaLog(root, config.REPLICA_ID)
+    
+    def _path(self, filename: str) -> str:
+        return str(self.root / filename)
+    
+    def close(self):
+        """Освобождает ресурсы перед выгрузкой из памяти; данные уже сохранены"""
+        if isinstance(self.users, UserTable):
+            self.users.snapshot.close()
+    
+    def start_loading(self):
+        self._loader = asyncio.create_task(self.load())
+    
+    async def load(self):
+        """Фоновая загрузка: с бинарным снимком таблица готова сразу, индексы строятся порциями"""
+        started = perf_counter()
+        
+        try:
+            snapshot = await asyncio.to_thread(self._load_users)
+            if snapshot is None:
+                await asyncio.to_thread(self._rebuild_indexes)
+            else:
+                self._mark_ready('users')
+                await self._build_indexes(snapshot)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки чата {self.chat_id}: {e}")
+        
+        self._mark_ready(*self.READY_PARTS)
+        logger.info(f"💬 Загружен чат {self.chat_id}: {self.total_users} пользователей "
+                    f"за {(perf_counter() - started) * 1000:.0f} мс")
+    
+    def _load_all(self):
+        """Синхронная загрузка целиком (миграции, бенчмарки)"""
+        self._load_users()
+        self._rebuild_indexes()
+    
+    def _load_users(self) -> Optional[BinarySnapshot]:
+        """Состояние, таблица пользователей и журнал, без индексов; снимок — если таблица из users.bin"""
+        state_data = self._load_json(self._path(config.STATE_FILE), {})
+        self.state = self._state_from_json(state_data)
+        self._activity.load_history(state_data.get('daily_active', {}))
+        self._windows.load_json(state_data.get('window_points', {}))
+        self._roster.load_json(state_data.get('roster', {}))
+        
+        snapshot = self._open_snapshot()
+        if snapshot is not None:
+            self.users = UserTable(snapshot)
+        else:
+            self.users = {
+                int(uid): UserRecord.from_json(data)
+                for uid, data in self._load_json(self._path(config.USERS_FILE), {}).items()
+            }
+        
+        # Снимок не в том формате, что в конфиге, перепишется при первом сохранении
+        self._snapshot_due = (snapshot is not None) != (config.SNAPSHOT_FORMAT == "binary")
+        
+        replayed = self._replay_journal()
+        if replayed:
+            logger.info(f"📒 Из журнала восстановлено записей: {replayed}")
+            # Без журнального режима сегменты свернутся в снимок при первом сохранении
+            self._snapshot_due |= not config.JOURNAL_ENABLED
+        
+        if self.replica is not None:
+            self._load_replicas()
+            return snapshot
+        
+        self._dirty = self._snapshot_due and bool(replayed or self.users)
+        return snapshot
+    
+    def _load_replicas(self):
+        """Вклады всех реплик поверх общего снимка, до постройки индексов"""
+        replica = self.replica
+        sources = [(replica.replica_id, replica.load_own(), {})] if replica.replica_id else []
+        
+        for _, data, prev in sources + replica.poll():
+            self._merge_replica(data, prev, indexed=False)
+        
+        # Снимок общий — его перепишет только merge-replicas
+        self._snapshot_due = False
+        logger.info(f"🔀 Реплика {replica.replica_id or '—'}: слито вкладов {len(sources) + len(replica.peers)}")
+    
+    def _merge_replica(self, data: dict, prev: dict, indexed: bool):
+        """Прибавляет к объединённым записям прирост вклада реплики с прошлого слияния"""
+        prev_users = prev.get('users', {})
+        users = self.users
+        
+        for key, slot in data.get('users', {}).items():
+            old = prev_users.get(key)
+            if old == slot:
+                continue
+            
+            points, messages, commands, last_active, joined, name, username = slot
+            old_points, old_messages, old_commands = old[:3] if old else (0, 0, 0)
+            uid = int(key)
+            
+            user = users.get(uid)
+            prev_active = None
+            if user is None:
+                user = users[uid] = UserRecord(name, username, 0, 0, 0, joined, last_active)
+            else:
+                prev_active = user.last_active
+                user.joined = min(user.joined, joined) if joined else user.joined
+                user.last_active = max(user.last_active, last_active)
+                user.name = user.name or sys.intern(name)
+                user.username = user.username or username
+            
+            user.points += points - old_points
+            user.messages += messages - old_messages
+            user.commands += commands - old_commands
+            
+            if indexed:
+                if user.last_active != prev_active and (not self._building or self._covered('activity', uid)):
+                    self._activity.merge(prev_active, user.last_active)
+                if not self._building or self._covered('leaderboard', uid):
+                    self._leaderboard.update(uid, user.points)
+        
+        prev_windows = prev.get('window_points', {})
+        for day, points in data.get('window_points', {}).items():
+            old = prev_windows.get(day, {})
+            ordinal = date.fromisoformat(day).toordinal()
+            for key, value in points.items():
+                self._windows.apply(int(key), ordinal, value - old.get(key, 0))
+        
+        prev_state = prev.get('state', {})
+        for key, value in data.get('state', {}).items():
+            if key in ('total_messages', 'new_members'):
+                self.state[key] += value - prev_state.get(key, 0)
+        self._activity.merge_history(data.get('daily_active', {}))
+        self.version += 1
+    
+    async def merge_replicas(self):
+        """Подтягивает изменившиеся вклады других реплик"""
+        if self.replica is None or 'activity' not in self._ready:
+            return
+        
+        for _, data, prev in await asyncio.to_thread(self.replica.poll):
+            self._merge_replica(data, prev, indexed=True)
+    
+    def _open_snapshot(self) -> Optional[BinarySnapshot]:
+        """users.bin, если он есть; при обоих файлах верен тот, что в формате конфига"""
+        path = Path(self._path(config.SNAPSHOT_FILE))
+        if not path.exists():
+            return None
+        if config.SNAPSHOT_FORMAT != "binary" and Path(self._path(config.USERS_FILE)).exists():
+            return None
+        
+        try:
+            return BinarySnapshot(str(path))
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка загрузки {path}: {e}")
+            return None
+    
+    def _mark_ready(self, *parts: str):
+        self._ready.update(parts)
+        for part in parts:
+            waiter = self._waiters.pop(part, None)
+            if waiter is not None:
+                waiter.set()
+    
+    async def wait_ready(self, part: str):
+        """Ждёт, пока загрузится часть данных: 'users', 'leaderboard' или 'activity'"""
+        if part in self._ready:
+            return
+        waiter = self._waiters.get(part)
+        if waiter is None:
+            waiter = self._waiters[part] = asyncio.Event()
+        await waiter.wait()
+    
+    def _covered(self, part: str, uid: int) -> bool:
+        """Учтён ли uid строящимся индексом; нет — его значение индекс возьмёт сам"""
+        cursor = self._building.get(part)
+        return cursor is None or uid < cursor or self.users.snapshot.find(uid) < 0
+    
+    async def _build_indexes(self, snapshot: BinarySnapshot):
+        """Индексы по колонкам снимка порциями по LOAD_CHUNK строк, не занимая цикл.
+
+        Строки обходятся по возрастанию uid. Изменения пользователей, до которых
+        постройка ещё не дошла, в индекс не пишутся (_covered) — постройка сама
+        возьмёт их текущие значения из live.
+        """
+        live = self.users.live
+        uids = snapshot.uids
+        leaderboard, activity = self._leaderboard, self._activity
+        self._building = dict.fromkeys(('leaderboard', 'activity'), -2 ** 63)
+        
+        # Новые из журнала в снимке отсутствуют — их учитываем сразу
+        for uid in self.users.added:
+            user = live[uid]
+            leaderboard.update(uid, user.points)
+            activity.add(user.last_active)
+        
+        for part, column in (('leaderboard', snapshot.points), ('activity', snapshot.last_active)):
+            for start in range(0, snapshot.count, config.LOAD_CHUNK):
+                end = min(start + config.LOAD_CHUNK, snapshot.count)
+                self._building[part] = uids[end] if end < snapshot.count else uids[end - 1] + 1
+                
+                for uid, value in zip(uids[start:end], column[start:end]):
+                    user = live.get(uid)
+                    if part == 'leaderboard':
+                        leaderboard.update(uid, user.points if user is not None else value)
+                    else:
+                        activity.add(user.last_active if user is not None else value)
+                await asyncio.sleep(0)
+            
+            if part == 'activity':
+                activity.finish_build()
+            del self._building[part]
+            self._mark_ready(part)
+    
+    @staticmethod
+    def _state_from_json(state_data: dict) -> dict:
+        now_iso = datetime.now().isoformat()
+        
+        return {
+            'total_messages': state_data.get('total_messages', 0),
+            'new_members': state_data.get('new_members', 0),
+            'bot_started': datetime.fromisoformat(state_data.get('bot_started', now_iso)),
+            'journal_seq': state_data.get('journal_seq', 0)
+        }
+    
+    def _state_to_json(self, history: bool = True) -> dict:
+        state = {
+            'total_messages': self.state['total_messages'],
+            'new_members': self.state['new_members'],
+            'bot_started': self.state['bot_started'].isoformat(),
+            'journal_seq': self.state['journal_seq']
+        }
+        
+        if history:
+            state['daily_active'] = self._activity.history_json()
+            state['window_points'] = self._windows.to_json()
+            state['roster'] = self._roster.to_json(members=self.ROSTER_IN_STATE)
+        return state
+    
+    def _replay_journal(self) -> int:
+        """Накатывает сегменты журнала, не вошедшие в снимок"""
+        first_seq = self.state['journal_seq']
+        count = 0
+        
+        for record in self._journal.read(first_seq):
+            kind = record[0]
+            if kind == 'u':
+                _, uid, name, username, points, messages, commands, joined, last_active = record
+                self.users[int(uid)] = UserRecord(
+                    name, username, points, messages, commands,
+                    to_epoch(joined), to_epoch(last_active)
+                )
+            elif kind == 's':
+                self.state = self._state_from_json({**record[1], 'journal_seq': first_seq})
+            elif kind == 'd':
+                self._activity.load_history(record[1])
+            elif kind == 'w':
+                self._windows.load_json(record[1])
+            elif kind == 'r':
+                self._roster.load_json(record[1])
+            count += 1
+        
+        self._journal.open_after(first_seq)
+        return count
+    
+    def _journal_lines(self, uids: set, members: set, resynced: bool = False, oldest: int = 0) -> List[str]:
+        """Строки журнала для изменившихся пользователей, состава и состояния.
+        oldest — самое раннее время событий: DAU и очки за дни пишутся начиная с его дня"""
+        lines = []
+        days = 2
+        if oldest:
+            days = max(days, date.today().toordinal() - date.fromtimestamp(oldest).toordinal() + 1)
+        
+        for uid in uids:
+            lines.append(json.dumps(
+                ['u', uid, *user_row(self.users[uid])],
+                ensure_ascii=False, separators=(',', ':')
+            ))
+        
+        # В строку состояния история DAU не входит — только затронутые дни, обычно вчера и сегодня
+        lines.append(json.dumps(['s', self._state_to_json(history=False)], ensure_ascii=False, separators=(',', ':')))
+        lines.append(json.dumps(['d', self._activity.history_json(days)], separators=(',', ':')))
+        if uids:
+            lines.append(json.dumps(['w', self._windows.to_json(days, uids)], separators=(',', ':')))
+        if members or resynced:
+            lines.append(json.dumps(['r', self._roster.to_json(members)], separators=(',', ':')))
+        return lines
+    
+    def _preserve(self, uid: int, user: UserRecord):
+        """Copy-on-write: пока пишется снимок, сохраняет строку до изменения"""
+        cow = self._cow
+        if cow is not None and uid not in cow:
+            cow[uid] = user_row(user)
+    
+    def _begin_snapshot(self) -> tuple:
+        """Дешёвая согласованная точка снимка (в цикле, без I/O)"""
+        self.state['journal_seq'] = self._journal.rotate()
+        self._cow = {}
+        users = self.users
+        if isinstance(users, UserTable):
+            # Нетронутые строки неизменны в старом снимке — копируем только live
+            return users.snapshot, dict(users.live), self._state_to_json()
+        return None, dict(users), self._state_to_json()
+    
+    def _snapshot_rows(self, base: Optional[BinarySnapshot], frozen: dict, ordered: bool) -> Iterator[tuple]:
+        """Строки (uid, row) снимка: frozen поверх base; ordered — по возрастанию uid"""
+        cow = self._cow
+        
+        def frozen_row(uid: int) -> tuple:
+            # Сначала копия, потом проверка cow: если строку уже начали
+            # менять, её исходная версия гарантированно лежит в cow
+            row = user_row(frozen[uid])
+            return cow.get(uid, row)
+        
+        if base is None and not ordered:
+            for uid in frozen:
+                yield uid, frozen_row(uid)
+            return
+        
+        pending = sorted(frozen)
+        j = 0
+        if base is not None:
+            for i, uid in enumerate(base.uids):
+                while j < len(pending) and pending[j] < uid:
+                    yield pending[j], frozen_row(pending[j])
+                    j += 1
+                if j < len(pending) and pending[j] == uid:
+                    yield uid, frozen_row(uid)
+                    j += 1
+                else:
+                    yield uid, base.row(i)
+        
+        for uid in pending[j:]:
+            yield uid, frozen_row(uid)
+    
+    def _write_snapshot(self, base: Optional[BinarySnapshot], frozen: dict, state: dict) -> int:
+        """Сериализация и запись снимка (в рабочем потоке)"""
+        binary = config.SNAPSHOT_FORMAT == "binary"
+        rows = self._snapshot_rows(base, frozen, ordered=binary)
+        
+        def user_chunks():
+            yield '{'
+            sep = '\n'
+            for uid, row in rows:
+                yield f'{sep}"{uid}": {json.dumps(UserRecord.row_to_json(row), ensure_ascii=False)}'
+                sep = ',\n'
+            yield '\n}\n'
+        
+        # Сначала пользователи, потом состояние с journal_seq: при сбое между
+        # ними журнал просто накатится повторно
+        if binary:
+            written = BinarySnapshot.write(self._path(config.SNAPSHOT_FILE), rows)
+        else:
+            written = self._atomic_write(self._path(config.USERS_FILE), user_chunks())
+        written += self._atomic_write(self._path(config.STATE_FILE), [json.dumps(state, ensure_ascii=False, indent=2)])
+        self._journal.drop_before(state['journal_seq'])
+        
+        # Снимок в другом формате теперь устарел
+        Path(self._path(config.USERS_FILE if binary else config.SNAPSHOT_FILE)).unlink(missing_ok=True)
+        return written
+    
+    @staticmethod
+    def _atomic_write(filename: str, chunks, binary: bool = False) -> int:
+        """Пишет во временный файл и атомарно подменяет им filename"""
+        tmp = f"{filename}.tmp"
+        
+        with open(tmp, 'wb') if binary else open(tmp, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+            written = f.tell()
+        
+        os.replace(tmp, filename)
+        return written
+    
+    def _record_save(self, kind: str, started: float, blocked: float, written: int, rows: int = 0):
+        duration = perf_counter() - started
+        stats = self.save_stats
+        stats['saves'] += 1
+        stats['bytes_total'] += written
+        stats.update(kind=kind, duration=duration, blocked=blocked, bytes=written, rows=rows)
+        metrics.observe_save(kind, duration, blocked, written)
+        logger.debug(f"💾 Сохранено ({kind}): {written} B, строк {rows} за {duration * 1000:.0f} мс, "
+                     f"цикл занят {blocked * 1000:.1f} мс")
+    
+    def _rebuild_indexes(self):
+        """Строит индексы рейтинга и активности с нуля (только при загрузке)"""
+        self._leaderboard = LeaderboardIndex()
+        activity = self._activity
+        
+        for uid, user in self.users.items():
+            self._leaderboard.update(uid, user.points)
+            activity.add(user.last_active)
+        
+        activity.finish_build()
+        self._ready.update(self.READY_PARTS)
+    
+    @staticmethod
+    def _load_json(filename: str, default: dict) -> dict:
+        path = Path(filename)
+        if not path.exists():
+            return default
+        
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except Exception as e:
             logger.error(f"Ошибка загрузки {filename}: {e}")
             return default
     
-    async def save_all(self):
-        """Безопасное сохранение с Lock"""
+    async def save_all(self) -> bool:
+        """Сохранение: точка снимка берётся в цикле, сериализация и запись — в потоке.
+        False — записать не удалось, изменения остались на следующий раз"""
+        async with self._lock:
+            if not self._dirty:
+                return True
+            # Снимок старого mmap нельзя подменять, пока по нему строятся индексы
+            await self.wait_ready('activity')
+            
+            if self.replica is not None:
+                return await self._save_replica()
+            
+            started = perf_counter()
+            self._dirty = False
+            uids, self._dirty_users = self._dirty_users, set()
+            members, self._roster.changed = self._roster.changed, set()
+            resynced, self._roster.resynced = self._roster.resynced, False
+            oldest, self._oldest = self._oldest, 0
+            blocked = 0.0
+            
+            try:
+                if config.JOURNAL_ENABLED and not self._snapshot_due:
+                    lines = self._journal_lines(uids, members, resynced, oldest)
+                    blocked = perf_counter() - started
+                    written = await asyncio.to_thread(self._journal.append, lines)
+                    
+                    if self._journal.size < config.JOURNAL_COMPACT_BYTES:
+                        self._record_save('journal', started, blocked, written, len(uids))
+                        return True
+                    
+                    logger.info(f"📒 Компакция журнала ({self._journal.size // 1024} KB)")
+                    uids = set()
+                
+                mark = perf_counter()
+                base, frozen, state = self._begin_snapshot()
+                rows = len(self.users)
+                blocked += perf_counter() - mark
+                written = await asyncio.to_thread(self._write_snapshot, base, frozen, state)
+                self._snapshot_due = False
+                
+                if base is not None and config.SNAPSHOT_FORMAT == "binary":
+                    self.users.rebase(BinarySnapshot(self._path(config.SNAPSHOT_FILE)))
+                self._record_save('snapshot', started, blocked, written, rows)
+                return True
+            except Exception as e:
+                self._dirty_users |= uids
+                self._roster.changed |= members
+                self._roster.resynced |= resynced
+                if oldest:
+                    self._touched(oldest)
+                self._dirty = True
+                logger.error(f"Ошибка сохранения: {e}")
+                return False
+            finally:
+                self._cow = None
+    
+    async def _save_replica(self) -> bool:
+        """Режим реплик: в свой журнал — только изменившееся, общий снимок не трогается"""
+        started = perf_counter()
+        self._dirty = False
+        self._dirty_users = set()
+        replica = self.replica
+        first_day = self._windows.first_day
+        compact = replica.compact_due or replica.log_size >= config.REPLICA_COMPACT_BYTES
+        rows = len(replica.changed) if not compact else len(replica.users)
+        
+        try:
+            if compact:
+                data = replica.full_json(first_day, self._activity.history_json())
+                blocked = perf_counter() - started
+                written = await asyncio.to_thread(replica.compact, data)
+            else:
+                data = replica.delta_json(first_day, self._activity.history_json(ReplicaLog.HISTORY_DAYS))
+                blocked = perf_counter() - started
+                written = await asyncio.to_thread(replica.append, data)
+            self._record_save('replica', started, blocked, written, rows)
+            return True
+        except Exception as e:
+            # Изменения уже сняты с учёта — следующее сохранение перепишет вклад целиком
+            replica.compact_due = True
+            self._dirty = True
+            logger.error(f"Ошибка сохранения вклада реплики: {e}")
+            return False
+    
+    def get_user(self, user_id: int, now: Optional[int] = None) -> UserRecord:
+        """Запись пользователя; новая — с входом и активностью now (по умолчанию сейчас)"""
+        user = self.users.get(user_id)
+        
+        if user is None:
+            now = int(time()) if now is None else now
+            user = self.users[user_id] = UserRecord(joined=now, last_active=now)
+            self._activity.touch(None, now)
+            self._changed(user_id, user, True)
+            if self.replica is not None:
+                self.replica.add(user_id, user)
+        
+        return user
+    
+    def peek_user(self, user_id: int) -> Optional[UserRecord]:
+        """Запись без создания и без изменения версии"""
+        return self.users.get(user_id)
+    
+    def track_message(self, user_id: int, username: str = "", first_name: str = ""):
+        """Отслеживание одного текстового сообщения (бот трекает пакетами через Ingest)"""
+        now = int(time())
+        points = points_rules.message(self, user_id, 'text', now)
+        self.track_messages({user_id: [1, points, username, first_name]}, now)
+    
+    def track_messages(self, counts: Dict[int, list], now: int):
+        """Пакет сообщений: uid → [сколько, очков, username, first_name], одно время на весь пакет —
+        время отправки (Ingest складывает пакеты по дням). Очки уже посчитаны по points_rules"""
+        replica = self.replica
+        total = 0
+        self._touched(now)
+        
+        for user_id, (count, awarded, username, first_name) in counts.items():
+            user = self.get_user(user_id, now)
+            self._preserve(user_id, user)
+            if not self._building or self._covered('activity', user_id):
+                self._activity.touch(user.last_active, now)
+            user.messages += count
+            if now > user.last_active:
+                user.last_active = now
+            total += count
+            
+            if username and not user.username:
+                user.username = username
+            if first_name and not user.name:
+                user.name = sys.intern(first_name)
+            
+            user.points += awarded
+            self._award(user_id, awarded, now)
+            self._changed(user_id, user, awarded != 0)
+            
+            if replica is not None:
+                replica.add(user_id, user, awarded, messages=count)
+        
+        self.state['total_messages'] += total
+        if replica is not None:
+            replica.count('total_messages', total)
+    
+    def track_command(self, user_id: int, command: str = "", sent: Optional[int] = None):
+        """Отслеживание команды; очки — по весу команды в points_rules.
+        sent — время отправки (догон передаёт дату сообщения), по умолчанию сейчас"""
+        now = int(time()) if sent is None else sent
+        points = points_rules.command(self, user_id, command, now)
+        self._touched(now)
+        user = self.get_user(user_id, now)
+        self._preserve(user_id, user)
+        user.commands += 1
+        user.points += points
+        if not self._building or self._covered('activity', user_id):
+            self._activity.touch(user.last_active, now)
+        if now > user.last_active:
+            user.last_active = now
+        self._award(user_id, points, now)
+        self._changed(user_id, user, points != 0)
+        
+        if self.replica is not None:
+            self.replica.add(user_id, user, points, commands=1)
+    
+    def _touched(self, now: int):
+        if now < self._oldest or not self._oldest:
+            self._oldest = now
+    
+    def track_new_member(self, user_id: int, now: Optional[int] = None) -> bool:
+        """Вход в группу; повтор того же входа (служебное сообщение и chat_member) не считается"""
+        now = int(time()) if now is None else now
+        if not self._roster.join(user_id, date.fromtimestamp(now).toordinal()):
+            return False
+        
+        self.state['new_members'] += 1
+        self.version += 1
+        self._dirty = True
+        
+        if self.replica is not None:
+            self.replica.count('new_members')
+        return True
+    
+    def track_left_member(self, user_id: int, now: Optional[int] = None) -> bool:
+        """Выход или исключение из группы"""
+        now = int(time()) if now is None else now
+        if not self._roster.leave(user_id, date.fromtimestamp(now).toordinal()):
+            return False
+        
+        self.version += 1
+        self._dirty = True
+        return True
+    
+    def sync_member_count(self, count: int):
+        self._roster.sync(count, int(time()))
+        self.version += 1
+        self._dirty = True
+    
+    @property
+    def roster(self) -> MemberRoster:
+        return self._roster
+    
+    def _award(self, uid: int, points: int, now: int) -> Optional[int]:
+        """Начисленные очки — в рейтинги за период, по дню начисления; возвращает день"""
+        if points:
+            day = self._windows.add(uid, points, now)
+            if self.replica is not None:
+                self.replica.add_window(uid, day, points)
+            return day
+        return None
+    
+    def _changed(self, uid: int, user: UserRecord, points_changed: bool):
+        """Общий хвост всех изменений строки пользователя"""
+        if points_changed and (not self._building or self._covered('leaderboard', uid)):
+            self._leaderboard.update(uid, user.points)
+        self.version += 1
+        self._dirty_users.add(uid)
+        self._dirty = True
+    
+    def get_top_users(self, limit: int = 10) -> list:
+        """Топ из индекса рейтинга, без сортировки таблицы"""
+        users = self.users
+        return [(uid, users[uid]) for uid in self._leaderboard.top(limit)]
+    
+    def get_user_rank(self, user_id: int) -> Optional[int]:
+        return self._leaderboard.rank(user_id)
+    
+    def export_rows(self, min_points: int = 0, active_since: int = 0) -> Iterator[tuple]:
+        """Строки (uid, row) для экспорта с отбором по очкам и последней активности.
+
+        Генератор читается между отправками кусков. Список uid фиксируется
+        сразу — при min_points по индексу рейтинга, без обхода остальных, —
+        а строки берутся по одной: таблица целиком не копируется.
+        """
+        users = self.users
+        if isinstance(users, UserTable):
+            get_row = users.row
+        else:
+            def get_row(uid: int) -> Optional[tuple]:
+                user = users.get(uid)
+                return user_row(user) if user is not None else None
+        
+        uids = self._leaderboard.at_least(min_points) if min_points > 0 else array('q', users)
+        for uid in uids:
+            row = get_row(uid)
+            # Очки и активность могли измениться, пока шёл экспорт
+            if row is not None and row[2] >= min_points and row[6] >= active_since:
+                yield uid, row
+    
+    def get_window_top(self, window: str, limit: int = 10) -> list:
+        """Топ за период: [(uid, запись, очки за период), ...]; строк не создаёт"""
+        top = []
+        for uid, points in self._windows.top(window, limit):
+            user = self.peek_user(uid)
+            if user is not None:
+                top.append((uid, user, points))
+        return top
+    
+    def get_window_rank(self, window: str, user_id: int) -> Optional[int]:
+        return self._windows.rank(window, user_id)
+    
+    def get_window_points(self, window: str, user_id: int) -> int:
+        return self._windows.points(window, user_id)
+    
+    @property
+    def total_users(self) -> int:
+        return len(self.users)
+    
+    def get_active_count(self, days: int = 7) -> int:
+        """Активные за N календарных дней по индексу активности"""
+        return self._activity.active_count(days)
+    
+    def get_daily_active(self, days: int = 30) -> List[tuple]:
+        """История DAU для графиков трендов"""
+        return self._activity.daily_history(days)
+
+
+# ==============================
+# 🗄️ SQLITE BACKEND
+# ==============================
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    username TEXT NOT NULL DEFAULT '',
+    points INTEGER NOT NULL DEFAULT 0,
+    messages INTEGER NOT NULL DEFAULT 0,
+    commands INTEGER NOT NULL DEFAULT 0,
+    joined INTEGER NOT NULL,
+    last_active INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_points ON users (points DESC);
+CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    uid INTEGER PRIMARY KEY,
+    state INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS window_points (
+    day INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (day, uid)
+) WITHOUT ROWID;
+"""
+
+SQLITE_USER_COLUMNS = "uid, name, username, points, messages, commands, joined, last_active"
+
+SQLITE_UPSERT_USER = f"""
+INSERT INTO users ({SQLITE_USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(uid) DO UPDATE SET
+    name = excluded.name, username = excluded.username, points = excluded.points,
+    messages = excluded.messages, commands = excluded.commands,
+    joined = excluded.joined, last_active = excluded.last_active
+"""
+
+# key: 'state' — счётчики, 'history' — история активности и состава
+SQLITE_UPSERT_STATE = "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)"
+
+SQLITE_UPSERT_WINDOW = "INSERT OR REPLACE INTO window_points (day, uid, points) VALUES (?, ?, ?)"
+
+SQLITE_UPSERT_MEMBER = "INSERT OR REPLACE INTO members (uid, state) VALUES (?, ?)"
+
+
+class SqliteDataManager(FastDataManager):
+    """Хранилище SQLite (WAL) с тем же интерфейсом, что у FastDataManager.
+
+    В памяти — только LRU-кэш строк, несохранённые изменения и счётчики
+    индекса активности. Топ и место считаются по индексу points; перед
+    такими запросами изменения сбрасываются одной транзакцией.
+
+    Очки за дни лежат в window_points построчно, и сброс пишет только
+    изменившиеся ячейки. История активности и состава — строка 'history'
+    в state, её пишет лишь save_all: сброс перед запросом остаётся
+    пропорционален изменениям, а не длине истории.
+    """
+
+    __slots__ = ('_conn', '_rows', '_total', '_dirty_windows')
+    
+    ROSTER_IN_STATE = False
+
+    def _load_all(self):
+        self._conn = self.connect(self._path(config.SQLITE_FILE))
+        self._rows: OrderedDict = OrderedDict()
+        self._dirty_windows: set = set()
+
+        rows = dict(self._conn.execute("SELECT key, value FROM state"))
+        # До window_points и 'history' всё лежало в одной строке 'state'
+        state_data = json.loads(rows.get('state', '{}'))
+        state_data.update(json.loads(rows.get('history', '{}')))
+        self.state = self._state_from_json(state_data)
+        self._total: int = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+        # Индекс активности строится по диапазону индекса last_active, без полного обхода
+        self._activity.load_history(state_data.get('daily_active', {}))
+        windows = self._windows
+        if 'window_points' in state_data:
+            windows.load_json(state_data['window_points'])
+            self._dirty_windows.update((day, uid) for day, uid, _ in windows.cells())
+            self._dirty = True
+        for day, uid, points in self._conn.execute(
+            "SELECT day, uid, points FROM window_points WHERE day >= ?", (windows.first_day,)
+        ):
+            windows.apply(uid, day, points - windows.value(day, uid))
+        self._roster.load_json(state_data.get('roster', {}))
+        for uid, state in self._conn.execute("SELECT uid, state FROM members"):
+            self._roster.set(uid, state)
+        horizon = int((datetime.now() - timedelta(days=config.ACTIVITY_HISTORY_DAYS)).timestamp())
+        for (last_active,) in self._conn.execute("SELECT last_active FROM users WHERE last_active >= ?", (horizon,)):
+            self._activity.add(last_active)
+        self._activity.finish_build()
+
+        logger.info(f"🗄️ SQLite: {self._path(config.SQLITE_FILE)}, пользователей {self._total}")
+
+    async def load(self):
+        # Соединение SQLite привязано к потоку, где открыто, — открываем в цикле
+        self._load_all()
+        self._mark_ready(*self.READY_PARTS)
+    
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def connect(filename: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(filename, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SQLITE_SCHEMA)
+        return conn
+
+    @staticmethod
+    def _row_to_db(uid: int, user: UserRecord) -> tuple:
+        return (uid, *user_row(user))
+
+    @staticmethod
+    def _row_from_db(row: tuple) -> UserRecord:
+        return UserRecord(*row[1:])
+
+    def _flush(self, history: bool = False) -> int:
+        """Пакетный upsert изменившихся строк, очков за дни и счётчиков одной транзакцией;
+        history — ещё история активности и состава и чистка выпавших из окон дней"""
+        uids, self._dirty_users = self._dirty_users, set()
+        members, self._roster.changed = self._roster.changed, set()
+        cells, self._dirty_windows = self._dirty_windows, set()
+        batch = [self._row_to_db(uid, self._rows[uid]) for uid in uids]
+        value = self._windows.value
+        windows = [(day, uid, value(day, uid)) for day, uid in cells]
+        conn = self._conn
+
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(SQLITE_UPSERT_USER, batch)
+            conn.executemany(SQLITE_UPSERT_MEMBER, self._roster.rows(members))
+            conn.executemany(SQLITE_UPSERT_WINDOW, [cell for cell in windows if cell[2]])
+            conn.executemany("DELETE FROM window_points WHERE day = ? AND uid = ?",
+                             [(day, uid) for day, uid, points in windows if not points])
+            conn.execute(SQLITE_UPSERT_STATE, ('state', json.dumps(self._state_to_json(history=False))))
+            if history:
+                conn.execute("DELETE FROM window_points WHERE day < ?", (self._windows.first_day,))
+                conn.execute(SQLITE_UPSERT_STATE, ('history', json.dumps({
+                    'daily_active': self._activity.history_json(),
+                    'roster': self._roster.to_json(members=False)
+                }, ensure_ascii=False)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            self._dirty_users |= uids
+            self._roster.changed |= members
+            self._dirty_windows |= cells
+            raise
+
+        return len(batch)
+
+    def _flush_pending(self):
+        """Запросам по индексам нужны уже записанные изменения"""
+        if self._dirty_users:
+            self._flush()
+
+    def _award(self, uid: int, points: int, now: int) -> Optional[int]:
+        day = super()._award(uid, points, now)
+        if day is not None:
+            self._dirty_windows.add((day, uid))
+        return day
+
+    async def save_all(self) -> bool:
         async with self._lock:
             if not self._dirty:
-                return
-            
+                return True
+
+            started = perf_counter()
+            self._dirty = False
             try:
-                state_to_save = {
-                    'last_fb_post': self.state['last_fb_post'].isoformat(),
-                    'last_bot_reminder': self.state['last_bot_reminder'].isoformat(),
-                    'total_messages': self.state['total_messages'],
-                    'new_members': self.state['new_members'],
-                    'bot_started': self.state['bot_started'].isoformat()
-                }
-                
-                with open(config.STATE_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(state_to_save, f, ensure_ascii=False, indent=2)
-                
-                with open(config.USERS_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(self.users, f, ensure_ascii=False, indent=2)
-                
-                self._dirty = False
-                logger.debug("💾 Данные сохранены")
+                rows = self._flush(history=True)
+                self._record_save('sqlite', started, perf_counter() - started, 0, rows)
+                return True
             except Exception as e:
+                self._dirty = True
                 logger.error(f"Ошибка сохранения: {e}")
-    
-    def get_user(self, user_id: int) -> dict:
-        uid = str(user_id)
-        
-        if uid in self._user_cache:
-            return self._user_cache[uid]
-        
-        if uid not in self.users:
-            self.users[uid] = {
-                'name': '',
-                'username': '',
-                'points': 0,
-                'messages': 0,
-                'commands': 0,
-                'joined': datetime.now().isoformat(),
-                'last_active': datetime.now().isoformat()
-            }
-            self._dirty = True
+                return False
+
+    def get_user(self, user_id: int, now: Optional[int] = None) -> UserRecord:
+        rows = self._rows
+
+        user = rows.get(user_id)
+        if user is not None:
+            rows.move_to_end(user_id)
+            return user
+
+        found = self._conn.execute(
+            f"SELECT {SQLITE_USER_COLUMNS} FROM users WHERE uid = ?", (user_id,)
+        ).fetchone()
+
+        if found:
+            user = self._row_from_db(found)
+        else:
+            now = int(time()) if now is None else now
+            user = UserRecord(joined=now, last_active=now)
+            self._total += 1
+            self._activity.touch(None, now)
+            self._changed(user_id, user, True)
+
+        rows[user_id] = user
+        if len(rows) > config.SQLITE_CACHE_SIZE:
+            # Вытесняем только сохранённые строки
+            self._flush_pending()
+            while len(rows) > config.SQLITE_CACHE_SIZE:
+                rows.popitem(last=False)
+
+        return user
+
+    def peek_user(self, user_id: int) -> Optional[UserRecord]:
+        user = self._rows.get(user_id)
+        if user is not None:
+            return user
+
+        found = self._conn.execute(
+            f"SELECT {SQLITE_USER_COLUMNS} FROM users WHERE uid = ?", (user_id,)
+        ).fetchone()
+        return self._row_from_db(found) if found else None
+
+    def _changed(self, uid: int, user: UserRecord, points_changed: bool):
+        self.version += 1
+        self._dirty_users.add(uid)
+        self._dirty = True
+
+    def get_top_users(self, limit: int = 10) -> list:
+        self._flush_pending()
+        found = self._conn.execute(
+            f"SELECT {SQLITE_USER_COLUMNS} FROM users ORDER BY points DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+        rows = self._rows
+        return [(row[0], rows.get(row[0]) or self._row_from_db(row)) for row in found]
+
+    def get_user_rank(self, user_id: int) -> Optional[int]:
+        points = self.get_user(user_id).points
+        self._flush_pending()
+        above = self._conn.execute("SELECT COUNT(*) FROM users WHERE points > ?", (points,)).fetchone()[0]
+        return above + 1
+
+    @property
+    def total_users(self) -> int:
+        return self._total
+
+    def export_rows(self, min_points: int = 0, active_since: int = 0) -> Iterator[tuple]:
+        self._flush_pending()
+        # Отдельное соединение только для чтения: в WAL оно видит неизменный
+        # снимок, пока основное продолжает писать
+        conn = sqlite3.connect(f"file:{self._path(config.SQLITE_FILE)}?mode=ro", uri=True)
+        try:
+            for uid, *row in conn.execute(
+                f"SELECT {SQLITE_USER_COLUMNS} FROM users WHERE points >= ? AND last_active >= ?",
+                (min_points, active_since)
+            ):
+                yield uid, tuple(row)
+        finally:
+            conn.close()
+
+
+def migrate_json_to_sqlite():
+    """Разовый перенос users.json / bot_state.json (с журналом) каждого чата в SQLite"""
+    for root in open_chats().chat_dirs():
+        source = FastDataManager(int(root.name), root)
+        source._load_all()
+        filename = source._path(config.SQLITE_FILE)
+        conn = SqliteDataManager.connect(filename)
+        batch = []
+
+        conn.execute("BEGIN")
+        try:
+            for uid, user in source.users.items():
+                batch.append(SqliteDataManager._row_to_db(uid, user))
+                if len(batch) >= 10_000:
+                    conn.executemany(SQLITE_UPSERT_USER, batch)
+                    batch = []
+
+            conn.executemany(SQLITE_UPSERT_USER, batch)
+            conn.executemany(SQLITE_UPSERT_MEMBER, source.roster.rows())
+            conn.executemany(SQLITE_UPSERT_WINDOW, source._windows.cells())
+            # Разложено так же, как пишет _flush: сброс перед запросом перепишет только 'state'
+            conn.execute(SQLITE_UPSERT_STATE, ('state', json.dumps(source._state_to_json(history=False))))
+            conn.execute(SQLITE_UPSERT_STATE, ('history', json.dumps({
+                'daily_active': source._activity.history_json(),
+                'roster': source.roster.to_json(members=False)
+            }, ensure_ascii=False)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        logger.info(f"✅ Перенесено в {filename}: {len(source.users)} пользователей")
+
+
+def merge_replica_files():
+    """Разовое сворачивание вкладов реплик в общий снимок; все реплики должны быть остановлены"""
+    for root in open_chats().chat_dirs():
+        part = FastDataManager(int(root.name), root)
+        part.replica = ReplicaLog(root, "")
+        part._load_all()
+        merged = list(part.replica.peers)
+        if not merged:
+            continue
         
-        self._user_cache[uid] = self.users[uid]
-        return self.users[uid]
+        part._cow = {}
+        part._write_snapshot(*part._begin_snapshot())
+        part.close()
+        for replica_id in merged:
+            for path in part.replica.files(replica_id):
+                path.unlink(missing_ok=True)
+        logger.info(f"✅ Чат {root.name}: вклады {', '.join(merged)} свёрнуты в снимок, "
+                    f"пользователей {part.total_users}")
+
+
+# ==============================
+# 🧾 ЭКСПОРТ
+# ==============================
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = ('uid', *UserRecord.__slots__)
+
+
+class EchoWriter:
+    """«Файл» для csv.writer: writerow возвращает готовую строку, ничего не записывая"""
+
+    @staticmethod
+    def write(line: str) -> str:
+        return line
+
+
+class ExportFile(InputFile):
+    """Документ Bot API, куски которого генерируются и сжимаются по ходу отправки"""
+
+    def __init__(self, make_chunks: Callable[[], Iterator[bytes]], filename: str):
+        super().__init__(filename=filename)
+        self.make_chunks = make_chunks
+        self.written: int = 0
+
+    async def read(self, bot: Bot):
+        # Повторная отправка (RetryAfter) начинает экспорт заново
+        self.written = 0
+        for chunk in self.make_chunks():
+            self.written += len(chunk)
+            yield chunk
+            await asyncio.sleep(0)
+
+
+def parse_since(value: str) -> int:
+    """Граница активности: дата YYYY-MM-DD или число календарных дней (1 — сегодня)"""
+    if value.isdigit():
+        day = date.today() - timedelta(days=max(int(value), 1) - 1)
+    else:
+        day = date.fromisoformat(value)
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
+
+
+def export_summary(db: FastDataManager, min_points: int, active_since: int) -> dict:
+    """Агрегаты чата — первая строка JSON Lines и подпись к документу"""
+    return {
+        'chat_id': db.chat_id,
+        'exported_at': datetime.now().isoformat(timespec='seconds'),
+        'bot_started': db.state['bot_started'].isoformat(),
+        'total_users': db.total_users,
+        'total_messages': db.state['total_messages'],
+        'new_members': db.state['new_members'],
+        'active_today': db.get_active_count(0),
+        'active_week': db.get_active_count(7),
+        'min_points': min_points,
+        'active_since': datetime.fromtimestamp(active_since).isoformat() if active_since else None
+    }
+
+
+def export_lines(db: FastDataManager, fmt: str, min_points: int = 0, active_since: int = 0) -> Iterator[str]:
+    """Строки экспорта: CSV с заголовком или JSON Lines со сводкой по чату в первой строке"""
+    rows = db.export_rows(min_points, active_since)
     
-    def track_message(self, user_id: int, username: str = "", first_name: str = ""):
-        """Отслеживание обычного сообщения"""
-        user = self.get_user(user_id)
-        user['messages'] += 1
-        user['last_active'] = datetime.now().isoformat()
-        
-        if username and not user['username']:
-            user['username'] = username
-        if first_name and not user['name']:
-            user['name'] = first_name
+    if fmt == 'csv':
+        writer = csv.writer(EchoWriter())
+        yield writer.writerow(EXPORT_COLUMNS)
+        for uid, (name, username, points, messages, commands, joined, last_active) in rows:
+            yield writer.writerow((uid, name, username, points, messages, commands,
+                                   datetime.fromtimestamp(joined).isoformat(),
+                                   datetime.fromtimestamp(last_active).isoformat()))
+        return
+    
+    summary = export_summary(db, min_points, active_since)
+    yield json.dumps({'type': 'chat', **summary}, ensure_ascii=False) + '\n'
+    for uid, row in rows:
+        yield json.dumps({'type': 'user', 'uid': uid, **UserRecord.row_to_json(row)}, ensure_ascii=False) + '\n'
+
+
+def export_chunks(lines: Iterable[str], compress: bool = True) -> Iterator[bytes]:
+    """Склеивает строки в куски по EXPORT_CHUNK_SIZE и на лету сжимает их в gzip"""
+    gzip = zlib.compressobj(config.EXPORT_COMPRESS_LEVEL, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size < config.EXPORT_CHUNK_SIZE:
+            continue
         
-        if user['messages'] % 10 == 0:
-            user['points'] += config.POINTS_PER_10_MESSAGES
+        data = ''.join(buffer).encode()
+        buffer = []
+        size = 0
+        if gzip is not None:
+            data = gzip.compress(data)
+        if data:
+            yield data
+    
+    data = ''.join(buffer).encode()
+    if gzip is not None:
+        data = gzip.compress(data) + gzip.flush()
+    if data:
+        yield data
+
+
+def export_filename(chat_id: int, fmt: str, compress: bool = True) -> str:
+    return f"haybot_{chat_id}_{date.today().isoformat()}.{fmt}{'.gz' if compress else ''}"
+
+
+def export_cli(argv: List[str]):
+    """Экспорт раздела чата в файл или stdout; бот при этом может работать"""
+    parser = argparse.ArgumentParser(prog="bot.py export", description="Потоковый экспорт пользователей чата")
+    parser.add_argument('--chat', type=int, default=config.CHAT_ID)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--min-points', type=int, default=0)
+    parser.add_argument('--since', help="дата YYYY-MM-DD или число дней активности")
+    parser.add_argument('--output', help="файл; '-' — stdout; по умолчанию haybot_<chat>_<дата>.<формат>.gz")
+    parser.add_argument('--no-gzip', action='store_true')
+    args = parser.parse_args(argv)
+    
+    root = open_chats().root / str(args.chat)
+    if not root.is_dir():
+        parser.error(f"нет данных чата {args.chat} в {chats.root}")
+    
+    manager = SqliteDataManager if config.STORAGE_BACKEND == "sqlite" else FastDataManager
+    part = manager(args.chat, root)
+    part._load_all()
+    active_since = parse_since(args.since) if args.since else 0
+    compress = not args.no_gzip
+    output = args.output or export_filename(args.chat, args.format, compress)
+    
+    started = perf_counter()
+    written = 0
+    f = open(output, 'wb') if output != '-' else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(export_lines(part, args.format, args.min_points, active_since), compress):
+            f.write(chunk)
+            written += len(chunk)
+    finally:
+        if f is not sys.stdout.buffer:
+            f.close()
+        part.close()
+    logger.info(f"🧾 Экспорт чата {args.chat} ({args.format}) в {output}: {written} B "
+                f"за {(perf_counter() - started) * 1000:.0f} мс")
+
+
+async def is_admin(chat_id: int, user_id: int) -> bool:
+    """Администратор группы, чей раздел запрошен, или id из ADMIN_IDS"""
+    if user_id in config.ADMIN_IDS:
+        return True
+    try:
+        member = await bot.get_chat_member(chat_id, user_id)
+    except TelegramBadRequest:
+        return False
+    return member.status in (ChatMemberStatus.CREATOR, ChatMemberStatus.ADMINISTRATOR)
+
+
+def parse_export_args(args: Optional[str]) -> tuple:
+    """/export [csv|jsonl] [min=N] [since=YYYY-MM-DD|N] → (формат, min_points, active_since)"""
+    fmt, min_points, active_since = 'csv', 0, 0
+    for arg in (args or '').split():
+        key, _, value = arg.lower().partition('=')
+        if key in EXPORT_FORMATS and not value:
+            fmt = key
+        elif key == 'min':
+            min_points = int(value)
+        elif key == 'since':
+            active_since = parse_since(value)
+        else:
+            raise ValueError(arg)
+    return fmt, min_points, active_since
+
+
+# Одновременно идёт только один экспорт — он долго занимает цикл кусками
+export_lock = asyncio.Lock()
+
+
+# ==============================
+# 💬 ЧАТЫ
+# ==============================
+
+class ChatPartitions:
+    """Данные по чатам: chats/<chat_id>/ со своими файлами и индексами.
+
+    Раздел чата загружается при первом апдейте из него и выгружается
+    (после сохранения), если чат молчит дольше CHAT_IDLE_TIMEOUT, — память
+    растёт с числом активных чатов, а не всех. Список известных групп
+    лежит отдельно в chats.json, чтобы планировщик не поднимал разделы.
+    """
+
+    def __init__(self):
+        self.root = Path(config.CHATS_DIR)
+        self.loaded: Dict[int, FastDataManager] = {}
+        self.known: Dict[int, dict] = {}
+        self._used: Dict[int, float] = {}
+        self._known_dirty: bool = False
+
+        self.root.mkdir(exist_ok=True)
+        self._migrate_legacy()
+        self._load_known()
+        self.register(config.CHAT_ID)
+
+    def _migrate_legacy(self):
+        """Файлы единственной группы из корня переезжают в раздел CHAT_ID"""
+        legacy = [Path(name) for name in (config.STATE_FILE, config.USERS_FILE, config.SQLITE_FILE)]
+        legacy += Path('.').glob(f"{config.JOURNAL_FILE}.*")
+        legacy = [path for path in legacy if path.exists()]
+        if not legacy:
+            return
+
+        target = self.root / str(config.CHAT_ID)
+        if target.exists():
+            logger.warning(f"⚠️ В корне остались файлы {[str(p) for p in legacy]}, но {target} уже есть — не трогаю")
+            return
+
+        state = FastDataManager._load_json(config.STATE_FILE, {})
+        target.mkdir()
+        for path in legacy:
+            os.replace(path, target / path.name)
+
+        # Время последних постов подхватит планировщик
+        self.known[config.CHAT_ID] = {key: state[key] for key in ('last_fb_post', 'last_bot_reminder') if key in state}
+        self._write_known()
+        logger.info(f"📦 Данные группы перенесены в {target}")
+
+    def _load_known(self):
+        data = FastDataManager._load_json(str(self.root / config.CHATS_FILE), {})
+        self.known.update((int(chat_id), meta) for chat_id, meta in data.items())
+
+    def _write_known(self) -> int:
+        data = {str(chat_id): meta for chat_id, meta in self.known.items()}
+        if config.REPLICA_ID:
+            # Группы, которые нашли другие реплики, не затираем
+            data = {**FastDataManager._load_json(str(self.root / config.CHATS_FILE), {}), **data}
+        return FastDataManager._atomic_write(str(self.root / config.CHATS_FILE),
+                                             [json.dumps(data, ensure_ascii=False, indent=2)])
+
+    def register(self, chat_id: int) -> bool:
+        """Запоминает группу; True — если она новая"""
+        if chat_id in self.known or chat_id > 0:
+            return False
+        self.known[chat_id] = {}
+        self._known_dirty = True
+        return True
+
+    def unregister(self, chat_id: int):
+        if self.known.pop(chat_id, None) is not None:
+            self._known_dirty = True
+
+    def chat_dirs(self) -> List[Path]:
+        return sorted(path for path in self.root.iterdir() if path.is_dir() and path.name.lstrip('-').isdigit())
+
+    def get(self, chat_id: int) -> FastDataManager:
+        part = self.loaded.get(chat_id)
+
+        if part is None:
+            root = self.root / str(chat_id)
+            root.mkdir(exist_ok=True)
+            manager = SqliteDataManager if config.STORAGE_BACKEND == "sqlite" else FastDataManager
+            part = self.loaded[chat_id] = manager(chat_id, root)
+            part.start_loading()
+            if self.register(chat_id):
+                jobs.add_chat(chat_id)
+
+        self._used[chat_id] = monotonic()
+        return part
+
+    def for_chat(self, chat: Optional[types.Chat]) -> FastDataManager:
+        """Раздел, из которого отвечать: в личке — домашняя группа CHAT_ID"""
+        if chat is None or chat.type == "private":
+            return self.get(config.CHAT_ID)
+        return self.get(chat.id)
+
+    @property
+    def total_users(self) -> int:
+        return sum(part.total_users for part in self.loaded.values())
+
+    async def save_all(self) -> bool:
+        """False — хотя бы один раздел записать не удалось"""
+        saved = True
+        for part in list(self.loaded.values()):
+            saved = await part.save_all() and saved
+
+        if self._known_dirty:
+            self._known_dirty = False
+            try:
+                await asyncio.to_thread(self._write_known)
+            except Exception as e:
+                self._known_dirty = True
+                saved = False
+                logger.error(f"Ошибка сохранения {config.CHATS_FILE}: {e}")
+        return saved
+
+    async def merge_replicas(self):
+        for part in list(self.loaded.values()):
+            await part.merge_replicas()
+    
+    async def evict_idle(self):
+        """Сохраняет и выгружает разделы чатов, молчащих дольше CHAT_IDLE_TIMEOUT"""
+        deadline = monotonic() - config.CHAT_IDLE_TIMEOUT
+
+        for chat_id in [cid for cid, used in self._used.items() if used < deadline]:
+            part = self.loaded[chat_id]
+            await part.save_all()
+
+            # Пока шло сохранение, в чат могли написать или что-то осталось несохранённым;
+            # после flush событий для этого раздела в очереди уже нет
+            ingest.flush()
+            if part._dirty or self._used[chat_id] >= deadline:
+                continue
+
+            part.close()
+            del self.loaded[chat_id], self._used[chat_id]
+            screens.forget(chat_id)
+            points_rules.forget(chat_id)
+            logger.info(f"💤 Выгружен чат {chat_id}")
+
+
+# Создаётся в main() и командах CLI: конструктор заводит папку, переносит старые файлы и пишет chats.json
+chats: Optional[ChatPartitions] = None
+
+
+def open_chats() -> ChatPartitions:
+    global chats
+    if chats is None:
+        chats = ChatPartitions()
+    return chats
+
+
+class ChatMiddleware(BaseMiddleware):
+    """Подставляет обработчикам раздел чата аргументом db"""
+
+    async def __call__(
+        self,
+        handler,
+        event: TelegramObject,
+        data: dict
+    ):
+        message = event.message if isinstance(event, types.CallbackQuery) else event
+        db = data['db'] = chats.for_chat(message.chat if message else None)
+        await db.wait_ready('users')
+        return await handler(event, data)
+
+
+# ==============================
+# ⏰ ПЛАНИРОВЩИК
+# ==============================
+
+class CronSpec:
+    """Cron из пяти полей: минута, час, день месяца, месяц, день недели (0 и 7 — воскресенье).
+
+    Поддерживаются *, числа, списки через запятую, диапазоны a-b и шаг /n.
+    Если заданы и день месяца, и день недели, подходит любой из них — как в cron.
+    """
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    __slots__ = ('minutes', 'hours', 'days', 'months', 'weekdays', 'any_day', 'any_weekday')
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Ожидалось 5 полей cron: {expr!r}")
+
+        parsed = [self._parse(field, lo, hi) for field, (lo, hi) in zip(fields, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> frozenset:
+        values = set()
+
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, end = lo, hi
+            elif '-' in span:
+                start, end = map(int, span.split('-'))
+            else:
+                start = int(span)
+                end = hi if step else start
+
+            if not lo <= start <= end <= hi:
+                raise ValueError(f"Поле cron вне диапазона {lo}-{hi}: {part!r}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+
+        return frozenset(values)
+
+    def _day_matches(self, day: datetime) -> bool:
+        dom = day.day in self.days
+        dow = day.isoweekday() % 7 in self.weekdays
+        if self.any_day:
+            return dow
+        if self.any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, when: datetime) -> datetime:
+        """Ближайшее срабатывание строго после when — прыжками по месяцам, дням и часам"""
+        t = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        for _ in range(10_000):
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+
+        raise ValueError("Выражение cron не срабатывает никогда")
+
+
+class Job:
+    """Повторяющаяся задача: по интервалу или по cron, на каждую группу или одна на бота.
+
+    catch_up — что делать с пропущенными запусками (бот лежал дольше периода):
+    'once' — выполнить один раз, 'all' — каждый пропущенный (не больше
+    JOBS_MAX_CATCH_UP), 'skip' — опоздавший больше JOBS_MISFIRE_GRACE запуск пропустить.
+    """
+
+    __slots__ = ('name', 'action', 'every', 'cron', 'per_chat', 'catch_up')
+
+    def __init__(self, name: str, action: Callable, every: Optional[timedelta] = None,
+                 cron: str = '', per_chat: bool = True, catch_up: str = 'once'):
+        if not every and not cron:
+            raise ValueError(f"У задачи {name} нет ни интервала, ни cron")
+        if catch_up not in ('once', 'all', 'skip'):
+            raise ValueError(f"Неизвестная политика catch_up: {catch_up}")
+
+        self.name = name
+        self.action = action
+        self.every = every
+        self.cron = CronSpec(cron) if cron else None
+        self.per_chat = per_chat
+        self.catch_up = catch_up
+
+    def next_after(self, when: datetime) -> datetime:
+        return self.cron.next_after(when) if self.cron else when + self.every
+
+
+class JobScheduler:
+    """Планировщик на min-куче: спит ровно до ближайшего срока.
+
+    Куча хранит (время, seq, задача, чат); следующее время каждой пары
+    записано в _next и сохраняется в JOBS_FILE, поэтому расписание
+    переживает рестарт. Устаревшие элементы кучи (после перепланирования
+    или снятия чата) отбрасываются при извлечении. Следующий срок
+    сохраняется до запуска действия — после падения пост не повторится.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._next: Dict[tuple, datetime] = {}
+        self._heap: List[tuple] = []
+        self._seq: int = 0
+        self._wake = asyncio.Event()
+        self._tasks: set = set()
+        self._dirty: bool = False
+        self._started: bool = False
+        self.fired: int = 0
+        self.skipped: int = 0
+
+    def add(self, job: Job):
+        self.jobs[job.name] = job
+
+    def _schedule(self, job: Job, chat_id: int, when: datetime):
+        self._next[(job.name, chat_id)] = when
+        self._seq += 1
+        heapq.heappush(self._heap, (when.timestamp(), self._seq, job.name, chat_id))
+        self._dirty = True
+        self._wake.set()
+
+    def _first_run(self, job: Job, chat_id: int, stored: dict) -> datetime:
+        """Срок из JOBS_FILE, из прежних last_* в chats.json или через полный период"""
+        saved = stored.get(job.name, {}).get(str(chat_id))
+        if saved:
+            return datetime.fromisoformat(saved)
+
+        last = chats.known.get(chat_id, {}).pop(f'last_{job.name}', None)
+        return job.next_after(datetime.fromisoformat(last) if last else datetime.now())
+
+    def start(self):
+        stored = FastDataManager._load_json(str(chats.root / config.JOBS_FILE), {})
+
+        for job in self.jobs.values():
+            for chat_id in (list(chats.known) if job.per_chat else [0]):
+                self._schedule(job, chat_id, self._first_run(job, chat_id, stored))
+
+        self._started = True
+        logger.info(f"⏰ Задач в расписании: {len(self._next)}")
+
+    def add_chat(self, chat_id: int):
+        """Ставит задачи новой группы; до start() группы подхватит сам start()"""
+        if not self._started:
+            return
+        for job in self.jobs.values():
+            if job.per_chat and (job.name, chat_id) not in self._next:
+                self._schedule(job, chat_id, job.next_after(datetime.now()))
+
+    def remove_chat(self, chat_id: int):
+        for job in self.jobs.values():
+            if self._next.pop((job.name, chat_id), None) is not None:
+                self._dirty = True
+
+    async def run(self):
+        heap = self._heap
+
+        while True:
+            self._wake.clear()
+            wait = heap[0][0] - time() if heap else None
+
+            if wait is None or wait > 0:
+                # Верхняя граница сна страхует от перевода часов и сна машины
+                timeout = config.JOBS_MAX_SLEEP if wait is None else min(wait, config.JOBS_MAX_SLEEP)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, name, chat_id = heapq.heappop(heap)
+            due = self._next.get((name, chat_id))
+            if due is None or due.timestamp() > time():
+                continue
+
+            job = self.jobs[name]
+            runs, next_run = self._plan(job, due, datetime.now())
+            self._schedule(job, chat_id, next_run)
+            await self.save()
+
+            task = asyncio.create_task(self._fire(job, chat_id, runs))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _plan(job: Job, due: datetime, now: datetime) -> tuple:
+        """Сколько раз выполнить сейчас и когда следующий срок"""
+        missed = 1
+        next_run = job.next_after(due)
+        while next_run <= now:
+            missed += 1
+            next_run = job.next_after(next_run)
+
+        if job.catch_up == 'all':
+            return min(missed, config.JOBS_MAX_CATCH_UP), next_run
+        if job.catch_up == 'skip' and (now - due).total_seconds() > config.JOBS_MISFIRE_GRACE:
+            return 0, next_run
+        return 1, next_run
+
+    async def _fire(self, job: Job, chat_id: int, runs: int):
+        if not runs:
+            self.skipped += 1
+            logger.info(f"⏰ {job.name} ({chat_id}) пропущен по политике skip")
+            return
+
+        for _ in range(runs):
+            try:
+                await job.action(chat_id)
+                self.fired += 1
+            except TelegramForbiddenError:
+                # Бота удалили из группы — больше туда не пишем
+                self.remove_chat(chat_id)
+                chats.unregister(chat_id)
+                logger.warning(f"🚫 Нет доступа к {chat_id}, чат снят с расписания")
+                return
+            except Exception as e:
+                logger.error(f"Ошибка задачи {job.name} ({chat_id}): {e}")
+                return
+
+    async def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        data: Dict[str, Dict[str, str]] = {}
+        for (name, chat_id), when in self._next.items():
+            data.setdefault(name, {})[str(chat_id)] = when.isoformat()
+
+        try:
+            await asyncio.to_thread(FastDataManager._atomic_write, str(chats.root / config.JOBS_FILE),
+                                    [json.dumps(data, ensure_ascii=False, indent=2)])
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Ошибка сохранения {config.JOBS_FILE}: {e}")
+
+
+jobs = JobScheduler()
+
+
+# ==============================
+# 🖼️ КЭШ ЭКРАНОВ
+# ==============================
+
+class RenderCache:
+    """Отрисованные тексты экранов и статьи inline-режима, привязанные к версии данных.
+
+    Экран перерисовывается, только если его версия (version чата плюс то, что
+    зависит от часов) изменилась. Отдельно запоминается последний текст
+    каждого отредактированного сообщения — повторная правка тем же текстом
+    не уходит в Bot API.
+    """
+    
+    __slots__ = ('_texts', '_shown', 'max_size', 'hits', 'misses', 'edits', 'edits_skipped')
+    
+    def __init__(self, max_size: int = 10_000):
+        self._texts: OrderedDict = OrderedDict()
+        self._shown: OrderedDict = OrderedDict()
+        self.max_size = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self.edits: int = 0
+        self.edits_skipped: int = 0
+    
+    @staticmethod
+    def _put(table: OrderedDict, key, value, max_size: int):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > max_size:
+            table.popitem(last=False)
+    
+    def render(self, key, version, build):
+        entry = self._texts.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self._texts.move_to_end(key)
+            return entry[1]
         
-        self.state['total_messages'] += 1
-        self._dirty = True
-        self._invalidate_caches()
-    
-    def track_command(self, user_id: int):
-        """Отслеживание команды"""
-        user = self.get_user(user_id)
-        user['commands'] += 1
-        user['points'] += config.POINTS_PER_COMMAND
-        user['last_active'] = datetime.now().isoformat()
-        self._dirty = True
-        self._invalidate_caches()
+        self.misses += 1
+        text = build()
+        self._put(self._texts, key, (version, text), self.max_size)
+        return text
     
-    def track_new_member(self):
-        self.state['new_members'] += 1
-        self._dirty = True
+    def forget(self, chat_id: int):
+        """Раздел выгружен: после загрузки его версии начнутся с нуля"""
+        for key in [key for key in self._texts if key[1] == chat_id]:
+            del self._texts[key]
     
-    def _invalidate_caches(self):
-        """Инвалидирует кэши"""
-        self._top_cache = None
-        self._active_cache = {}
+    def clear(self):
+        """Сменилось то, от чего зависят все тексты, — перерисуются при следующем показе"""
+        self._texts.clear()
     
-    def get_top_users(self, limit: int = 10) -> list:
-        now = datetime.now()
-        
-        if self._top_cache and (now - self._top_cache_time).seconds < config.CACHE_TTL:
-            return self._top_cache[:limit]
-        
-        sorted_users = sorted(
-            self.users.items(),
-            key=lambda x: x[1]['points'],
-            reverse=True
-        )
-        
-        self._top_cache = sorted_users
-        self._top_cache_time = now
-        
-        return sorted_users[:limit]
+    def is_shown(self, target: tuple, content: tuple) -> bool:
+        return self._shown.get(target) == content
     
-    def get_user_rank(self, user_id: int) -> Optional[int]:
-        top = self.get_top_users(len(self.users))
-        uid = str(user_id)
-        
-        for i, (user_id_str, _) in enumerate(top, 1):
-            if user_id_str == uid:
-                return i
-        return None
+    def mark_shown(self, target: tuple, content: tuple):
+        self._put(self._shown, target, content, self.max_size)
     
     @property
-    def total_users(self) -> int:
-        return len(self.users)
-    
-    def get_active_count(self, days: int = 7) -> int:
-        """Активные за N дней с кэшированием"""
-        now = datetime.now()
-        cache_key = f"active_{days}"
-        
-        if cache_key in self._active_cache:
-            if (now - self._active_cache_time).seconds < config.CACHE_TTL:
-                return self._active_cache[cache_key]
-        
-        threshold = now - timedelta(days=days)
-        count = 0
-        
-        for user_data in self.users.values():
-            try:
-                last_active = datetime.fromisoformat(user_data['last_active'])
-                if last_active >= threshold:
-                    count += 1
-            except:
-                pass
-        
-        self._active_cache[cache_key] = count
-        self._active_cache_time = now
-        
-        return count
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses,
+                'edits': self.edits, 'edits_skipped': self.edits_skipped}
 
 
-db = FastDataManager()
+screens = RenderCache(config.RENDER_CACHE_SIZE)
 
 
 # ==============================
 # 📊 ГЕНЕРАТОРЫ ТЕКСТА
 # ==============================
 
-def get_stats_text() -> str:
+def get_stats_text(db: FastDataManager) -> str:
+    ingest.flush()
+    # Текст содержит время с точностью до минуты — она тоже часть версии
+    stamp = datetime.now().strftime('%d.%m %H:%M')
+    return screens.render(('stats', db.chat_id), (db.version, stamp), lambda: _render_stats(db, stamp))
+
+
+def _render_stats(db: FastDataManager, stamp: str) -> str:
     days = (datetime.now() - db.state['bot_started']).days + 1
+    roster = db.roster
+    period = config.ROSTER_STATS_DAYS
+    today = date.today().toordinal()
+    joins, leaves = roster.flow(period, today)
+    count = roster.count
+    
+    def percent(value: Optional[float]) -> str:
+        return '—' if value is None else f"{value:.0%}"
     
     return f"""📊 Բոտի ստատիստիկա
 
@@ -336,72 +4006,188 @@ def get_stats_text() -> str:
 ├ Ակտիվ այսօր՝ {db.get_active_count(0)}
 └ Ակտիվ այս շաբաթ՝ {db.get_active_count(7)}
 
+🚪 Անդամներ՝ {'—' if count is None else f'{count:,}'}
+├ Միացել ({period} օր)՝ {joins}
+├ Լքել ({period} օր)՝ {leaves}
+├ Արտահոսք՝ {percent(roster.churn(period, today))}
+└ Մնացել են նորեկներից՝ {percent(roster.retention(period, today))}
+
 💬 Հաղորդագրություններ՝ {db.state['total_messages']:,}
 🆕 Նոր անդամներ՝ {db.state['new_members']}
 
-⏰ {datetime.now().strftime('%d.%m %H:%M')}"""
+⏰ {stamp}"""
+
 
+def get_top_text(db: FastDataManager, window: Optional[str] = None) -> str:
+    """Топ за всё время или за период из config.TOP_WINDOWS"""
+    ingest.flush()
+    if window is None:
+        return screens.render(('top', db.chat_id), db.version, lambda: _render_top(db))
+    # Окно сдвигается с датой — она тоже часть версии
+    return screens.render(('top', db.chat_id, window), (db.version, date.today()),
+                          lambda: _render_top(db, window))
 
-def get_top_text() -> str:
+
+def _render_top(db: FastDataManager, window: Optional[str] = None) -> str:
     """Генерирует топ с кликабельными именами"""
-    top = db.get_top_users(config.MAX_TOP_USERS)
+    if window is None:
+        top = [(uid, u, u.points) for uid, u in db.get_top_users(config.MAX_TOP_USERS)]
+    else:
+        top = db.get_window_top(window, config.MAX_TOP_USERS)
     
+    return _format_top(top, window, messages=window is None)
+
+
+def _format_top(top: list, window: Optional[str], messages: bool) -> str:
+    """Текст топа по строкам (uid, запись, очки); messages — с числом сообщений"""
     if not top:
         return "❌ Տվյալներ դեռ չկան"
     
-    lines = ["🏆 Ամենաակտիվ օգտատերերը\n\n"]
+    lines = [f"{TOP_TITLES.get(window, TOP_TITLES[None])}\n\n"]
     medals = ["🥇", "🥈", "🥉"]
     
-    for i, (uid, u) in enumerate(top, 1):
+    for i, (uid, u, points) in enumerate(top, 1):
         medal = medals[i-1] if i <= 3 else f"{i}."
         
         # Получаем имя
-        name = u.get('name') or u.get('username')
+        name = u.name or u.username
         
         # Пропускаем пользователей без имени
         if not name:
             continue
         
         # Делаем кликабельным
-        if u.get('username'):
-            clickable_name = f"<a href='tg://user?id={uid}'>@{u['username']}</a>"
+        if u.username:
+            clickable_name = f"<a href='tg://user?id={uid}'>@{u.username}</a>"
         else:
             clickable_name = f"<a href='tg://user?id={uid}'>{name}</a>"
         
-        lines.append(f"{medal} {clickable_name}\n   💎 {u['points']} | 💬 {u['messages']}\n\n")
+        if messages:
+            lines.append(f"{medal} {clickable_name}\n   💎 {points} | 💬 {u.messages}\n\n")
+        else:
+            lines.append(f"{medal} {clickable_name}\n   💎 {points}\n\n")
     
-    lines.append("💡 Միավորներ՝\n├ 10 հաղորդագրություն = 1 միավոր\n└ 1 հրաման = 2 միավոր")
+    lines.append(f"💡 Միավորներ՝\n{points_rules.summary()}")
     
     return "".join(lines)
 
 
-def get_profile_text(user_id: int) -> str:
+def get_profile_text(db: FastDataManager, user_id: int) -> str:
+    ingest.flush()
+    # Первый показ профиля может создать пользователя — версию берём после
+    db.get_user(user_id)
+    return screens.render(('profile', db.chat_id, user_id), (db.version, date.today()),
+                          lambda: _render_profile(db, user_id))
+
+
+def _render_profile(db: FastDataManager, user_id: int) -> str:
     """Генерирует профиль с кликабельным именем"""
     user = db.get_user(user_id)
     rank = db.get_user_rank(user_id)
     
     # Получаем имя
-    name = user.get('name') or user.get('username') or "Օգտատեր"
+    name = user.name or user.username or "Օգտատեր"
     
     # Делаем кликабельным
-    if user.get('username'):
-        clickable_name = f"<a href='tg://user?id={user_id}'>@{user['username']}</a>"
+    if user.username:
+        clickable_name = f"<a href='tg://user?id={user_id}'>@{user.username}</a>"
     else:
         clickable_name = f"<a href='tg://user?id={user_id}'>{name}</a>"
     
-    days = (datetime.now() - datetime.fromisoformat(user['joined'])).days + 1
+    days = (datetime.now() - datetime.fromtimestamp(user.joined)).days + 1
+    remaining = points_rules.remaining(db, user_id, user.messages)
+    hint = f"\n\n💡 Մինչև հաջորդ միավորը՝ {remaining} հաղորդագրություն" if remaining else ""
     
     return f"""👤 {clickable_name}
 
 🏆 Տեղը՝ #{rank or '—'}
-💎 Միավորներ՝ {user['points']}
+💎 Միավորներ՝ {user.points}
 
 📊 Ակտիվություն՝
-├ Հաղորդագրություններ՝ {user['messages']}
-├ Հրամաններ՝ {user['commands']}
-└ Խմբում՝ {days} օր
+├ Հաղորդագրություններ՝ {user.messages}
+├ Հրամաններ՝ {user.commands}
+└ Խմբում՝ {days} օր{hint}"""
+
+
+def get_inline_top(db: FastDataManager) -> List[InlineQueryResultArticle]:
+    """Статьи рейтингов для inline-режима.
+
+    Версия — сам рейтинг: (uid, очки, имя) по каждому окну. Сообщения в
+    статьи не входят — они меняются чаще рейтинга, и статьи пересобирались
+    бы почти на каждый запрос. Прочитать топы из индексов — микросекунды.
+    """
+    ingest.flush()
+    limit = config.MAX_TOP_USERS
+    boards = {None: [(uid, u, u.points) for uid, u in db.get_top_users(limit)]}
+    for window in config.TOP_WINDOWS:
+        boards[window] = db.get_window_top(window, limit)
+    
+    ranking = tuple(tuple((uid, points, u.name, u.username) for uid, u, points in rows) for rows in boards.values())
+    return screens.render(('inline_top', db.chat_id), ranking, lambda: _render_inline_top(boards))
+
+
+def _render_inline_top(boards: Dict[Optional[str], list]) -> List[InlineQueryResultArticle]:
+    articles = []
+    
+    for window, rows in boards.items():
+        leader = next(((u, points) for _, u, points in rows if u.name or u.username), None)
+        if leader:
+            u, points = leader
+            description = f"🥇 {u.name or u.username} · 💎 {points}"
+        else:
+            description = "❌ Տվյալներ դեռ չկան"
+        
+        articles.append(InlineQueryResultArticle(
+            id=f"top:{window or 'all'}",
+            title=TOP_TITLES.get(window, TOP_TITLES[None]),
+            description=description,
+            input_message_content=InputTextMessageContent(message_text=_format_top(rows, window, messages=False))
+        ))
+    
+    return articles
+
 
-💡 Մինչև հաջորդ միավորը՝ {10 - (user['messages'] % 10)} հաղորդագրություն"""
+def get_inline_profile(db: FastDataManager, user: types.User) -> InlineQueryResultArticle:
+    """Статья «мой профиль»: пересобирается, только когда меняются место или очки.
+    Запрос может прийти от кого угодно — строку группы он не создаёт"""
+    ingest.flush()
+    uid = user.id
+    record = db.peek_user(uid)
+    if record is None:
+        return InlineQueryResultArticle(
+            id="me",
+            title="👤 Իմ պրոֆիլը",
+            description="❌ Տվյալներ դեռ չկան",
+            input_message_content=InputTextMessageContent(message_text="❌ Տվյալներ դեռ չկան")
+        )
+    standing = (record.name or record.username or user.first_name, record.username, db.get_user_rank(uid),
+                record.points, tuple(db.get_window_points(window, uid) for window in config.TOP_WINDOWS))
+    return screens.render(('inline_me', db.chat_id, uid), standing, lambda: _render_inline_profile(uid, standing))
+
+
+def _render_inline_profile(user_id: int, standing: tuple) -> InlineQueryResultArticle:
+    name, username, rank, points, window_points = standing
+    
+    if username:
+        clickable_name = f"<a href='tg://user?id={user_id}'>@{username}</a>"
+    else:
+        clickable_name = f"<a href='tg://user?id={user_id}'>{name or 'Օգտատեր'}</a>"
+    
+    periods = " | ".join(f"{TOP_WINDOW_BUTTONS.get(window, window)}՝ {value}"
+                         for window, value in zip(config.TOP_WINDOWS, window_points))
+    text = f"""👤 {clickable_name}
+
+🏆 Տեղը՝ #{rank or '—'}
+💎 Միավորներ՝ {points}
+
+📅 {periods}"""
+    
+    return InlineQueryResultArticle(
+        id="me",
+        title="👤 Իմ պրոֆիլը",
+        description=f"🏆 #{rank or '—'} · 💎 {points}",
+        input_message_content=InputTextMessageContent(message_text=text)
+    )
 
 
 # ==============================
@@ -450,6 +4236,25 @@ WELCOME_MSG = """👋 Բարի գալուստ, {name}!
 
 Հաջող խաղ! 🎯"""
 
+# Заголовки топа: None — за всё время, остальные — окна из config.TOP_WINDOWS
+TOP_TITLES = {
+    None: "🏆 Ամենաակտիվ օգտատերերը",
+    'day': "🏆 Այսօրվա ամենաակտիվները",
+    'week': "🏆 Վերջին 7 օրվա ամենաակտիվները",
+    'month': "🏆 Վերջին 30 օրվա ամենաակտիվները"
+}
+
+TOP_WINDOW_BUTTONS = {
+    None: "Ընդհանուր",
+    'day': "Այսօր",
+    'week': "7 օր",
+    'month': "30 օր"
+}
+
+# Запросы inline-режима: только рейтинги или только свой профиль; любой другой — всё вместе
+INLINE_TOP_QUERIES = frozenset({"top", "топ", "տոպ"})
+INLINE_PROFILE_QUERIES = frozenset({"me", "profile", "я", "ես"})
+
 START_MSG = """🤖 Բարև, ես Հայ🇦🇲PS Bot-ն եմ։
 
 Քո վստահելի PlayStation օգնականը 🚀
@@ -493,12 +4298,28 @@ def get_keyboard(key: str) -> InlineKeyboardMarkup:
         ])
     }
     
-    for name in ['top', 'stats', 'profile']:
+    for name in ['stats', 'profile']:
         keyboards[f'refresh_{name}'] = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔄 Թարմացնել", callback_data=name)],
             [InlineKeyboardButton(text="⬅️ Հետ", callback_data="back")]
         ])
     
+    # Топ: переключатель периодов, текущий отмечен точкой
+    windows = [None, *config.TOP_WINDOWS]
+    for current in windows:
+        data = f"top:{current}" if current else "top"
+        keyboards[f'refresh_{data}'] = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=f"{'• ' if window == current else ''}{TOP_WINDOW_BUTTONS.get(window, window)}",
+                    callback_data=f"top:{window}" if window else "top"
+                )
+                for window in windows
+            ],
+            [InlineKeyboardButton(text="🔄 Թարմացնել", callback_data=data)],
+            [InlineKeyboardButton(text="⬅️ Հետ", callback_data="back")]
+        ])
+    
     _KEYBOARDS.update(keyboards)
     return _KEYBOARDS.get(key, keyboards['back'])
 
@@ -508,17 +4329,55 @@ def get_keyboard(key: str) -> InlineKeyboardMarkup:
 # ==============================
 
 @dp.message(F.new_chat_members)
-async def on_new_members(m: types.Message):
+async def on_new_members(m: types.Message, db: FastDataManager):
+    chat_id = m.chat.id
+    
     for user in m.new_chat_members:
         name = user.first_name or user.username or "Ընկեր"
-        db.track_new_member()
+        db.track_new_member(user.id, int(m.date.timestamp()))
         db.get_user(user.id)
         
-        try:
-            await m.answer(WELCOME_MSG.format(name=name))
-            logger.info(f"✅ Приветствие: {name}")
-        except Exception as e:
-            logger.error(f"Ошибка приветствия: {e}")
+        outbox.coalesce(('welcome', chat_id), name, lambda names: welcome_message(chat_id, names),
+                        config.WELCOME_COALESCE_WINDOW, config.WELCOME_MAX_NAMES)
+
+
+def welcome_message(chat_id: int, names: List[str]) -> SendMessage:
+    """Одно приветствие на всех, кто вошёл за окно склейки"""
+    logger.info(f"✅ Приветствие: {', '.join(names)}")
+    return SendMessage(chat_id=chat_id, text=WELCOME_MSG.format(name=", ".join(names)))
+
+
+@dp.message(F.left_chat_member)
+async def on_left_member(m: types.Message, db: FastDataManager):
+    db.track_left_member(m.left_chat_member.id, int(m.date.timestamp()))
+
+
+# chat_member приходит, только если бот — админ группы; зато и тогда, когда служебные сообщения скрыты
+@dp.chat_member(ChatMemberUpdatedFilter(JOIN_TRANSITION))
+async def on_member_joined(event: types.ChatMemberUpdated, db: FastDataManager):
+    user = event.new_chat_member.user
+    db.track_new_member(user.id, int(event.date.timestamp()))
+    db.get_user(user.id)
+
+
+@dp.chat_member(ChatMemberUpdatedFilter(LEAVE_TRANSITION))
+async def on_member_left(event: types.ChatMemberUpdated, db: FastDataManager):
+    db.track_left_member(event.old_chat_member.user.id, int(event.date.timestamp()))
+
+
+async def sync_member_count(db: FastDataManager):
+    """Раз в ROSTER_SYNC_INTERVAL сверяет число участников с Telegram — так в составе учтены бывшие до бота"""
+    if time() - db.roster.synced < config.ROSTER_SYNC_INTERVAL:
+        return
+    
+    try:
+        count = await bot.get_chat_member_count(db.chat_id)
+    except TelegramAPIError as e:
+        # Не группа или бота в ней нет — до следующего срока не спрашиваем
+        db.roster.synced = int(time())
+        logger.warning(f"Число участников {db.chat_id} недоступно: {e}")
+        return
+    db.sync_member_count(count)
 
 
 # ==============================
@@ -526,39 +4385,82 @@ async def on_new_members(m: types.Message):
 # ==============================
 
 @dp.message(Command("start"))
-async def cmd_start(m: types.Message):
-    db.track_command(m.from_user.id)
-    await m.answer(START_MSG, reply_markup=get_keyboard('main'))
+async def cmd_start(m: types.Message, db: FastDataManager):
+    db.track_command(m.from_user.id, "start")
+    await outbox.send(m.answer(START_MSG, reply_markup=get_keyboard('main')))
 
 
 @dp.message(Command("buy"))
-async def cmd_buy(m: types.Message):
-    db.track_command(m.from_user.id)
-    await m.answer("Ընտրիր տարածաշրջանը 👇", reply_markup=get_keyboard('country'))
+async def cmd_buy(m: types.Message, db: FastDataManager):
+    db.track_command(m.from_user.id, "buy")
+    await outbox.send(m.answer("Ընտրիր տարածաշրջանը 👇", reply_markup=get_keyboard('country')))
 
 
 @dp.message(Command("support"))
-async def cmd_support(m: types.Message):
-    db.track_command(m.from_user.id)
-    await m.answer(f"🆘 {config.SUPPORT_MANAGER}", reply_markup=get_keyboard('back'))
+async def cmd_support(m: types.Message, db: FastDataManager):
+    db.track_command(m.from_user.id, "support")
+    await outbox.send(m.answer(f"🆘 {config.SUPPORT_MANAGER}", reply_markup=get_keyboard('back')))
 
 
 @dp.message(Command("top"))
-async def cmd_top(m: types.Message):
-    db.track_command(m.from_user.id)
-    await m.answer(get_top_text(), reply_markup=get_keyboard('refresh_top'))
+async def cmd_top(m: types.Message, db: FastDataManager):
+    db.track_command(m.from_user.id, "top")
+    await db.wait_ready('leaderboard')
+    await outbox.send(m.answer(get_top_text(db), reply_markup=get_keyboard('refresh_top')))
 
 
 @dp.message(Command("stats"))
-async def cmd_stats(m: types.Message):
-    db.track_command(m.from_user.id)
-    await m.answer(get_stats_text(), reply_markup=get_keyboard('refresh_stats'))
+async def cmd_stats(m: types.Message, db: FastDataManager):
+    db.track_command(m.from_user.id, "stats")
+    await db.wait_ready('activity')
+    await sync_member_count(db)
+    await outbox.send(m.answer(get_stats_text(db), reply_markup=get_keyboard('refresh_stats')))
 
 
 @dp.message(Command("profile"))
-async def cmd_profile(m: types.Message):
-    db.track_command(m.from_user.id)
-    await m.answer(get_profile_text(m.from_user.id), reply_markup=get_keyboard('refresh_profile'))
+async def cmd_profile(m: types.Message, db: FastDataManager):
+    db.track_command(m.from_user.id, "profile")
+    await db.wait_ready('leaderboard')
+    await outbox.send(m.answer(get_profile_text(db, m.from_user.id), reply_markup=get_keyboard('refresh_profile')))
+
+
+@dp.message(Command("export"))
+async def cmd_export(m: types.Message, command: CommandObject, db: FastDataManager):
+    db.track_command(m.from_user.id, "export")
+    if not await is_admin(db.chat_id, m.from_user.id):
+        await outbox.send(m.answer("⛔ Միայն ադմինների համար"))
+        return
+    
+    try:
+        fmt, min_points, active_since = parse_export_args(command.args)
+    except ValueError:
+        await outbox.send(m.answer("🧾 /export [csv|jsonl] [min=միավորներ] [since=ՏՏՏՏ-ԱԱ-ՕՕ|օրեր]"))
+        return
+    
+    if export_lock.locked():
+        await outbox.send(m.answer("⏳ Արտահանումն արդեն ընթացքի մեջ է"))
+        return
+    
+    async with export_lock:
+        await db.wait_ready('activity')
+        ingest.flush()
+        summary = export_summary(db, min_points, active_since)
+        document = ExportFile(lambda: export_chunks(export_lines(db, fmt, min_points, active_since)),
+                              export_filename(db.chat_id, fmt))
+        caption = (f"🧾 {fmt.upper()} · {summary['exported_at']}\n"
+                   f"👥 {summary['total_users']} | 💬 {summary['total_messages']:,}\n"
+                   f"🔎 min={min_points} since={summary['active_since'] or '—'}")
+        started = perf_counter()
+        
+        # Файл с данными участников — только в личку запросившему
+        try:
+            await outbox.send(SendDocument(chat_id=m.from_user.id, document=document, caption=caption))
+        except TelegramForbiddenError:
+            await outbox.send(m.answer("✉️ Նախ գրիր բոտին անձնական նամակով՝ /start"))
+            return
+    
+    logger.info(f"🧾 Экспорт чата {db.chat_id} ({fmt}) для {m.from_user.id}: {document.written} B "
+                f"за {(perf_counter() - started) * 1000:.0f} мс")
 
 
 # ==============================
@@ -571,82 +4473,292 @@ KEYWORDS = {
     'top': {'топ', 'տոպ', 'рейтинг', 'ամենաակտիվ'}
 }
 
+# Если в сообщении несколько категорий — отвечаем на самую приоритетную
+KEYWORD_PRIORITY = {'top': 3, 'buy': 2, 'bot': 1}
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    if not unicodedata.is_normalized('NFKC', text):
+        text = unicodedata.normalize('NFKC', text)
+    return text.casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+class KeywordMatcher:
+    """Ключевые слова и фразы, скомпилированные в автомат по токенам.
+
+    Текст нормализуется (NFKC + casefold) и режется на слова, поэтому
+    пунктуация не мешает («бот?» совпадает, «ботинок» — нет). Слова и
+    фразы вроде «ps plus» лежат в одном дереве: корни — первые токены,
+    потомки — следующие, так что все совпадения находятся одним проходом.
+
+    Большинство сообщений ключевых слов не содержит. Куски split() из
+    таких сообщений запоминаются, и сообщение из одних знакомых кусков
+    отсекается проверкой подмножества — без нормализации и разбиения
+    (см. benchmarks/bench_keywords.py).
+    """
+
+    __slots__ = ('_heads', '_cold', 'priority')
+
+    def __init__(self, keywords: Dict[str, set], priority: Dict[str, int]):
+        self.priority = {key: priority.get(key, 0) for key in keywords}
+        # Узел: [категория или None, слово или фраза, {следующий токен: узел}]
+        self._heads: Dict[str, list] = {}
+        # Куски split() из сообщений, где не нашлось ни одного первого токена
+        self._cold: set = set()
+
+        # Порядок категорий — по убыванию приоритета: при конфликте слово остаётся за старшей
+        for key in sorted(keywords, key=self.priority.get, reverse=True):
+            for word in keywords[key]:
+                tokens = tokenize(word)
+                if not tokens:
+                    continue
+                nodes = self._heads
+                for depth, token in enumerate(tokens, 1):
+                    node = nodes.get(token)
+                    if node is None:
+                        node = nodes[token] = [None, ' '.join(tokens[:depth]), {}]
+                    nodes = node[2]
+                if node[0] is None:
+                    node[0] = key
+
+    def _scan(self, tokens: List[str]) -> Iterator[tuple]:
+        """Один проход: от каждого первого токена — вглубь по дереву"""
+        heads = self._heads
+        end = len(tokens)
+
+        for i, token in enumerate(tokens):
+            node = heads.get(token)
+            while node is not None:
+                key, phrase, children = node
+                if key is not None:
+                    yield key, phrase
+                i += 1
+                node = children.get(tokens[i]) if children and i < end else None
+
+    def find_all(self, text: str) -> List[tuple]:
+        """Все совпадения по порядку: [(категория, слово или фраза), ...]"""
+        return list(self._scan(tokenize(text)))
+
+    def best(self, text: str) -> Optional[str]:
+        """Самая приоритетная категория в тексте"""
+        pieces = text.split()
+        cold = self._cold
+        if cold.issuperset(pieces):
+            return None
+
+        tokens = tokenize(text)
+        if self._heads.keys().isdisjoint(tokens):
+            # Ни в одном куске нет первого токена — запоминаем все
+            if len(cold) >= config.KEYWORDS_CACHE_SIZE:
+                cold.clear()
+            cold.update(pieces)
+            return None
+
+        priority = self.priority
+        best = None
+        for key, _ in self._scan(tokens):
+            if best is None or priority[key] > priority[best]:
+                best = key
+        return best
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'KeywordMatcher':
+        """keywords.json: {"категория": ["слово", ...]} или {"категория": {"priority": 3, "words": [...]}}"""
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        keywords, priority = {}, dict(KEYWORD_PRIORITY)
+        for key, value in data.items():
+            if isinstance(value, dict):
+                keywords[key] = set(value.get('words', []))
+                priority[key] = value.get('priority', priority.get(key, 0))
+            else:
+                keywords[key] = set(value)
+        return cls(keywords, priority)
+
+
+keyword_matcher = KeywordMatcher(KEYWORDS, KEYWORD_PRIORITY)
+_keywords_mtime: float = 0.0
+
+
+def reload_keywords() -> bool:
+    """Перечитывает KEYWORDS_FILE, если он изменился; при ошибке остаётся старый набор"""
+    global keyword_matcher, _keywords_mtime
+
+    try:
+        mtime = os.stat(config.KEYWORDS_FILE).st_mtime
+    except FileNotFoundError:
+        return False
+
+    if mtime == _keywords_mtime:
+        return False
+
+    try:
+        keyword_matcher = KeywordMatcher.from_file(config.KEYWORDS_FILE)
+        logger.info(f"🔑 Ключевые слова загружены из {config.KEYWORDS_FILE}")
+    except Exception as e:
+        logger.error(f"Ошибка загрузки {config.KEYWORDS_FILE}: {e}")
+
+    _keywords_mtime = mtime
+    return True
+
+
+reload_keywords()
+
+
 @dp.message(F.text)
-@throttle(3)
 async def handle_text(m: types.Message):
     if m.chat.type == "private":
         return
     
-    text = m.text.lower()
-    
-    if text.startswith('/'):
+    if m.text.startswith('/'):
         return
     
     try:
-        text_set = set(text.split())
+        matched = keyword_matcher.best(m.text)
         
-        if KEYWORDS['top'] & text_set:
-            await m.reply(
+        if matched is None or not keyword_replies.allow(m.from_user.id, monotonic()):
+            return
+        
+        if matched == 'top':
+            await outbox.send(m.reply(
                 "🏆 Ուզում ես տեսնել ամենաակտիվները?\n\nՕգտագործիր՝ /top",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="🏆 Ցույց տալ", callback_data="top")]
                 ])
-            )
-        elif KEYWORDS['buy'] & text_set:
-            await m.reply(
+            ))
+        elif matched == 'buy':
+            await outbox.send(m.reply(
                 "🎮 Ուզում ես գնել PS Plus?\n\nՕգտագործիր՝ /buy",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="🎮 Գնել բաժանորդագրություն", callback_data="buy")]
                 ])
-            )
-        elif KEYWORDS['bot'] & text_set:
-            await m.reply("👋 Այո, ես այստեղ եմ!\n\nՕգտագործիր՝ /start")
+            ))
+        else:
+            await outbox.send(m.reply("👋 Այո, ես այստեղ եմ!\n\nՕգտագործիր՝ /start"))
     except Exception as e:
         logger.error(f"Ошибка обработки ключевых слов: {e}")
 
 
+# Медиа и прочие сообщения групп без своего обработчика. Отвечать не на что, но
+# TrackingMiddleware — внутренняя и без найденного обработчика не вызывается
+@dp.message(F.chat.type.in_({"group", "supergroup"}))
+async def handle_other(m: types.Message):
+    pass
+
+
 # ==============================
 # CALLBACKS
 # ==============================
 
+async def show(c: types.CallbackQuery, text: str, keyboard: str):
+    """edit_text, который не отправляет правку, если сообщение уже так выглядит"""
+    target = (c.message.chat.id, c.message.message_id)
+    content = (text, keyboard)
+    
+    if screens.is_shown(target, content):
+        screens.edits_skipped += 1
+        await c.answer()
+        return
+    
+    try:
+        await outbox.send(c.message.edit_text(text, reply_markup=get_keyboard(keyboard)))
+        screens.edits += 1
+    except TelegramBadRequest as e:
+        # После рестарта память о сообщениях пуста — Telegram сам скажет, что правка пустая
+        if "message is not modified" not in str(e):
+            raise
+        screens.edits_skipped += 1
+        await c.answer()
+    
+    screens.mark_shown(target, content)
+
+
 @dp.callback_query(F.data == "back")
 async def cb_back(c: types.CallbackQuery):
-    await c.message.edit_text(START_MSG, reply_markup=get_keyboard('main'))
+    await show(c, START_MSG, 'main')
 
 
 @dp.callback_query(F.data == "buy")
 async def cb_buy(c: types.CallbackQuery):
-    await c.message.edit_text("Ընտրիր տարածաշրջանը 👇", reply_markup=get_keyboard('country'))
+    await show(c, "Ընտրիր տարածաշրջանը 👇", 'country')
 
 
 @dp.callback_query(F.data == "support")
 async def cb_support(c: types.CallbackQuery):
-    await c.message.edit_text(f"🆘 {config.SUPPORT_MANAGER}", reply_markup=get_keyboard('back'))
+    await show(c, f"🆘 {config.SUPPORT_MANAGER}", 'back')
 
 
 @dp.callback_query(F.data == "top")
-async def cb_top(c: types.CallbackQuery):
-    await c.message.edit_text(get_top_text(), reply_markup=get_keyboard('refresh_top'))
+async def cb_top(c: types.CallbackQuery, db: FastDataManager):
+    await db.wait_ready('leaderboard')
+    await show(c, get_top_text(db), 'refresh_top')
+
+
+@dp.callback_query(F.data.startswith("top:"))
+async def cb_top_window(c: types.CallbackQuery, db: FastDataManager):
+    window = c.data[4:]
+    if window not in config.TOP_WINDOWS:
+        await c.answer()
+        return
+    await show(c, get_top_text(db, window), f'refresh_top:{window}')
 
 
 @dp.callback_query(F.data == "stats")
-async def cb_stats(c: types.CallbackQuery):
-    await c.message.edit_text(get_stats_text(), reply_markup=get_keyboard('refresh_stats'))
+async def cb_stats(c: types.CallbackQuery, db: FastDataManager):
+    await db.wait_ready('activity')
+    await sync_member_count(db)
+    await show(c, get_stats_text(db), 'refresh_stats')
 
 
 @dp.callback_query(F.data == "profile")
-async def cb_profile(c: types.CallbackQuery):
-    await c.message.edit_text(get_profile_text(c.from_user.id), reply_markup=get_keyboard('refresh_profile'))
+async def cb_profile(c: types.CallbackQuery, db: FastDataManager):
+    await db.wait_ready('leaderboard')
+    await show(c, get_profile_text(db, c.from_user.id), 'refresh_profile')
 
 
 @dp.callback_query(F.data == "uk")
 async def cb_uk(c: types.CallbackQuery):
-    await c.message.edit_text(f"🇺🇦 Գրիր 👉 {config.UK_MANAGERS}", reply_markup=get_keyboard('back'))
+    await show(c, f"🇺🇦 Գրիր 👉 {config.UK_MANAGERS}", 'back')
 
 
 @dp.callback_query(F.data == "tr")
 async def cb_tr(c: types.CallbackQuery):
-    await c.message.edit_text(f"🇹🇷 Գրիր 👉 {config.TR_MANAGERS}", reply_markup=get_keyboard('back'))
+    await show(c, f"🇹🇷 Գրիր 👉 {config.TR_MANAGERS}", 'back')
+
+
+# ==============================
+# 🔎 INLINE
+# ==============================
+
+@dp.inline_query()
+async def inline_query(q: types.InlineQuery):
+    """@bot top — рейтинги, @bot me — свой профиль; отвечаем из домашней группы CHAT_ID"""
+    db = chats.for_chat(None)
+    await db.wait_ready('users')
+    await db.wait_ready('leaderboard')
+    
+    query = q.query.strip().lower()
+    results = [] if query in INLINE_PROFILE_QUERIES else list(get_inline_top(db))
+    # Ответ с профилем личный — Telegram кэширует его для каждого пользователя отдельно
+    personal = query not in INLINE_TOP_QUERIES
+    if personal:
+        results.append(get_inline_profile(db, q.from_user))
+    
+    try:
+        await q.answer(results, is_personal=personal,
+                       cache_time=config.INLINE_PROFILE_CACHE_TIME if personal else config.INLINE_TOP_CACHE_TIME)
+    except TelegramBadRequest as e:
+        # Запрос из очереди простоя успел истечь — отвечать уже некому
+        if "query is too old" not in str(e):
+            raise
 
 
 # ==============================
@@ -654,65 +4766,456 @@ async def cb_tr(c: types.CallbackQuery):
 # ==============================
 
 async def auto_save():
-    """Автосохранение каждые 60 секунд"""
+    """Автосохранение: журнал — каждые пару секунд, иначе полный снимок раз в минуту.
+    В режиме реплик — свой вклад и слияние чужих с тем же шагом.
+    """
+    interval = config.JOURNAL_FLUSH_INTERVAL if config.JOURNAL_ENABLED else config.SAVE_INTERVAL
+    
+    while True:
+        await asyncio.sleep(interval)
+        # Номер снимается сразу после flush, без уступки циклу: всё до него уже в памяти
+        flushed = ingest.flush()
+        checkpoint = backlog.checkpoint()
+        saved = await chats.save_all()
+        await jobs.save()
+        if flushed and saved:
+            await backlog.save(checkpoint)
+        await chats.merge_replicas()
+        await chats.evict_idle()
+
+
+async def sample_loop_lag():
+    """Насколько позже запланированного просыпается цикл событий"""
+    interval = config.LOOP_LAG_INTERVAL
+    
     while True:
-        await asyncio.sleep(config.SAVE_INTERVAL)
-        await db.save_all()
+        started = monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, monotonic() - started - interval)
+        metrics.loop_lag.observe(lag)
+        metrics.loop_lag_last = lag
 
 
-async def scheduler():
-    """Планировщик с защитой от спама"""
-    await asyncio.sleep(60)
-    logger.info("✅ Планировщик запущен")
+async def serve_metrics() -> Optional[web.AppRunner]:
+    """Сервер /metrics; порт занят — бот работает без него"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.expose().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
     
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.METRICS_HOST, config.METRICS_PORT).start()
+    except OSError as e:
+        await runner.cleanup()
+        logger.error(f"Метрики не запущены на {config.METRICS_HOST}:{config.METRICS_PORT}: {e}")
+        return None
+    logger.info(f"📡 Метрики: http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+    return runner
+
+
+async def watch_keywords():
+    """Горячая перезагрузка KEYWORDS_FILE и POINTS_FILE"""
     while True:
+        await asyncio.sleep(config.KEYWORDS_RELOAD_INTERVAL)
+        reload_keywords()
+        reload_points_rules()
+
+
+async def post_fb(chat_id: int):
+    logger.info(f"📱 Отправляю FB пост в {chat_id}")
+    await outbox.send(SendMessage(chat_id=chat_id, text=FB_MSG), Outbox.SCHEDULED)
+
+
+async def post_reminder(chat_id: int):
+    logger.info(f"💡 Отправляю напоминание в {chat_id}")
+    await outbox.send(SendMessage(chat_id=chat_id, text=REMINDER_MSG), Outbox.SCHEDULED)
+
+
+jobs.add(Job('fb_post', post_fb, every=timedelta(days=config.FB_POST_EVERY_DAYS), cron=config.FB_POST_CRON))
+jobs.add(Job('bot_reminder', post_reminder, every=timedelta(days=config.BOT_REMINDER_EVERY_DAYS),
+             cron=config.BOT_REMINDER_CRON))
+
+
+# ==============================
+# 🌐 WEBHOOK
+# ==============================
+
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query", "chat_member"]
+
+
+class WebhookServer:
+    """Приём апдейтов по HTTP с ограничением числа обработчиков в работе.
+
+    Апдейт подтверждается сразу, а обрабатывается в отдельной задаче.
+    Когда занято WEBHOOK_MAX_IN_FLIGHT задач, запрос ждёт свободного места
+    до WEBHOOK_ACCEPT_TIMEOUT секунд и получает 503 — Telegram повторит
+    доставку позже. Локально проверяется POST-запросом с JSON апдейта:
+
+        curl -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+             -d @update.json http://127.0.0.1:8080/webhook
+    """
+
+    def __init__(self):
+        self._slots = asyncio.Semaphore(config.WEBHOOK_MAX_IN_FLIGHT)
+        self._tasks: set = set()
+        self.accepted: int = 0
+        self.rejected: int = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if config.WEBHOOK_SECRET:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not compare_digest(token, config.WEBHOOK_SECRET):
+                return web.Response(status=401)
+
         try:
-            now = datetime.now()
-            
-            days_since_fb = (now - db.state['last_fb_post']).days
-            if days_since_fb >= config.FB_POST_EVERY_DAYS:
-                logger.info(f"📱 Отправляю FB пост (прошло {days_since_fb} дней)")
-                await bot.send_message(config.CHAT_ID, FB_MSG)
-                
-                async with db._lock:
-                    db.state['last_fb_post'] = now
-                    db._dirty = True
-
-            days_since_reminder = (now - db.state['last_bot_reminder']).days
-            if days_since_reminder >= config.BOT_REMINDER_EVERY_DAYS:
-                logger.info(f"💡 Отправляю напоминание (прошло {days_since_reminder} дней)")
-                await bot.send_message(config.CHAT_ID, REMINDER_MSG)
-                
-                async with db._lock:
-                    db.state['last_bot_reminder'] = now
-                    db._dirty = True
-                
+            update = types.Update.model_validate(await request.json(), context={"bot": bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), config.WEBHOOK_ACCEPT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"🌐 Перегрузка: {self.in_flight} апдейтов в работе")
+            return web.Response(status=503)
+
+        self.accepted += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            await dp.feed_update(bot, update)
         except Exception as e:
-            logger.error(f"Ошибка scheduler: {e}")
-        
-        await asyncio.sleep(config.CHECK_EVERY)
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float):
+        """Ждёт обработчики, уже принятые в работу"""
+        if self._tasks:
+            logger.info(f"🌐 Дожидаюсь {self.in_flight} апдейтов")
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+async def run_webhook():
+    server = WebhookServer()
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, server.handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"🌐 Webhook слушает {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+
+    if config.WEBHOOK_URL:
+        await bot.set_webhook(
+            config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=min(config.WEBHOOK_MAX_IN_FLIGHT, 100),
+            drop_pending_updates=not config.BACKLOG_CATCH_UP
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        # Сначала перестаём принимать, потом дожидаемся принятого
+        await site.stop()
+        await server.drain(config.WEBHOOK_DRAIN_TIMEOUT)
+        await runner.cleanup()
+
+
+# ==============================
+# ⏪ ДОГОН ПОСЛЕ ПРОСТОЯ
+# ==============================
+
+class Backlog(BaseMiddleware):
+    """Апдейты, накопившиеся, пока бот лежал или перезапускался.
+
+    Outer middleware на dp.update — раньше антифлуда: пачка старых сообщений
+    не флуд. Сообщение старше BACKLOG_CUTOFF идёт быстрым путём — только
+    учёт (Ingest, команды, новые участники), без ответов, ключевых слов и
+    приветствий. Первое свежее сообщение — живой край: дальше всё идёт
+    обычной обработкой. Callbacks даты не несут и обрабатываются как обычно.
+    При polling очередь выбирается заранее в drain(), при webhook её
+    присылает сам Telegram — вперемешку со свежими, поэтому там каждое
+    сообщение сверяется с моментом запуска, а не с общим флагом.
+
+    Номер, до которого все апдейты обработаны, пишется в UPDATES_FILE вслед
+    за данными: апдейты, которые Telegram пришлёт повторно (offset не успели
+    подтвердить до остановки), второй раз не считаются. С handle_as_tasks
+    апдейты завершаются вразнобой — номер не выше самого старого незавершённого.
+    """
+
+    # Неподтверждённые апдейты Telegram хранит сутки, а после недели тишины начинает нумерацию заново
+    RESUME_TTL = 86400
+
+    def __init__(self):
+        self.live: bool = False
+        self.webhook: bool = False
+        # Апдейты не новее resume_id уже учтены и сохранены прошлым запуском
+        self.resume_id: int = 0
+        # Самый новый принятый апдейт и ещё не завершённые
+        self.last_id: int = 0
+        self._running: set = set()
+        self._saved_id: int = 0
+        # Webhook: сообщения старше этой отметки отправлены, пока бот лежал
+        self.horizon: float = 0.0
+        self.fast: int = 0
+        self.normal: int = 0
+        self.duplicates: int = 0
+        self.started: float = 0.0
+        self.elapsed: float = 0.0
+        self._commands: Optional[list] = None
+        self._tasks: set = set()
+
+    def load(self):
+        self.started = monotonic()
+        if not config.BACKLOG_CATCH_UP:
+            self.live = True
+            return
+
+        self.webhook = config.RUN_MODE == "webhook"
+        self.horizon = time() - config.BACKLOG_CUTOFF
+
+        # Реплики принимают апдейты через webhook: принятый подтверждается сразу и повторно не приходит
+        if config.REPLICA_ID:
+            return
+        stored = FastDataManager._load_json(str(chats.root / config.UPDATES_FILE), {})
+        if time() - stored.get('saved_at', 0) < self.RESUME_TTL:
+            self.resume_id = self.last_id = self._saved_id = stored.get('last_update_id', 0)
+
+    def checkpoint(self) -> int:
+        """Номер, не новее которого всё обработано"""
+        if self._running:
+            return min(self._running) - 1
+        return self.last_id
+
+    async def save(self, update_id: int):
+        """update_id снят до сохранения данных: всё, что до него, уже на диске"""
+        if update_id <= self._saved_id or config.REPLICA_ID:
+            return
+
+        try:
+            await asyncio.to_thread(FastDataManager._atomic_write, str(chats.root / config.UPDATES_FILE),
+                                    [json.dumps({'last_update_id': update_id, 'saved_at': int(time())})])
+            self._saved_id = update_id
+        except Exception as e:
+            logger.error(f"Ошибка сохранения {config.UPDATES_FILE}: {e}")
+
+    async def __call__(
+        self,
+        handler,
+        event: types.Update,
+        data: dict
+    ):
+        update_id = event.update_id
+        running = self._running
+        running.add(update_id)
+        if update_id > self.last_id:
+            self.last_id = update_id
+
+        try:
+            if not self.live or self.webhook:
+                if await self.take(event):
+                    return None
+                if not self.live:
+                    self.normal += 1
+            return await handler(event, data)
+        finally:
+            running.discard(update_id)
+
+    async def take(self, update: types.Update) -> bool:
+        """True — апдейт поглощён догоном: повтор или учтён быстрым путём"""
+        if update.update_id <= self.resume_id:
+            self.duplicates += 1
+            return True
+
+        message = update.message
+        if message is None:
+            return False
+        if message.date.timestamp() >= (self.horizon if self.webhook else time() - config.BACKLOG_CUTOFF):
+            self.finish()
+            return False
+
+        await self.apply(message)
+        self.fast += 1
+        if update.update_id > self.last_id:
+            self.last_id = update.update_id
+        return True
+
+    async def apply(self, message: types.Message):
+        """Тот же учёт, что у middleware и обработчиков, но без единого ответа"""
+        db = chats.for_chat(message.chat)
+        await db.wait_ready('users')
+
+        # Команды и состав учитываются сразу, сообщения — через очередь Ingest: сначала
+        # применяются более ранние сообщения, иначе активность пойдёт не по порядку дней
+        if message.new_chat_members:
+            ingest.flush()
+            for user in message.new_chat_members:
+                db.track_new_member(user.id, int(message.date.timestamp()))
+                db.get_user(user.id, int(message.date.timestamp()))
+        elif message.left_chat_member:
+            ingest.flush()
+            db.track_left_member(message.left_chat_member.id, int(message.date.timestamp()))
+        elif message.text and message.text.startswith('/'):
+            for command in self._command_filters():
+                found = await command(message, bot)
+                if found:
+                    ingest.flush()
+                    db.track_command(message.from_user.id, found['command'].command.lower(),
+                                     int(message.date.timestamp()))
+                    break
+        elif message.chat.type in ("group", "supergroup"):
+            # Пауза и потолок правил — по времени отправки, а не догона
+            kind = points_rules.kind(message)
+            if kind is not None:
+                ingest.track(db, message.from_user, kind, int(message.date.timestamp()))
+
+    def _command_filters(self) -> list:
+        """Фильтры Command из обработчиков — каждый такой обработчик первым делом зовёт track_command"""
+        if self._commands is None:
+            self._commands = [f.callback for handler in dp.message.handlers for f in handler.filters or ()
+                              if isinstance(f.callback, Command)]
+        return self._commands
+
+    def finish(self):
+        """Живой край: дальше обычная обработка, итог догона — в лог"""
+        if self.live:
+            return
+        self.live = True
+        # Webhook может прислать повтор и после первого свежего сообщения
+        if not self.webhook:
+            self.resume_id = 0
+        self.elapsed = monotonic() - self.started
+
+        total = self.fast + self.duplicates + self.normal
+        if total:
+            logger.info(f"⏪ Догон: {total} апдейтов за {self.elapsed:.1f} с "
+                        f"({total / max(self.elapsed, 1e-6):,.0f}/с): без ответа {self.fast}, "
+                        f"повторов {self.duplicates}, обычным путём {self.normal}")
+
+    async def drain(self):
+        """Polling: выбирает очередь до пустого ответа — start_polling продолжит с живого края"""
+        offset = None
+        while True:
+            updates = await bot.get_updates(offset=offset, limit=config.BACKLOG_BATCH, timeout=0,
+                                            allowed_updates=ALLOWED_UPDATES)
+            if not updates:
+                break
+
+            for update in updates:
+                offset = update.update_id + 1
+                if not self.live and await self.take(update):
+                    continue
+                # Задача стартует позже: до того номер не должен уйти в checkpoint
+                self._running.add(update.update_id)
+                task = asyncio.create_task(self._process(update))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+        self.finish()
+
+    async def _process(self, update: types.Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._running.discard(update.update_id)
+
+
+backlog = Backlog()
 
 
 # ==============================
 # ЗАПУСК
 # ==============================
 
+def setup_dispatcher():
+    """Middleware конвейера апдейтов — общее для polling, webhook и бенчмарков"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(backlog)
+    dp.message.outer_middleware(rate_limit)
+    dp.callback_query.outer_middleware(rate_limit)
+    dp.message.outer_middleware(ChatMiddleware())
+    dp.callback_query.outer_middleware(ChatMiddleware())
+    dp.chat_member.outer_middleware(ChatMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    dp.inline_query.middleware(HandlerMetricsMiddleware())
+    dp.chat_member.middleware(HandlerMetricsMiddleware())
+    dp.message.middleware(TrackingMiddleware())
+
+
 async def main():
     logger.info("🚀 Бот запускается...")
-    logger.info(f"👥 {db.total_users} | 💬 {db.state['total_messages']}")
+    # Раздел грузится в фоне — polling стартует, не дожидаясь его
+    open_chats().get(config.CHAT_ID)
+    logger.info(f"💬 Групп: {len(chats.known)}")
+    reload_points_rules()
+    backlog.load()
     
-    dp.message.middleware(TrackingMiddleware())
+    setup_dispatcher()
     
     asyncio.create_task(auto_save())
-    asyncio.create_task(scheduler())
+    if config.RUN_JOBS:
+        jobs.start()
+        asyncio.create_task(jobs.run())
+    asyncio.create_task(watch_keywords())
+    
+    metrics_runner = None
+    if config.METRICS_ENABLED:
+        metrics_runner = await serve_metrics()
+        asyncio.create_task(sample_loop_lag())
     
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot, allowed_updates=["message", "callback_query", "chat_member"])
+        if config.RUN_MODE == "webhook":
+            await run_webhook()
+        else:
+            await bot.delete_webhook(drop_pending_updates=not config.BACKLOG_CATCH_UP)
+            if config.BACKLOG_CATCH_UP:
+                await backlog.drain()
+            await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
     finally:
-        await db.save_all()
+        await outbox.drain(config.OUTBOX_DRAIN_TIMEOUT)
+        flushed = ingest.flush()
+        checkpoint = backlog.checkpoint()
+        saved = await chats.save_all()
+        await jobs.save()
+        if flushed and saved:
+            await backlog.save(checkpoint)
+        if metrics_runner:
+            await metrics_runner.cleanup()
         logger.info("✅ Данные сохранены")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if sys.argv[1:2] == ["migrate-sqlite"]:
+        migrate_json_to_sqlite()
+    elif sys.argv[1:2] == ["merge-replicas"]:
+        merge_replica_files()
+    elif sys.argv[1:2] == ["export"]:
+        export_cli(sys.argv[2:])
+    else:
+        asyncio.run(main())
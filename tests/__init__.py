@@ -0,0 +1,73 @@
+"""Проверки круговых путей данных и крайних случаев: python -m unittest (или pytest).
+
+bot.py на импорте требует токен — подставляется фиктивный. Каждый тест
+пишет файлы в свою временную папку (temp_root), конфиг меняется через patch.
+"""
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+ROOT = Path(__file__).resolve().parent.parent
+
+os.environ.setdefault("TOKEN", "123456:TESTS")
+sys.path.insert(0, str(ROOT))
+
+import bot  # noqa: E402
+
+bot.logger.setLevel("CRITICAL")
+# Отладочный режим тестового цикла пишет в лог каждый открытый сервер, aiohttp — каждый запрос
+logging.getLogger("asyncio").setLevel("WARNING")
+logging.getLogger("aiohttp.access").setLevel("WARNING")
+
+
+def temp_root(test: unittest.TestCase) -> Path:
+    """Папка данных, которая удалится после теста"""
+    tmp = tempfile.TemporaryDirectory(prefix="haybot-test-")
+    test.addCleanup(tmp.cleanup)
+    return Path(tmp.name)
+
+
+def chats_root(test: unittest.TestCase) -> Path:
+    """Временная папка как рабочая: ChatPartitions и перенос старых файлов считают пути от cwd.
+    Глобальный bot.chats на время теста пуст — open_chats() создаст свой"""
+    root = temp_root(test)
+    cwd = os.getcwd()
+    os.chdir(root)
+    test.addCleanup(os.chdir, cwd)
+    patcher = patch.object(bot, 'chats', None)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return root
+
+
+def noon(days: int = 0) -> int:
+    """Полдень через days дней от сегодняшнего — подальше от границ суток"""
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    return int((today + timedelta(days=days, hours=12)).timestamp())
+
+
+class Clock:
+    """Подменяет bot.time: индексы сами сдвигают «сегодня» по текущему времени"""
+
+    def __init__(self, test: unittest.TestCase, now: int):
+        self.now = now
+        patcher = patch.object(bot, 'time', lambda: self.now)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+def snapshot(db: 'bot.FastDataManager') -> dict:
+    """То, что должно пережить сохранение и перезагрузку"""
+    return {
+        'users': {uid: bot.user_row(user) for uid, user in db.users.items()},
+        'total_messages': db.state['total_messages'],
+        'windows': sorted(db._windows.cells()),
+        # Порядок равных очков внутри бакета не сохраняется — сравниваются места
+        'ranks': {uid: db.get_user_rank(uid) for uid in db.users},
+        'roster': db.roster.to_json()
+    }
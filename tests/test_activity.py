@@ -0,0 +1,94 @@
+"""ActivityIndex: активные за N дней и история DAU против полного пересчёта, смена суток, перестроение"""
+import random
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from tests import Clock, bot, noon, temp_root
+
+
+def ordinal(now: int) -> int:
+    return date.fromtimestamp(now).toordinal()
+
+
+class ActivityIndexTest(unittest.TestCase):
+
+    def assert_counts(self, index: 'bot.ActivityIndex', last_active: dict, visits: set, today: int):
+        for days in (0, 1, 2, 7, 30, 90):
+            want = sum(1 for ts in last_active.values() if ordinal(ts) > today - max(days, 1))
+            self.assertEqual(index.active_count(days), want, f"{days} дн., день {today}")
+
+        history = index.daily_history(10)
+        self.assertEqual([day.toordinal() for day, _ in history], list(range(today - 9, today + 1)))
+        self.assertEqual([count for _, count in history],
+                         [sum(1 for day, _ in visits if day == today - i) for i in range(9, -1, -1)])
+
+    def test_random_days_with_gaps(self):
+        """Сутки сменяются по одной и прыжками; повтор в тот же день DAU не растит"""
+        rnd = random.Random(5)
+        clock = Clock(self, noon())
+        index = bot.ActivityIndex()
+        last_active, visits = {}, set()
+        offset = 0
+
+        for _ in range(150):
+            offset += rnd.choice((0, 0, 1, 1, 2, 5, 12))
+            clock.now = noon(offset) + rnd.randint(-3 * 3600, 3 * 3600)
+            for _ in range(rnd.randint(1, 8)):
+                uid = rnd.randrange(40)
+                index.touch(last_active.get(uid), clock.now)
+                last_active[uid] = clock.now
+                visits.add((ordinal(clock.now), uid))
+            self.assert_counts(index, last_active, visits, ordinal(clock.now))
+
+    def test_history_is_bounded(self):
+        clock = Clock(self, noon())
+        index = bot.ActivityIndex()
+        with patch.object(bot.config, 'ACTIVITY_HISTORY_DAYS', 5):
+            for offset in range(8):
+                clock.now = noon(offset)
+                index.touch(None, clock.now)
+            self.assertEqual(len(index.history_json()), 5)
+            self.assertEqual(index.active_count(30), 5)
+            self.assertEqual(len(index.history_json(2)), 2)
+
+    def test_merge_from_replica(self):
+        """Чужой last_active переносит пользователя в свой день, а не в сегодня"""
+        Clock(self, noon())
+        index = bot.ActivityIndex()
+        index.merge(None, noon(-5))
+        index.merge(noon(-5), noon(-2))
+        index.merge(None, noon(-40))
+        self.assertEqual(index.active_count(1), 0)
+        self.assertEqual(index.active_count(3), 1)
+        self.assertEqual(index.active_count(60), 2)
+
+        index.merge_history({date.fromtimestamp(noon(-1)).isoformat(): 7})
+        index.merge_history({date.fromtimestamp(noon(-1)).isoformat(): 3})
+        self.assertEqual(index.daily_history(2)[0][1], 7)
+
+
+class ActivityRebuildTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_rebuilt_on_load(self):
+        """Счётчики по last_active строятся заново, история DAU — из состояния"""
+        root = temp_root(self)
+        clock = Clock(self, noon(-20))
+        db = bot.FastDataManager(-100, root)
+        await db.load()
+        for offset in (-20, -6, -1, 0):
+            clock.now = noon(offset)
+            db.track_messages({uid: [1, 0, "", ""] for uid in range(-offset, -offset + 4)}, clock.now)
+        db._snapshot_due = True
+        self.assertTrue(await db.save_all())
+
+        fresh = bot.FastDataManager(-100, root)
+        await fresh.load()
+        await fresh.wait_ready('activity')
+        for days in (1, 2, 7, 30):
+            self.assertEqual(fresh.get_active_count(days), db.get_active_count(days))
+        self.assertEqual(fresh.get_daily_active(30), db.get_daily_active(30))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Backlog: учёт догона по времени отправки, граница живого края и продолжение с сохранённого номера"""
+import json
+import unittest
+from datetime import date, datetime
+from time import time
+from unittest.mock import patch
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from tests import bot, chats_root, noon, snapshot
+
+CHAT = Chat(id=-100, type='supergroup')
+
+
+def update(update_id: int, sent: float, uid: int = 1, text: str = "բարև", **fields) -> Update:
+    message = Message(message_id=update_id, date=datetime.fromtimestamp(sent), chat=CHAT,
+                      from_user=User(id=uid, is_bot=False, first_name=f"u{uid}"), text=text, **fields)
+    return Update(update_id=update_id, message=message)
+
+
+def day(days: int) -> str:
+    return date.fromtimestamp(noon(days)).isoformat()
+
+
+class BacklogTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.root = chats_root(self)
+        for patcher in (patch.object(bot.config, 'CHAT_ID', CHAT.id), patch.object(bot, 'ingest', bot.Ingest()),
+                        patch.object(bot, 'points_rules', bot.PointsRules({'messages': {'text': {'every': 1}}}))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.chats = bot.open_chats()
+        self.handled = []
+
+    def backlog(self) -> 'bot.Backlog':
+        backlog = bot.Backlog()
+        backlog.load()
+        return backlog
+
+    async def handler(self, event: Update, data: dict):
+        self.handled.append(event.update_id)
+
+    async def feed(self, backlog: 'bot.Backlog', *updates: Update):
+        for event in updates:
+            await backlog(self.handler, event, {})
+
+    async def test_old_messages_count_on_their_day(self):
+        """Сообщения догона — в свои дни: последняя активность, DAU и очки за период"""
+        backlog = self.backlog()
+        joined = update(1, noon(-3), uid=3, text=None, new_chat_members=[User(id=3, is_bot=False, first_name="n")])
+        await self.feed(backlog, update(2, noon(-3)), update(3, noon(-3) + 60), update(4, noon(-1), uid=2),
+                        update(5, noon(-1) + 60, text="/top"), joined)
+        self.assertEqual(self.handled, [])
+        self.assertEqual(backlog.fast, 5)
+
+        db = self.chats.get(CHAT.id)
+        bot.ingest.flush()
+        # Пакет дня применяется со временем его последнего сообщения
+        self.assertEqual((db.users[1].joined, db.users[1].last_active), (noon(-3) + 60, noon(-1) + 60))
+        self.assertEqual((db.users[1].messages, db.users[1].commands, db.users[2].last_active), (2, 1, noon(-1)))
+        self.assertEqual(db.users[3].joined, noon(-3))
+        self.assertEqual(db._windows.to_json(), {day(-3): {"1": 2}, day(-1): {"2": 1, "1": 2}})
+        self.assertEqual({d: n for d, n in db._activity.history_json().items() if n}, {day(-3): 2, day(-1): 2})
+        self.assertEqual((db.get_active_count(1), db.get_active_count(3)), (0, 2))
+
+        # Журнал пишет все затронутые дни, а не только вчера и сегодня
+        expected = {**snapshot(db), 'daily_active': db._activity.history_json()}
+        self.assertTrue(await db.save_all())
+        self.assertEqual(db.save_stats['kind'], 'journal')
+        reloaded = bot.FastDataManager(CHAT.id, db.root)
+        await reloaded.load()
+        self.assertEqual({**snapshot(reloaded), 'daily_active': reloaded._activity.history_json()}, expected)
+
+    async def test_live_edge(self):
+        backlog = self.backlog()
+        callback = Update(update_id=2, callback_query=CallbackQuery(
+            id="q", from_user=User(id=1, is_bot=False, first_name="a"), chat_instance="c", data="refresh_top"))
+        await self.feed(backlog, update(1, time() - bot.config.BACKLOG_CUTOFF - 10), callback)
+        self.assertFalse(backlog.live)
+        self.assertEqual((backlog.fast, backlog.normal, self.handled), (1, 1, [2]))
+
+        # Первое свежее сообщение — живой край; в polling дальше всё идёт обычным путём
+        await self.feed(backlog, update(3, time()), update(4, noon(-2)))
+        self.assertTrue(backlog.live)
+        self.assertEqual(self.handled, [2, 3, 4])
+        self.assertEqual(backlog.fast, 1)
+
+    async def test_webhook_checks_every_message(self):
+        with patch.object(bot.config, 'RUN_MODE', "webhook"):
+            backlog = self.backlog()
+        await self.feed(backlog, update(1, time()), update(2, time() - bot.config.BACKLOG_CUTOFF - 10))
+        self.assertTrue(backlog.live)
+        self.assertEqual((self.handled, backlog.fast), ([1], 1))
+
+    async def test_resume_from_checkpoint(self):
+        old = time() - bot.config.BACKLOG_CUTOFF - 10
+        first = self.backlog()
+        await self.feed(first, *(update(i, old) for i in range(1, 4)))
+        await first.save(first.checkpoint())
+        with open(self.root / bot.config.CHATS_DIR / bot.config.UPDATES_FILE) as f:
+            self.assertEqual(json.load(f)['last_update_id'], 3)
+
+        # Telegram присылает неподтверждённые апдейты заново — второй раз они не считаются
+        second = self.backlog()
+        await self.feed(second, *(update(i, old) for i in range(1, 5)))
+        self.assertEqual((second.duplicates, second.fast), (3, 1))
+        bot.ingest.flush()
+        self.assertEqual(self.chats.get(CHAT.id).users[1].messages, 4)
+
+        # Сохранённому номеру старше суток не верим
+        with patch.object(bot, 'time', lambda: time() + bot.Backlog.RESUME_TTL + 1):
+            self.assertEqual(self.backlog().resume_id, 0)
+
+    async def test_checkpoint_waits_for_running(self):
+        backlog = self.backlog()
+        backlog.live = True
+        backlog._running.update((5, 7))
+        backlog.last_id = 9
+        self.assertEqual(backlog.checkpoint(), 4)
+
+        backlog._running.clear()
+        self.assertEqual(backlog.checkpoint(), 9)
+        await backlog.save(9)
+        await backlog.save(4)
+        self.assertEqual(bot.FastDataManager._load_json(str(self.chats.root / bot.config.UPDATES_FILE), {})
+                         ['last_update_id'], 9)
+
+
+class ActivityBackdatedTest(unittest.TestCase):
+
+    def test_touch_in_past_days(self):
+        index = bot.ActivityIndex()
+        index.touch(None, noon(-5))
+        index.touch(noon(-5), noon(-5) + 60)
+        index.touch(noon(-5), noon(-2))
+        # Позже уже был активен — прошлый день не трогается
+        index.touch(noon(-2), noon(-3))
+        index.touch(None, noon(-3))
+        self.assertEqual(index.history_json(), {day(-5): 1, day(-2): 1, day(-3): 1})
+        self.assertEqual([index.active_count(n) for n in (1, 3, 4, 6)], [0, 1, 2, 2])
+
+        index.touch(noon(-2), noon())
+        self.assertEqual([index.active_count(n) for n in (1, 3, 4)], [1, 1, 2])
+        # За горизонтом истории не считается
+        index.touch(None, noon(-bot.config.ACTIVITY_HISTORY_DAYS - 1))
+        self.assertEqual(index.active_count(bot.config.ACTIVITY_HISTORY_DAYS + 5), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
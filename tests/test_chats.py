@@ -0,0 +1,143 @@
+"""ChatPartitions: ленивая загрузка разделов, выгрузка молчащих чатов с сохранением и перенос старой раскладки"""
+import json
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from aiogram.types import Chat, User
+
+from tests import bot, chats_root, noon, snapshot
+
+HOME = -100
+
+
+class ChatPartitionsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.root = chats_root(self)
+        self.now = 1000.0
+        for patcher in (patch.object(bot.config, 'CHAT_ID', HOME), patch.object(bot, 'monotonic', lambda: self.now),
+                        patch.object(bot, 'ingest', bot.Ingest()), patch.object(bot, 'screens', bot.RenderCache())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.chats = bot.open_chats()
+
+    async def open(self, chat_id: int) -> 'bot.FastDataManager':
+        part = self.chats.get(chat_id)
+        await part.wait_ready('activity')
+        return part
+
+    async def test_lazy_load(self):
+        self.assertEqual(self.chats.loaded, {})
+        self.assertIn(HOME, self.chats.known)
+
+        part = await self.open(-200)
+        self.assertIs(self.chats.get(-200), part)
+        self.assertEqual(list(self.chats.loaded), [-200])
+        self.assertTrue((self.root / "chats" / "-200").is_dir())
+        self.assertIs(self.chats.for_chat(Chat(id=7, type='private')), self.chats.get(HOME))
+        # Личные чаты группами не считаются
+        self.assertFalse(self.chats.register(7))
+
+        part.track_messages({1: [3, 1, "", ""]}, noon())
+        self.assertTrue(await self.chats.save_all())
+        with open(self.root / "chats" / bot.config.CHATS_FILE, encoding='utf-8') as f:
+            self.assertEqual(set(json.load(f)), {str(HOME), "-200"})
+        self.assertEqual([path.name for path in self.chats.chat_dirs()], ["-100", "-200"])
+        self.assertTrue(any((self.root / "chats" / "-200").iterdir()))
+        self.assertFalse(any((self.root / "chats" / "-100").iterdir()))
+
+    async def test_idle_chat_is_saved_and_unloaded(self):
+        idle = await self.open(-200)
+        busy = await self.open(-300)
+        idle.track_messages({1: [5, 2, "a", "A"]}, noon())
+        bot.screens.render(('top', -200), idle.version, lambda: "топ")
+        expected = snapshot(idle)
+
+        self.now += bot.config.CHAT_IDLE_TIMEOUT + 1
+        self.chats.get(-300)
+        await self.chats.evict_idle()
+
+        self.assertEqual(list(self.chats.loaded), [-300])
+        self.assertIs(self.chats.loaded[-300], busy)
+        self.assertFalse(bot.screens._texts)
+
+        reloaded = await self.open(-200)
+        self.assertIsNot(reloaded, idle)
+        self.assertEqual(snapshot(reloaded), expected)
+
+    async def test_queued_events_keep_the_chat_loaded(self):
+        """События в очереди применяются до выгрузки — раздел остаётся до следующего сохранения"""
+        part = await self.open(-200)
+        bot.ingest.track(part, User(id=1, is_bot=False, first_name="A"), 'text', noon())
+
+        self.now += bot.config.CHAT_IDLE_TIMEOUT + 1
+        await self.chats.evict_idle()
+        self.assertIn(-200, self.chats.loaded)
+        self.assertEqual(part.users[1].messages, 1)
+
+        await self.chats.evict_idle()
+        self.assertNotIn(-200, self.chats.loaded)
+        self.assertEqual((await self.open(-200)).users[1].messages, 1)
+
+    async def test_failed_save_keeps_the_chat_loaded(self):
+        part = await self.open(-200)
+        part.track_messages({1: [1, 1, "", ""]}, noon())
+        self.now += bot.config.CHAT_IDLE_TIMEOUT + 1
+
+        async def fail(db):
+            return False
+
+        with patch.object(bot.FastDataManager, 'save_all', fail):
+            await self.chats.evict_idle()
+        self.assertIs(self.chats.loaded[-200], part)
+
+
+class LegacyLayoutTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.root = chats_root(self)
+        patcher = patch.object(bot.config, 'CHAT_ID', HOME)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def write_legacy(self) -> dict:
+        """Данные единственной группы в корне, как до разделов: снимок и журнал поверх него"""
+        db = bot.FastDataManager(HOME, Path('.'))
+        await db.load()
+        db.track_messages({uid: [uid, uid % 3, f"u{uid}", ""] for uid in range(1, 20)}, noon())
+        db._snapshot_due = True
+        await db.save_all()
+        db.track_messages({1: [7, 4, "", ""]}, noon())
+        db.state['last_fb_post'] = "2024-05-01T10:00:00"
+        db._snapshot_due = False
+        await db.save_all()
+        expected = snapshot(db)
+        db.close()
+        return expected
+
+    async def test_files_move_into_home_partition(self):
+        expected = await self.write_legacy()
+        legacy = sorted(path.name for path in self.root.iterdir() if path.is_file())
+        self.assertIn(bot.config.USERS_FILE, legacy)
+
+        chats = bot.open_chats()
+        target = self.root / "chats" / str(HOME)
+        self.assertEqual([path for path in self.root.iterdir() if path.is_file()], [])
+        self.assertEqual(sorted(path.name for path in target.iterdir()), legacy)
+
+        part = chats.get(HOME)
+        await part.wait_ready('activity')
+        self.assertEqual(snapshot(part), expected)
+
+    async def test_existing_partition_is_not_overwritten(self):
+        await self.write_legacy()
+        (self.root / "chats" / str(HOME)).mkdir(parents=True)
+
+        bot.open_chats()
+        self.assertTrue((self.root / bot.config.USERS_FILE).exists())
+        self.assertFalse(any((self.root / "chats" / str(HOME)).iterdir()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""CronSpec: разбор полей и следующее срабатывание против перебора по минутам"""
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from tests import bot
+
+
+def brute_next(spec: 'bot.CronSpec', when: datetime) -> datetime:
+    t = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    while not (t.minute in spec.minutes and t.hour in spec.hours and t.month in spec.months
+               and spec._day_matches(t)):
+        t += timedelta(minutes=1)
+    return t
+
+
+class CronSpecTest(unittest.TestCase):
+
+    def test_parse(self):
+        spec = bot.CronSpec("*/15 9-17 1,15 * 1-5")
+        self.assertEqual(spec.minutes, {0, 15, 30, 45})
+        self.assertEqual(spec.hours, frozenset(range(9, 18)))
+        self.assertEqual(spec.days, {1, 15})
+        self.assertEqual(spec.months, frozenset(range(1, 13)))
+        self.assertEqual(spec.weekdays, {1, 2, 3, 4, 5})
+        self.assertEqual(bot.CronSpec("0 0 * * 7").weekdays, {0})
+        self.assertEqual(bot.CronSpec("5/20 * * * *").minutes, {5, 25, 45})
+
+    def test_invalid(self):
+        for expr in ("* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8",
+                     "5-1 * * * *", "a * * * *"):
+            with self.subTest(expr=expr), self.assertRaises(ValueError):
+                bot.CronSpec(expr)
+
+    def test_never_fires(self):
+        with self.assertRaises(ValueError):
+            bot.CronSpec("0 0 31 2 *").next_after(datetime(2026, 1, 1))
+
+    def test_day_of_month_or_weekday(self):
+        """Заданы оба поля — подходит любой из дней, как в cron"""
+        spec = bot.CronSpec("0 12 13 * 5")
+        fires = []
+        t = datetime(2026, 2, 1)
+        for _ in range(8):
+            t = spec.next_after(t)
+            fires.append(t)
+        self.assertTrue(all(t.day == 13 or t.isoweekday() == 5 for t in fires))
+        self.assertIn(datetime(2026, 2, 13, 12, 0), fires)
+        self.assertIn(datetime(2026, 2, 6, 12, 0), fires)
+
+    def test_month_and_year_rollover(self):
+        spec = bot.CronSpec("30 23 31 * *")
+        self.assertEqual(spec.next_after(datetime(2026, 4, 1)), datetime(2026, 5, 31, 23, 30))
+        self.assertEqual(spec.next_after(datetime(2026, 12, 31, 23, 30)), datetime(2027, 1, 31, 23, 30))
+        self.assertEqual(bot.CronSpec("0 0 29 2 *").next_after(datetime(2026, 3, 1)), datetime(2028, 2, 29))
+
+    def test_matches_brute_force(self):
+        rnd = random.Random(2)
+        exprs = ["*/7 * * * *", "0 9 * * 1-5", "15 */6 1,10,20 * *", "0 0 * 2,8 0", "45 22 * * *",
+                 "0,30 8-10 5-9 * 2,4", "59 23 28-31 * *"]
+        for expr in exprs:
+            spec = bot.CronSpec(expr)
+            for _ in range(20):
+                when = datetime(2026, 1, 1) + timedelta(minutes=rnd.randrange(366 * 24 * 60), seconds=rnd.randrange(60))
+                with self.subTest(expr=expr, when=when):
+                    self.assertEqual(spec.next_after(when), brute_next(spec, when))
+
+
+if __name__ == "__main__":
+    unittest.main()
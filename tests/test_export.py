@@ -0,0 +1,143 @@
+"""Экспорт: потоковые CSV и JSON Lines в gzip кусками против export_rows, отбор и CLI"""
+import csv
+import gzip
+import io
+import json
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from tests import bot, chats_root, noon, temp_root
+
+CHAT_ID = -100
+
+
+def fill(db: 'bot.FastDataManager'):
+    """Очки 0..5 и последняя активность от сегодня до пяти дней назад"""
+    for days in range(5, -1, -1):
+        db.track_messages({uid: [1, (uid + days) % 6, f"u{uid}", f"Имя, \"{uid}\""]
+                           for uid in range(1, 200) if uid % 6 >= days}, noon(-days))
+
+
+def unpack(chunks) -> str:
+    return gzip.decompress(b''.join(chunks)).decode()
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = bot.FastDataManager(CHAT_ID)
+        self.db._mark_ready(*self.db.READY_PARTS)
+        fill(self.db)
+
+    def expected(self, min_points: int = 0, active_since: int = 0) -> dict:
+        return {uid: bot.user_row(user) for uid, user in self.db.users.items()
+                if user.points >= min_points and user.last_active >= active_since}
+
+    def test_rows_filter(self):
+        since = noon(-2)
+        for min_points, active_since in ((0, 0), (4, 0), (0, since), (3, since), (1000, 0)):
+            with self.subTest(min_points=min_points, active_since=active_since):
+                rows = dict(self.db.export_rows(min_points, active_since))
+                self.assertEqual(rows, self.expected(min_points, active_since))
+        self.assertEqual(dict(self.db.export_rows(1000)), {})
+
+    def test_csv_gzip_in_chunks(self):
+        with patch.object(bot.config, 'EXPORT_CHUNK_SIZE', 512):
+            chunks = list(bot.export_chunks(bot.export_lines(self.db, 'csv', 2)))
+
+        header, *rows = csv.reader(io.StringIO(unpack(chunks), newline=''))
+        self.assertEqual(tuple(header), bot.EXPORT_COLUMNS)
+        exported = {int(uid): (name, username, int(points), int(messages), int(commands),
+                               int(datetime.fromisoformat(joined).timestamp()),
+                               int(datetime.fromisoformat(last_active).timestamp()))
+                    for uid, name, username, points, messages, commands, joined, last_active in rows}
+        self.assertEqual(exported, self.expected(2))
+
+    def test_jsonl_with_summary(self):
+        since = noon(-1)
+        with patch.object(bot.config, 'EXPORT_CHUNK_SIZE', 256):
+            text = unpack(bot.export_chunks(bot.export_lines(self.db, 'jsonl', active_since=since)))
+
+        summary, *users = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(summary['type'], 'chat')
+        self.assertEqual((summary['total_users'], summary['total_messages']),
+                         (self.db.total_users, self.db.state['total_messages']))
+        self.assertEqual(summary['active_since'], datetime.fromtimestamp(since).isoformat())
+        self.assertEqual({user.pop('uid'): user for user in users if user.pop('type') == 'user'},
+                         {uid: bot.UserRecord.row_to_json(row) for uid, row in self.expected(0, since).items()})
+
+    def test_plain_chunks(self):
+        lines = list(bot.export_lines(self.db, 'csv'))
+        with patch.object(bot.config, 'EXPORT_CHUNK_SIZE', 100):
+            chunks = list(bot.export_chunks(iter(lines), compress=False))
+        self.assertEqual(b''.join(chunks).decode(), ''.join(lines))
+        self.assertTrue(all(len(chunk) >= 100 for chunk in chunks[:-1]))
+        self.assertEqual(list(bot.export_chunks(iter(()), compress=False)), [])
+
+        # Строки читаются по мере отдачи кусков, а не все сразу
+        read = []
+        with patch.object(bot.config, 'EXPORT_CHUNK_SIZE', 100):
+            next(bot.export_chunks((line for line in lines if not read.append(line)), compress=False))
+        self.assertLess(len(read), len(lines) // 2)
+
+    def test_parse_args(self):
+        self.assertEqual(bot.parse_export_args(None), ('csv', 0, 0))
+        self.assertEqual(bot.parse_export_args("JSONL min=5 since=2024-05-01"),
+                         ('jsonl', 5, int(datetime(2024, 5, 1).timestamp())))
+        self.assertEqual(bot.parse_since("1"), bot.parse_since("0"))
+        self.assertEqual(noon() - bot.parse_since("1"), 12 * 3600)
+        for args in ("xml", "min=x", "since=вчера"):
+            with self.subTest(args=args), self.assertRaises(ValueError):
+                bot.parse_export_args(args)
+
+
+class ExportFileTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_read_restarts_export(self):
+        db = bot.FastDataManager(CHAT_ID)
+        db._mark_ready(*db.READY_PARTS)
+        fill(db)
+        with patch.object(bot.config, 'EXPORT_CHUNK_SIZE', 1024):
+            document = bot.ExportFile(lambda: bot.export_chunks(bot.export_lines(db, 'csv')), "x.csv.gz")
+            first = [chunk async for chunk in document.read(None)]
+            # Повтор после RetryAfter отдаёт файл целиком заново
+            second = [chunk async for chunk in document.read(None)]
+        self.assertEqual(unpack(first), unpack(second))
+        self.assertEqual(document.written, sum(map(len, second)))
+
+
+class SqliteExportTest(unittest.TestCase):
+
+    def test_rows_match_records(self):
+        db = bot.SqliteDataManager(CHAT_ID, temp_root(self))
+        db._load_all()
+        self.addCleanup(db.close)
+        fill(db)
+
+        # Ещё не сброшенные в базу изменения тоже попадают в экспорт
+        rows = dict(db.export_rows(3, noon(-3)))
+        expected = {uid: bot.user_row(db.peek_user(uid)) for uid in range(1, 200)}
+        self.assertEqual(rows, {uid: row for uid, row in expected.items() if row[2] >= 3 and row[6] >= noon(-3)})
+
+
+class ExportCliTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_writes_file(self):
+        root = chats_root(self)
+        with patch.object(bot.config, 'CHAT_ID', CHAT_ID):
+            db = bot.open_chats().get(CHAT_ID)
+            await db.wait_ready('activity')
+            fill(db)
+            expected = {uid: bot.user_row(user) for uid, user in db.users.items() if user.points >= 4}
+            await db.save_all()
+
+            bot.export_cli(['--format', 'jsonl', '--min-points', '4', '--output', 'out.jsonl.gz'])
+        with gzip.open(root / 'out.jsonl.gz', 'rt', encoding='utf-8') as f:
+            users = [json.loads(line) for line in f][1:]
+        self.assertEqual({user['uid']: user['points'] for user in users},
+                         {uid: row[2] for uid, row in expected.items()})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Ingest: пакеты по разделу и пользователю, очки по правилам в очереди, повтор упавшего раздела и переполнение"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from aiogram.types import User
+
+from tests import bot, noon
+
+TRACK = bot.FastDataManager.track_messages
+
+
+def user(uid: int) -> User:
+    return User(id=uid, is_bot=False, first_name=f"u{uid}", username=f"u{uid}")
+
+
+class IngestTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.ingest = bot.Ingest()
+        self.calls = []
+        self.broken = set()
+        for patcher in (patch.object(bot, 'points_rules', bot.PointsRules({})),
+                        patch.object(bot.FastDataManager, 'track_messages',
+                                     lambda db, counts, now: self.track_messages(db, counts, now))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addAsyncCleanup(self.stop)
+        self.a = bot.FastDataManager(-100)
+        self.b = bot.FastDataManager(-200)
+
+    async def stop(self):
+        if self.ingest._worker is not None:
+            self.ingest._worker.cancel()
+
+    def track_messages(self, db, counts, now):
+        """Запоминает пакеты; раздел из broken падает, не записав ничего"""
+        self.calls.append((db.chat_id, {uid: entry[:2] for uid, entry in counts.items()}))
+        if db.chat_id in self.broken:
+            raise OSError("сбой раздела")
+        TRACK(db, counts, now)
+
+    def send(self, db, uid: int, times: int = 1):
+        for _ in range(times):
+            self.ingest.track(db, user(uid), 'text', noon())
+
+    async def test_batch_by_partition_and_user(self):
+        self.send(self.a, 1, 3)
+        self.send(self.b, 1)
+        self.send(self.a, 2, 2)
+        self.assertEqual(self.ingest.depth, 6)
+
+        self.assertTrue(self.ingest.flush())
+        self.assertEqual(self.calls, [(-100, {1: [3, 0], 2: [2, 0]}), (-200, {1: [1, 0]})])
+        self.assertEqual((self.ingest.applied, self.ingest.batches, self.ingest.depth), (6, 1, 0))
+        self.assertEqual((self.a.users[1].messages, self.a.users[1].username), (3, "u1"))
+        self.assertEqual(self.a.state['total_messages'], 5)
+
+    async def test_max_batch(self):
+        self.send(self.a, 1, 5)
+        with patch.object(bot.config, 'INGEST_MAX_BATCH', 2):
+            self.ingest.flush()
+        self.assertEqual([counts[1][0] for _, counts in self.calls], [2, 2, 1])
+        self.assertEqual(self.ingest.batches, 3)
+
+    async def test_every_n_counts_queued_messages(self):
+        """Состояние правил, заведённое при уже стоящих в очереди событиях, не теряет их и не считает дважды"""
+        self.a.users[1] = bot.UserRecord(messages=7)
+        self.send(self.a, 1, 2)
+        # Правила перечитаны, пока события ждали: новое состояние — с нуля
+        bot.points_rules = bot.PointsRules({})
+        self.send(self.a, 1, 2)
+        self.ingest.flush()
+
+        self.assertEqual(self.a.users[1].messages, 11)
+        self.assertEqual(self.a.users[1].points, bot.config.POINTS_PER_10_MESSAGES)
+        self.assertEqual(bot.points_rules.remaining(self.a, 1, 11), 9)
+
+    async def test_failed_partition_is_retried_first(self):
+        self.broken.add(-200)
+        self.a.users[1] = bot.UserRecord(messages=9)
+        self.b.users[1] = bot.UserRecord(messages=9)
+        self.send(self.b, 1)
+        self.send(self.a, 1)
+
+        self.assertFalse(self.ingest.flush())
+        self.assertEqual(self.ingest.depth, 1)
+        self.assertEqual(self.ingest.applied, 1)
+        self.assertEqual(self.a.users[1].messages, 10)
+
+        # Новое событие встаёт за вернувшимся; очки вернувшегося не пересчитываются
+        self.send(self.b, 1)
+        self.broken.clear()
+        self.assertTrue(self.ingest.flush())
+        self.assertEqual(self.calls[-1], (-200, {1: [2, bot.config.POINTS_PER_10_MESSAGES]}))
+        self.assertEqual(self.b.users[1].points, bot.config.POINTS_PER_10_MESSAGES)
+        self.assertEqual(self.ingest.applied, 3)
+
+    async def test_dropped_after_retries(self):
+        self.broken.add(-200)
+        self.send(self.b, 1, 2)
+        self.send(self.a, 1)
+
+        for _ in range(bot.config.INGEST_MAX_RETRIES):
+            self.ingest.flush()
+        self.assertEqual(self.ingest.depth, 0)
+        self.assertEqual(self.ingest.dropped, 2)
+        self.assertEqual(self.ingest.applied, 1)
+        self.assertEqual(len(self.calls), 1 + bot.config.INGEST_MAX_RETRIES)
+        self.assertFalse(self.ingest._failures)
+
+    async def test_overflow(self):
+        with patch.object(bot.config, 'INGEST_QUEUE_SIZE', 3):
+            self.send(self.a, 1, 5)
+        self.assertEqual((self.ingest.depth, self.ingest.dropped), (3, 2))
+        self.ingest.flush()
+        self.assertEqual(self.a.users[1].messages, 3)
+
+    async def test_writer_applies_in_background(self):
+        with patch.object(bot.config, 'INGEST_BATCH_DELAY', 0):
+            self.send(self.a, 1, 2)
+            self.send(self.a, 2)
+            for _ in range(5):
+                await asyncio.sleep(0)
+        self.assertEqual(self.ingest.depth, 0)
+        self.assertEqual(self.calls, [(-100, {1: [2, 0], 2: [1, 0]})])
+
+
+if __name__ == "__main__":
+    unittest.main()
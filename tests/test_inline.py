@@ -0,0 +1,111 @@
+"""Inline-режим: статьи рейтингов и профиля из кэша экранов, без создания строк для чужих"""
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import AnswerInlineQuery
+from aiogram.types import User
+
+from tests import bot, chats_root, noon
+
+STRANGER = User(id=42, is_bot=False, first_name="Անծանոթ")
+
+
+class InlineTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.db = bot.FastDataManager(-100)
+        self.db._mark_ready(*self.db.READY_PARTS)
+        self.db.track_messages({1: [10, 5, "a", "Արամ"], 2: [3, 2, "", "Анна"]}, noon())
+        for patcher in (patch.object(bot, 'screens', bot.RenderCache(10)), patch.object(bot, 'ingest', bot.Ingest())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_profile_without_row(self):
+        version = self.db.version
+        article = bot.get_inline_profile(self.db, STRANGER)
+        self.assertEqual(article.description, "❌ Տվյալներ դեռ չկան")
+        self.assertIsNone(self.db.peek_user(STRANGER.id))
+        self.assertEqual((self.db.total_users, self.db.version), (2, version))
+
+    def test_profile_is_cached_by_standing(self):
+        anna = User(id=2, is_bot=False, first_name="Анна")
+        article = bot.get_inline_profile(self.db, anna)
+        self.assertEqual(article.description, "🏆 #2 · 💎 2")
+        self.assertIn("Анна", article.input_message_content.message_text)
+
+        # Сообщения без очков место и очки не меняют — статья та же
+        self.db.track_messages({2: [1, 0, "", ""]}, noon())
+        self.assertIs(bot.get_inline_profile(self.db, anna), article)
+
+        self.db.track_messages({2: [1, 4, "", ""]}, noon())
+        changed = bot.get_inline_profile(self.db, anna)
+        self.assertEqual(changed.description, "🏆 #1 · 💎 6")
+        self.assertEqual(bot.screens.stats['misses'], 2)
+
+    def test_top_articles(self):
+        articles = bot.get_inline_top(self.db)
+        self.assertEqual([a.id for a in articles], ["top:all", *(f"top:{w}" for w in bot.config.TOP_WINDOWS)])
+        self.assertEqual(articles[0].description, "🥇 Արամ · 💎 5")
+        self.assertIs(bot.get_inline_top(self.db), articles)
+
+        self.db.track_messages({1: [1, 0, "", ""]}, noon())
+        self.assertIs(bot.get_inline_top(self.db), articles)
+        self.db.track_messages({2: [1, 9, "", ""]}, noon())
+        self.assertEqual(bot.get_inline_top(self.db)[0].description, "🥇 Анна · 💎 11")
+
+    async def test_queued_messages_are_seen(self):
+        bot.ingest.track(self.db, STRANGER, 'text', noon())
+        self.assertEqual(bot.get_inline_profile(self.db, STRANGER).description, "🏆 #3 · 💎 0")
+
+    def test_window_top_creates_no_rows(self):
+        # Очки за период остались у того, чьей строки уже нет (например, после merge реплик)
+        self.db._windows.add(77, 50, noon())
+        top = self.db.get_window_top('day')
+        self.assertEqual([uid for uid, _, _ in top], [1, 2])
+        self.assertIsNone(self.db.peek_user(77))
+        self.assertEqual(bot.get_inline_top(self.db)[1].description, "🥇 Արամ · 💎 5")
+
+
+class InlineQueryTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        chats_root(self)
+        for patcher in (patch.object(bot.config, 'CHAT_ID', -100), patch.object(bot, 'screens', bot.RenderCache(10))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        db = bot.open_chats().get(-100)
+        await db.wait_ready('activity')
+        db.track_messages({1: [1, 3, "a", "A"]}, noon())
+        self.answers = []
+
+    def query(self, text: str, error: Exception = None) -> SimpleNamespace:
+        async def answer(results, **kwargs):
+            self.answers.append(([r.id for r in results], kwargs))
+            if error is not None:
+                raise error
+
+        return SimpleNamespace(query=text, from_user=STRANGER, answer=answer)
+
+    async def test_answers(self):
+        await bot.inline_query(self.query("top"))
+        await bot.inline_query(self.query(" Me "))
+        await bot.inline_query(self.query(""))
+        tops = [f"top:{w}" for w in ('all', *bot.config.TOP_WINDOWS)]
+        self.assertEqual(self.answers, [
+            (tops, {'is_personal': False, 'cache_time': bot.config.INLINE_TOP_CACHE_TIME}),
+            (["me"], {'is_personal': True, 'cache_time': bot.config.INLINE_PROFILE_CACHE_TIME}),
+            ([*tops, "me"], {'is_personal': True, 'cache_time': bot.config.INLINE_PROFILE_CACHE_TIME})
+        ])
+        self.assertIsNone(bot.chats.get(-100).peek_user(STRANGER.id))
+
+    async def test_expired_query(self):
+        method = AnswerInlineQuery(inline_query_id="q", results=[])
+        await bot.inline_query(self.query("top", TelegramBadRequest(method, "Bad Request: query is too old")))
+        with self.assertRaises(TelegramBadRequest):
+            await bot.inline_query(self.query("top", TelegramBadRequest(method, "Bad Request: RESULT_ID_DUPLICATE")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Журнал поверх снимка: перезагрузка после сохранений и после сбоя посреди компакции"""
+import random
+import unittest
+from unittest.mock import patch
+
+from tests import bot, noon, snapshot, temp_root
+
+CHAT_ID = -100
+
+
+class JournalReplayTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.root = temp_root(self)
+        self.rnd = random.Random(5)
+
+    async def open(self) -> 'bot.FastDataManager':
+        db = bot.FastDataManager(CHAT_ID, self.root)
+        await db.load()
+        return db
+
+    def reopen(self) -> 'bot.FastDataManager':
+        fresh = bot.FastDataManager(CHAT_ID, self.root)
+        fresh._load_all()
+        return fresh
+
+    def traffic(self, db: 'bot.FastDataManager', rounds: int = 1):
+        """Сообщения, команды и входы вперемешку, часть — новых пользователей"""
+        for _ in range(rounds):
+            counts = {}
+            for _ in range(30):
+                uid = self.rnd.randrange(1, 60)
+                counts[uid] = [self.rnd.randint(1, 3), self.rnd.choice((0, 0, 1, 5)), f"u{uid}", f"Имя {uid}"]
+            db.track_messages(counts, noon())
+            db.track_command(self.rnd.randrange(1, 60), "top")
+            db.track_new_member(self.rnd.randrange(100, 120), noon())
+
+    async def test_journal_round_trip(self):
+        db = await self.open()
+        for _ in range(4):
+            self.traffic(db)
+            self.assertTrue(await db.save_all())
+
+        self.assertEqual(snapshot(self.reopen()), snapshot(db))
+        self.assertGreater(len(db._journal.segments()), 0)
+
+    async def test_crash_between_users_and_state(self):
+        """Снимок пользователей уже подменён, состояние с journal_seq — ещё нет"""
+        for fmt in ("json", "binary"):
+            with self.subTest(fmt=fmt), patch.object(bot.config, 'SNAPSHOT_FORMAT', fmt):
+                self.root = temp_root(self)
+                db = await self.open()
+                for _ in range(3):
+                    self.traffic(db)
+                    await db.save_all()
+
+                write = bot.FastDataManager._atomic_write
+
+                def crash_on_state(filename, chunks, binary=False):
+                    if filename.endswith(bot.config.STATE_FILE):
+                        raise OSError("сбой посреди компакции")
+                    return write(filename, chunks, binary)
+
+                self.traffic(db)
+                with patch.object(bot.config, 'JOURNAL_COMPACT_BYTES', 1), \
+                        patch.object(bot.FastDataManager, '_atomic_write', staticmethod(crash_on_state)):
+                    self.assertFalse(await db.save_all())
+
+                # Старый journal_seq: сегменты накатываются поверх нового снимка повторно
+                self.assertEqual(snapshot(self.reopen()), snapshot(db))
+
+                # Следующее сохранение доводит компакцию до конца
+                self.traffic(db)
+                with patch.object(bot.config, 'JOURNAL_COMPACT_BYTES', 1):
+                    self.assertTrue(await db.save_all())
+                self.assertEqual(snapshot(self.reopen()), snapshot(db))
+                db.close()
+
+    async def test_torn_tail_and_stray_tmp(self):
+        """Оборванная последняя запись и недописанный .tmp не ломают загрузку"""
+        db = await self.open()
+        self.traffic(db, 3)
+        await db.save_all()
+        expected = snapshot(db)
+
+        segment = db._journal._path(db._journal.seq)
+        with open(segment, 'a', encoding='utf-8') as f:
+            f.write('["u", 1, "обрыв')
+        (self.root / f"{bot.config.USERS_FILE}.tmp").write_text('{"1": ', encoding='utf-8')
+
+        self.assertEqual(snapshot(self.reopen()), expected)
+
+    async def test_failed_journal_write_is_retried(self):
+        db = await self.open()
+        self.traffic(db)
+        with patch.object(bot.Journal, 'append', side_effect=OSError("диск полон")):
+            self.assertFalse(await db.save_all())
+
+        self.assertTrue(await db.save_all())
+        self.assertEqual(snapshot(self.reopen()), snapshot(db))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""KeywordMatcher: пунктуация и нормализация, фразы, конфликты приоритетов, отсечение знакомых слов, перезагрузка"""
+import json
+import os
+import random
+import unittest
+from unittest.mock import patch
+
+from tests import bot, temp_root
+
+KEYWORDS = {
+    'top': {'топ', 'ամենաակտիվ'},
+    'buy': {'купить', 'ps plus', 'ps plus extra', 'psplus'},
+    'bot': {'бот', 'ps', 'plus'}
+}
+PRIORITY = {'top': 3, 'buy': 2, 'bot': 1}
+
+
+class KeywordMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = bot.KeywordMatcher(KEYWORDS, PRIORITY)
+
+    def test_punctuation_and_normalization(self):
+        for text in ("бот?", "Бот,", "(БОТ)", "эй,бот!", "ＢＯＴ — бот", "бот "):
+            with self.subTest(text=text):
+                self.assertEqual(self.matcher.best(text), 'bot')
+        for text in ("ботинок", "роботы", "", "   ", "!!!", "бо т"):
+            with self.subTest(text=text):
+                self.assertIsNone(self.matcher.best(text))
+        self.assertEqual(self.matcher.best("Ամենաակտիվ ով է?"), 'top')
+
+    def test_phrases(self):
+        self.assertEqual(self.matcher.find_all("кто знает PS Plus-ը?"),
+                         [('bot', 'ps'), ('buy', 'ps plus'), ('bot', 'plus')])
+        self.assertIn(('buy', 'ps plus extra'), self.matcher.find_all("ps plus, extra"))
+        # Фраза не собирается через слово и не выходит за конец текста
+        self.assertEqual(self.matcher.find_all("ps мне plus"), [('bot', 'ps'), ('bot', 'plus')])
+        self.assertEqual(self.matcher.find_all("купить ps"), [('buy', 'купить'), ('bot', 'ps')])
+        # Каждое вхождение — отдельное совпадение
+        self.assertEqual(len(self.matcher.find_all("бот бот бот")), 3)
+
+    def test_priority(self):
+        self.assertEqual(self.matcher.best("ps"), 'bot')
+        self.assertEqual(self.matcher.best("ps plus"), 'buy')
+        self.assertEqual(self.matcher.best("бот, где топ?"), 'top')
+
+        # Одно и то же слово в двух категориях остаётся за старшей
+        matcher = bot.KeywordMatcher({'a': {'слово', 'ps plus'}, 'b': {'Слово!', 'PS  plus'}}, {'a': 1, 'b': 5})
+        self.assertEqual(matcher.find_all("слово ps plus"), [('b', 'слово'), ('b', 'ps plus')])
+
+    def test_known_pieces_never_hide_a_match(self):
+        """Отсечение по знакомым кускам split() отвечает так же, как полный разбор"""
+        rnd = random.Random(8)
+        vocabulary = ["привет", "как", "дела", "բարև", "ok", "gg", "бот", "бот?", "топ!", "ps", "plus-ը",
+                      "Купить", "ботинок", "psplus)", "ps5", "ամենաակտիվ,", "plus"]
+
+        for size in (1_000, 3):
+            with self.subTest(size=size), patch.object(bot.config, 'KEYWORDS_CACHE_SIZE', size):
+                matcher = bot.KeywordMatcher(KEYWORDS, PRIORITY)
+                for _ in range(3_000):
+                    text = ' '.join(rnd.choice(vocabulary) for _ in range(rnd.randint(0, 6)))
+                    expected = max((key for key, _ in matcher.find_all(text)), key=PRIORITY.get, default=None)
+                    self.assertEqual(matcher.best(text), expected, text)
+                self.assertLessEqual(len(matcher._cold), size + 6)
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = temp_root(self) / "keywords.json"
+        for patcher in (patch.object(bot.config, 'KEYWORDS_FILE', str(self.path)),
+                        patch.object(bot, 'keyword_matcher', bot.keyword_matcher),
+                        patch.object(bot, '_keywords_mtime', 0.0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, data, mtime: int):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False))
+        os.utime(self.path, (mtime, mtime))
+
+    def test_reload_on_change(self):
+        self.assertFalse(bot.reload_keywords())
+
+        self.write({'bot': ['робот'], 'sale': {'priority': 9, 'words': ['скидка', 'бот']}}, 1000)
+        self.assertTrue(bot.reload_keywords())
+        self.assertEqual(bot.keyword_matcher.best("робот"), 'bot')
+        self.assertEqual(bot.keyword_matcher.best("бот, скидка?"), 'sale')
+        self.assertEqual(bot.keyword_matcher.priority['bot'], bot.KEYWORD_PRIORITY['bot'])
+
+        # Файл не менялся — матчер тот же
+        matcher = bot.keyword_matcher
+        self.assertFalse(bot.reload_keywords())
+        self.assertIs(bot.keyword_matcher, matcher)
+
+    def test_broken_file_keeps_previous_set(self):
+        self.write({'bot': ['робот']}, 1000)
+        bot.reload_keywords()
+        matcher = bot.keyword_matcher
+
+        self.write("{не json", 2000)
+        self.assertTrue(bot.reload_keywords())
+        self.assertIs(bot.keyword_matcher, matcher)
+        # Повтор с тем же mtime ошибку не логирует заново
+        self.assertFalse(bot.reload_keywords())
+
+
+if __name__ == "__main__":
+    unittest.main()
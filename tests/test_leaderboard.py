@@ -0,0 +1,88 @@
+"""LeaderboardIndex (бакеты + дерево Фенвика) против пересчёта сортировкой"""
+import random
+import unittest
+
+from tests import bot
+
+
+class LeaderboardIndexTest(unittest.TestCase):
+
+    def assert_consistent(self, index: 'bot.LeaderboardIndex', reference: dict):
+        self.assertEqual(len(index), len(reference))
+        for uid, points in reference.items():
+            above = sum(1 for other in reference.values() if other > points)
+            self.assertEqual(index.rank(uid), above + 1)
+            self.assertEqual(index.points(uid), points)
+            self.assertEqual(index.count_above(points), above)
+
+        top = index.top(len(reference) + 5)
+        self.assertEqual(sorted(top), sorted(reference))
+        self.assertEqual([reference[uid] for uid in top], sorted(reference.values(), reverse=True))
+
+    def test_random_operations(self):
+        """update, add (в том числе с уходом в ноль), remove и рост дерева за 1024 очка"""
+        rnd = random.Random(11)
+        index, reference = bot.LeaderboardIndex(), {}
+
+        for step in range(20_000):
+            uid = rnd.randrange(200)
+            op = rnd.random()
+            if op < 0.05:
+                index.remove(uid)
+                reference.pop(uid, None)
+            elif op < 0.15:
+                points = rnd.choice((0, rnd.randrange(50), rnd.randrange(5000)))
+                index.update(uid, points)
+                reference[uid] = points
+            else:
+                delta = rnd.choice((1, 1, 1, 2, 5, -1, -3, 40))
+                index.add(uid, delta)
+                points = reference.get(uid, 0) + delta
+                if points > 0:
+                    reference[uid] = points
+                else:
+                    reference.pop(uid, None)
+
+            if step % 1000 == 0:
+                self.assert_consistent(index, reference)
+        self.assert_consistent(index, reference)
+
+    def test_moves_walk_both_paths(self):
+        """Перенос между значениями: вверх и вниз, соседние и дальние, у края дерева и с его ростом"""
+        index, reference = bot.LeaderboardIndex(), {}
+        for uid in range(8):
+            index.update(uid, uid * 3)
+            reference[uid] = uid * 3
+
+        for uid, points in ((0, 1), (1, 2), (7, 20), (2, 1022), (2, 1023), (3, 1023), (3, 1024),
+                            (4, 5000), (4, 4999), (5, 0), (6, 1023), (2, 1)):
+            index.update(uid, points)
+            reference[uid] = points
+            self.assert_consistent(index, reference)
+
+        # Дерево после переносов совпадает с построенным заново
+        fresh = bot.LeaderboardIndex()
+        for uid, points in reference.items():
+            fresh.update(uid, points)
+        self.assertEqual(index._tree, fresh._tree)
+
+    def test_ties_share_rank(self):
+        index = bot.LeaderboardIndex()
+        for uid, points in ((1, 10), (2, 10), (3, 7), (4, 10), (5, 0)):
+            index.update(uid, points)
+
+        self.assertEqual([index.rank(uid) for uid in range(1, 6)], [1, 1, 4, 1, 5])
+        self.assertEqual(index.top(3), [1, 2, 4])
+        self.assertEqual(list(index.at_least(7)), [1, 2, 4, 3])
+        self.assertIsNone(index.rank(99))
+        self.assertEqual(index.top(0), [])
+
+    def test_negative_points_clamp_to_zero(self):
+        index = bot.LeaderboardIndex()
+        index.update(1, -5)
+        self.assertEqual(index.points(1), 0)
+        self.assertEqual(index.rank(1), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
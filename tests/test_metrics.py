@@ -0,0 +1,144 @@
+"""Метрики: гистограммы, текст Prometheus, middleware обработчиков, замеры сохранений и сервер /metrics"""
+import asyncio
+import re
+import socket
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiohttp import ClientSession
+
+from tests import bot, noon, temp_root
+
+SAMPLE = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? -?[0-9.e+-]+$')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def samples(text: str) -> dict:
+    """{строка без значения: значение} по всем строкам, кроме комментариев"""
+    result = {}
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_buckets_are_cumulative(self):
+        histogram = bot.Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 1.0, 7.0):
+            histogram.observe(value)
+
+        lines = list(histogram.expose('lat', 'handler="top"'))
+        self.assertEqual(lines, [
+            'lat_bucket{handler="top",le="0.1"} 2',
+            'lat_bucket{handler="top",le="1.0"} 4',
+            'lat_bucket{handler="top",le="+Inf"} 5',
+            'lat_sum{handler="top"} 8.65',
+            'lat_count{handler="top"} 5'
+        ])
+        self.assertEqual(list(bot.Histogram((1,)).expose('x'))[-2:], ['x_sum 0.0', 'x_count 0'])
+
+
+class MetricsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.metrics = bot.Metrics()
+        patcher = patch.object(bot, 'metrics', self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_exposition_format(self):
+        self.metrics.updates['message'] = 3
+        self.metrics.observe_handler('cmd_top', 0.002)
+        self.metrics.observe_save('journal', 0.01, 0.001, 512)
+        self.metrics.loop_lag.observe(0.03)
+        text = self.metrics.expose()
+
+        declared = set()
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                declared.add(line.split()[2])
+            elif not line.startswith('# HELP '):
+                self.assertRegex(line, SAMPLE)
+                self.assertIn(re.sub(r'_(bucket|sum|count)$', '', line.split('{')[0].split(' ')[0]), declared)
+
+        values = samples(text)
+        self.assertEqual(values['haybot_updates_total{type="message"}'], 3)
+        self.assertEqual(values['haybot_handler_seconds_count{handler="cmd_top"}'], 1)
+        self.assertEqual(values['haybot_handler_seconds_bucket{handler="cmd_top",le="0.0025"}'], 1)
+        self.assertEqual(values['haybot_save_bytes_total'], 512)
+        self.assertEqual(values['haybot_loop_lag_seconds_count'], 1)
+
+    async def test_handler_middleware(self):
+        async def cmd_stats(event, data):
+            raise RuntimeError("сбой")
+
+        middleware = bot.HandlerMetricsMiddleware()
+        data = {'handler': SimpleNamespace(callback=cmd_stats)}
+        with self.assertRaises(RuntimeError):
+            await middleware(cmd_stats, None, data)
+        # Упавший обработчик тоже замерен
+        self.assertEqual(sum(self.metrics.handlers['cmd_stats'].counts), 1)
+
+    async def test_saves_are_recorded(self):
+        db = bot.FastDataManager(-100, temp_root(self))
+        await db.load()
+        db.track_messages({1: [1, 1, "", ""]}, noon())
+        self.assertTrue(await db.save_all())
+        db._snapshot_due = True
+        db.track_messages({2: [1, 1, "", ""]}, noon())
+        self.assertTrue(await db.save_all())
+
+        self.assertEqual(set(self.metrics.saves), {'journal', 'snapshot'})
+        self.assertEqual(self.metrics.save_bytes, db.save_stats['bytes_total'])
+        self.assertGreater(self.metrics.save_bytes, 0)
+
+
+class ServeMetricsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_serves_text_format(self):
+        port = free_port()
+        with patch.object(bot.config, 'METRICS_HOST', "127.0.0.1"), patch.object(bot.config, 'METRICS_PORT', port):
+            runner = await bot.serve_metrics()
+        self.assertIsNotNone(runner)
+        self.addAsyncCleanup(runner.cleanup)
+
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                self.assertEqual(response.status, 200)
+                self.assertTrue(response.headers['Content-Type'].startswith("text/plain; version=0.0.4"))
+                self.assertIn("# TYPE haybot_loop_lag_seconds histogram", await response.text())
+
+    async def test_busy_port_returns_none(self):
+        with socket.socket() as busy:
+            busy.bind(("127.0.0.1", 0))
+            busy.listen()
+            port = busy.getsockname()[1]
+            with patch.object(bot.config, 'METRICS_HOST', "127.0.0.1"), \
+                    patch.object(bot.config, 'METRICS_PORT', port):
+                self.assertIsNone(await bot.serve_metrics())
+
+    async def test_loop_lag_sampler(self):
+        with patch.object(bot, 'metrics', bot.Metrics()), patch.object(bot.config, 'LOOP_LAG_INTERVAL', 0.01):
+            task = asyncio.create_task(bot.sample_loop_lag())
+            await asyncio.sleep(0.03)
+            # Занятый цикл — опоздание видно в последнем замере
+            started = asyncio.get_running_loop().time()
+            while asyncio.get_running_loop().time() - started < 0.05:
+                pass
+            await asyncio.sleep(0.02)
+            task.cancel()
+            self.assertGreater(sum(bot.metrics.loop_lag.counts), 1)
+            self.assertGreater(max(bot.metrics.loop_lag_last, bot.metrics.loop_lag.sum), 0.03)
+
+
+if __name__ == "__main__":
+    unittest.main()
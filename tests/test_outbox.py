@@ -0,0 +1,179 @@
+"""Outbox: лимиты на чат и на бота, полосы приоритета, повтор после RetryAfter и склейка приветствий"""
+import asyncio
+import unittest
+from datetime import datetime
+from time import monotonic
+from unittest.mock import patch
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, User
+
+from tests import bot
+
+
+class FakeBot:
+    """Вместо Bot API: запоминает (время, chat_id, текст) и может ответить RetryAfter"""
+
+    def __init__(self):
+        self.calls = []
+        self.retry = {}
+
+    async def __call__(self, method):
+        await asyncio.sleep(0)
+        pause = self.retry.get(method.text)
+        if pause:
+            self.retry[method.text] = None
+            error = TelegramRetryAfter(method, "Too Many Requests", 1)
+            error.retry_after = pause
+            raise error
+        self.calls.append((monotonic(), method.chat_id, method.text))
+        return method.text
+
+
+def message(chat_id: int, text: str) -> SendMessage:
+    return SendMessage(chat_id=chat_id, text=text)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.api = FakeBot()
+        for patcher in (patch.object(bot, 'bot', self.api),
+                        patch.object(bot.config, 'OUTBOX_GLOBAL_LIMIT', (1000.0, 1000)),
+                        patch.object(bot.config, 'OUTBOX_GROUP_LIMIT', (20.0, 2))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def outbox(self) -> 'bot.Outbox':
+        outbox = bot.Outbox()
+        self.addAsyncCleanup(self.stop, outbox)
+        return outbox
+
+    @staticmethod
+    async def stop(outbox: 'bot.Outbox'):
+        if outbox._worker is not None:
+            outbox._worker.cancel()
+            await asyncio.gather(outbox._worker, return_exceptions=True)
+
+    async def test_per_chat_bucket(self):
+        outbox = self.outbox()
+        results = await asyncio.gather(*(outbox.send(message(-1, str(i))) for i in range(4)),
+                                       outbox.send(message(-2, "other")))
+        self.assertEqual(results, ["0", "1", "2", "3", "other"])
+
+        times = {text: at for at, _, text in self.api.calls}
+        # Запас 2 уходит сразу, дальше — по токену в 1/20 с; другой чат не ждёт
+        self.assertLess(times["1"] - times["0"], 0.03)
+        self.assertGreaterEqual(times["3"] - times["0"], 0.08)
+        self.assertLess(times["other"] - times["0"], 0.03)
+        # Порядок внутри чата сохраняется
+        self.assertEqual([text for _, chat_id, text in self.api.calls if chat_id == -1], ["0", "1", "2", "3"])
+
+    async def test_global_bucket(self):
+        with patch.object(bot.config, 'OUTBOX_GLOBAL_LIMIT', (20.0, 3)):
+            outbox = self.outbox()
+            await asyncio.gather(*(outbox.send(message(-i, str(i))) for i in range(1, 6)))
+        times = [at for at, _, _ in self.api.calls]
+        self.assertLess(times[2] - times[0], 0.03)
+        self.assertGreaterEqual(times[4] - times[0], 0.08)
+        self.assertEqual(outbox.stats['sent'], 5)
+
+    async def test_priority_lanes(self):
+        with patch.object(bot.config, 'OUTBOX_CONCURRENCY', 1):
+            outbox = self.outbox()
+        outbox.post(message(-1, "scheduled"), bot.Outbox.SCHEDULED)
+        outbox.post(message(-2, "welcome"), bot.Outbox.NOTICE)
+        reply = outbox.send(message(-3, "reply"))
+
+        self.assertEqual(await reply, "reply")
+        await outbox.drain(1)
+        self.assertEqual([text for _, _, text in self.api.calls], ["reply", "welcome", "scheduled"])
+        self.assertEqual(outbox.depth, 0)
+
+    async def test_retry_after_holds_only_that_chat(self):
+        outbox = self.outbox()
+        self.api.retry["flood"] = 0.1
+        started = monotonic()
+        results = await asyncio.gather(outbox.send(message(-1, "flood")), outbox.send(message(-1, "next")),
+                                       outbox.send(message(-2, "other")))
+
+        self.assertEqual(results, ["flood", "next", "other"])
+        times = {text: at - started for at, _, text in self.api.calls}
+        self.assertGreaterEqual(times["flood"], 0.1)
+        # Повтор встаёт в начало полосы — раньше следующего вызова того же чата
+        self.assertLess(times["flood"], times["next"])
+        self.assertLess(times["other"], 0.05)
+        self.assertEqual(outbox.retries, 1)
+
+    async def test_retry_after_gives_up(self):
+        outbox = self.outbox()
+
+        class Always(dict):
+            def get(self, key, default=None):
+                return 0.01
+
+        self.api.retry = Always()
+        with self.assertRaises(TelegramRetryAfter):
+            await outbox.send(message(-1, "flood"))
+        self.assertEqual(outbox.retries, bot.config.OUTBOX_MAX_RETRIES + 1)
+        self.assertEqual(outbox.failed, 1)
+
+    async def test_overflow(self):
+        with patch.object(bot.config, 'OUTBOX_MAX_DEPTH', 2):
+            outbox = self.outbox()
+            outbox.post(message(-1, "1"))
+            outbox.post(message(-1, "2"))
+            with self.assertRaises(asyncio.QueueFull):
+                outbox.post(message(-1, "3"))
+
+
+class WelcomeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.api = FakeBot()
+        self.outbox = bot.Outbox()
+        for patcher in (patch.object(bot, 'bot', self.api), patch.object(bot, 'outbox', self.outbox),
+                        patch.object(bot.config, 'WELCOME_COALESCE_WINDOW', 0.05),
+                        patch.object(bot.config, 'WELCOME_MAX_NAMES', 3)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addAsyncCleanup(OutboxTest.stop, self.outbox)
+
+    async def join(self, db, chat_id: int, *names: str):
+        users = [User(id=ord(name[0]), is_bot=False, first_name=name) for name in names]
+        m = Message(message_id=1, date=datetime.now(), chat=Chat(id=chat_id, type='supergroup'),
+                    new_chat_members=users)
+        await bot.on_new_members(m, db)
+
+    async def test_burst_of_joins_is_one_welcome(self):
+        db = bot.FastDataManager(-100)
+        await self.join(db, -100, "Արամ")
+        await self.join(db, -100, "Анна", "Bob")
+        await self.join(bot.FastDataManager(-200), -200, "Other")
+        self.assertFalse(self.api.calls)
+
+        await asyncio.sleep(0.1)
+        await self.outbox.drain(1)
+        texts = {chat_id: text for _, chat_id, text in self.api.calls}
+        self.assertEqual(len(self.api.calls), 2)
+        self.assertIn("Արամ, Анна, Bob", texts[-100])
+        self.assertIn("Other", texts[-200])
+        self.assertEqual(db.state['new_members'], 3)
+
+    async def test_name_limit_flushes_early(self):
+        db = bot.FastDataManager(-100)
+        await self.join(db, -100, "a", "b", "c", "d")
+        # Три имени ушли в очередь сразу, четвёртое ждёт своего окна
+        self.assertEqual(self.outbox.depth, 1)
+        self.assertIn("a, b, c!", self.outbox._lanes[bot.Outbox.NOTICE][0].method.text)
+        self.assertEqual(self.outbox._pending[('welcome', -100)][0], ["d"])
+
+        # Остановка отправляет и недокопленное
+        await self.outbox.drain(1)
+        self.assertEqual(len(self.api.calls), 2)
+        self.assertIn("d!", self.api.calls[1][2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""PointsRules: виды сообщений, каждые N, пауза, потолок за окно, веса команд и LRU состояний"""
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from aiogram.types import Chat, ForumTopicCreated, Message, PhotoSize, User
+
+from tests import bot
+
+CHAT = Chat(id=-100, type='supergroup')
+AUTHOR = User(id=1, is_bot=False, first_name="A")
+
+
+def message(**fields) -> Message:
+    return Message(message_id=1, date=datetime.now(), chat=CHAT, from_user=AUTHOR, **fields)
+
+
+class PointsRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = bot.FastDataManager(-100)
+
+    def award(self, rules: 'bot.PointsRules', kind: str, times: list, uid: int = 1) -> list:
+        return [rules.message(self.db, uid, kind, now) for now in times]
+
+    def test_default_every_ten_seeded_from_messages(self):
+        rules = bot.PointsRules({})
+        self.db.users[1] = bot.UserRecord(messages=7)
+        points = self.award(rules, 'text', [0] * 13)
+        # 7 уже было: начисление на 10-м и на 20-м сообщении
+        self.assertEqual([i for i, p in enumerate(points) if p], [2, 12])
+        self.assertEqual(points[2], bot.config.POINTS_PER_10_MESSAGES)
+        self.assertEqual(rules.remaining(self.db, 1, 20), 10)
+        self.assertEqual(rules.remaining(self.db, 2, 24), 6)
+
+    def test_every_one_needs_no_state(self):
+        rules = bot.PointsRules({'messages': {'text': {'points': 2, 'every': 1}}})
+        self.assertEqual(self.award(rules, 'text', [0, 0, 0]), [2, 2, 2])
+        self.assertEqual(rules.width, 0)
+        self.assertEqual(self.award(rules, 'media', [0]), [0])
+
+    def test_cooldown(self):
+        rules = bot.PointsRules({'messages': {'text': {'points': 1, 'every': 1}},
+                                 'limits': {'message': {'cooldown': 10}}})
+        self.assertEqual(self.award(rules, 'text', [100, 105, 109, 110, 125]), [1, 0, 0, 1, 1])
+
+    def test_cap_per_window(self):
+        rules = bot.PointsRules({'messages': {'text': {'points': 3, 'every': 1}},
+                                 'limits': {'message': {'cap': 7, 'window': 100}}})
+        # 3 + 3 + 1 (упёрлись в потолок), в следующем окне — заново
+        self.assertEqual(self.award(rules, 'text', [0, 10, 20, 30, 99, 100, 150]), [3, 3, 1, 0, 0, 3, 3])
+
+    def test_commands(self):
+        rules = bot.PointsRules({'commands': {'default': 2, '/Start': 0, 'top': 5},
+                                 'limits': {'command': {'cooldown': 60}}})
+        now = 1_700_000_000
+        self.assertEqual(rules.command(self.db, 1, 'start', now), 0)
+        self.assertEqual(rules.command(self.db, 1, 'top', now), 5)
+        # Нулевой вес паузу не трогает, ненулевой — ждёт её конца
+        self.assertEqual(rules.command(self.db, 1, 'start', now + 1), 0)
+        self.assertEqual(rules.command(self.db, 1, 'stats', now + 30), 0)
+        self.assertEqual(rules.command(self.db, 1, 'stats', now + 60), 2)
+
+    def test_kinds(self):
+        rules = bot.PointsRules({'messages': {'text': {}, 'media': {}, 'reply': {}}})
+        original = message(text="вопрос")
+        photo = [PhotoSize(file_id="x", file_unique_id="x", width=1, height=1)]
+        topic = message(forum_topic_created=ForumTopicCreated(name="t", icon_color=0))
+
+        self.assertEqual(rules.kind(message(text="привет")), 'text')
+        self.assertIsNone(rules.kind(message(text="/top")))
+        self.assertEqual(rules.kind(message(text="да", reply_to_message=original)), 'reply')
+        self.assertEqual(rules.kind(message(text="в теме", reply_to_message=topic)), 'text')
+        self.assertEqual(rules.kind(message(photo=photo)), 'media')
+        self.assertIsNone(bot.PointsRules({}).kind(message(photo=photo)))
+
+    def test_invalid(self):
+        for data in ({'messages': {'voice': {}}}, {'messages': {'text': {'every': 0}}},
+                     {'messages': {'text': {'points': -1}}}, {'commands': {'top': 1.5}},
+                     {'limits': {'message': {'cap': 5, 'window': 0}}}):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                bot.PointsRules(data)
+
+    def test_states_are_bounded_and_reseeded(self):
+        rules = bot.PointsRules({})
+        with patch.object(bot.config, 'POINTS_STATE_MAX_KEYS', 3):
+            for uid in range(1, 6):
+                self.db.users[uid] = bot.UserRecord(messages=5)
+                rules.message(self.db, uid, 'text', 0)
+            self.assertEqual(list(rules._states[-100]), [3, 4, 5])
+
+            # Вытесненный начинает с остатка от числа сообщений
+            self.db.users[1].messages = 8
+            self.assertEqual(self.award(rules, 'text', [0, 0]), [0, bot.config.POINTS_PER_10_MESSAGES])
+
+        rules.forget(-100)
+        self.assertNotIn(-100, rules._states)
+
+    def test_summary(self):
+        rules = bot.PointsRules({'messages': {'text': {'points': 1, 'every': 10}, 'media': {'points': 0}},
+                                 'commands': {'default': 3}})
+        self.assertEqual(rules.summary(), "├ 10 հաղորդագրություն = 1 միավոր\n└ 1 հրաման = 3 միավոր")
+
+
+if __name__ == "__main__":
+    unittest.main()
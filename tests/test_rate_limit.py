@@ -0,0 +1,120 @@
+"""Антифлуд: пополнение token bucket, вытеснение простаивающих ключей и отбрасывание апдейтов до обработчика"""
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+from tests import bot
+
+GROUP = Chat(id=-100, type='supergroup')
+
+
+def message(uid: int, text: str = "привет", chat: Chat = GROUP, **fields) -> Message:
+    return Message(message_id=1, date=datetime.now(), chat=chat,
+                   from_user=User(id=uid, is_bot=False, first_name="A"), text=text, **fields)
+
+
+def callback(uid: int) -> CallbackQuery:
+    return CallbackQuery(id="1", from_user=User(id=uid, is_bot=False, first_name="A"),
+                         chat_instance="1", message=message(uid), data="top")
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_burst_then_refill(self):
+        limiter = bot.RateLimiter(rate=2, capacity=3)
+        self.assertEqual([limiter.allow('a', 0) for _ in range(4)], [True, True, True, False])
+        self.assertAlmostEqual(limiter.retry_after('a', 0), 0.5)
+        self.assertEqual(limiter.retry_after('b', 0), 0)
+
+        # Половина токена за 0.25 с — ещё рано; отказ не тратит токены
+        self.assertFalse(limiter.allow('a', 0.25))
+        self.assertTrue(limiter.allow('a', 0.5))
+        self.assertFalse(limiter.allow('a', 0.5))
+        # Долгий простой наполняет бакет только до capacity
+        self.assertEqual([limiter.allow('a', 100) for _ in range(4)], [True, True, True, False])
+
+    def test_keys_are_independent(self):
+        limiter = bot.RateLimiter(rate=1, capacity=1)
+        self.assertTrue(limiter.allow(1, 0))
+        self.assertFalse(limiter.allow(1, 0))
+        self.assertTrue(limiter.allow(2, 0))
+
+    def test_idle_keys_are_evicted(self):
+        """Бакет, простоявший capacity / rate секунд, полон — такой ключ удаляется"""
+        limiter = bot.RateLimiter(rate=1, capacity=5)
+        for key in range(10):
+            limiter.allow(key, key * 0.1)
+        self.assertEqual(len(limiter), 10)
+
+        # Каждый новый ключ убирает до двух простаивающих с начала LRU
+        for i, key in enumerate(range(100, 106)):
+            limiter.allow(key, 10 + i * 0.01)
+        self.assertEqual(len(limiter), 6)
+
+        # Недавно тронутый ключ переезжает в конец и не вытесняется
+        limiter.allow(100, 12)
+        limiter.allow(200, 15.5)
+        self.assertIn(100, limiter._buckets)
+
+    def test_max_keys(self):
+        limiter = bot.RateLimiter(rate=1, capacity=100, max_keys=50)
+        for key in range(500):
+            self.assertTrue(limiter.allow(key, 0))
+        self.assertEqual(len(limiter), 50)
+        self.assertEqual(list(limiter._buckets)[0], 450)
+
+
+class RateLimitMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.now = 1000.0
+        patcher = patch.object(bot, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = bot.RateLimitMiddleware()
+        self.handled = []
+
+    async def handler(self, event, data):
+        self.handled.append(event)
+        return "ok"
+
+    async def send(self, event) -> bool:
+        return await self.middleware(self.handler, event, {}) == "ok"
+
+    async def test_throttled_update_never_reaches_handler(self):
+        burst = bot.config.RATE_LIMITS_USER['message'][1]
+        results = [await self.send(message(1)) for _ in range(burst + 2)]
+        self.assertEqual(results, [True] * burst + [False, False])
+        self.assertEqual(len(self.handled), burst)
+        self.assertEqual(self.middleware.rejected['message'], 2)
+
+        # Другой пользователь и другой класс обработчиков — свои бакеты
+        self.assertTrue(await self.send(message(2)))
+        self.assertTrue(await self.send(message(1, "/top")))
+        self.assertTrue(await self.send(callback(1)))
+
+        self.now += 1
+        self.assertTrue(await self.send(message(1)))
+
+    async def test_chat_limit(self):
+        rate, burst = bot.config.RATE_LIMITS_CHAT['command']
+        results = [await self.send(message(uid, "/top")) for uid in range(burst + 1)]
+        self.assertEqual(results, [True] * burst + [False])
+        # В другом чате и в личке лимит чата свой
+        self.assertTrue(await self.send(message(500, "/top", Chat(id=-200, type='group'))))
+        self.assertTrue(await self.send(message(501, "/top", Chat(id=501, type='private'))))
+
+    async def test_service_messages_are_not_limited(self):
+        burst = bot.config.RATE_LIMITS_USER['message'][1]
+        joined = [User(id=9, is_bot=False, first_name="B")]
+        for _ in range(burst):
+            await self.send(message(1))
+        self.assertTrue(await self.send(message(1, None, new_chat_members=joined)))
+        self.assertIsNone(bot.RateLimitMiddleware.classify(message(1, None, new_chat_members=joined)))
+        self.assertEqual(bot.RateLimitMiddleware.classify(callback(1)), 'callback')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""RenderCache: тексты по версии данных, LRU, сброс по чату и пропуск правок тем же текстом"""
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText
+
+from tests import bot, noon
+
+
+class RenderCacheTest(unittest.TestCase):
+
+    def test_render_by_version(self):
+        cache = bot.RenderCache(10)
+        builds = []
+
+        def build(text):
+            return lambda: builds.append(text) or text
+
+        self.assertEqual(cache.render(('top', 1), 1, build("a")), "a")
+        self.assertEqual(cache.render(('top', 1), 1, build("b")), "a")
+        self.assertEqual(cache.render(('top', 1), 2, build("c")), "c")
+        self.assertEqual(cache.render(('top', 2), 2, build("d")), "d")
+        self.assertEqual(builds, ["a", "c", "d"])
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 3, 'edits': 0, 'edits_skipped': 0})
+
+    def test_lru_forget_and_clear(self):
+        cache = bot.RenderCache(3)
+        for chat_id in (1, 2, 3):
+            cache.render(('top', chat_id), 0, lambda: "x")
+        cache.render(('top', 1), 0, lambda: "x")
+        cache.render(('stats', 4), 0, lambda: "x")
+        self.assertEqual(list(cache._texts), [('top', 3), ('top', 1), ('stats', 4)])
+
+        cache.render(('profile', 1, 77), 0, lambda: "x")
+        cache.forget(1)
+        self.assertEqual(list(cache._texts), [('stats', 4)])
+        cache.clear()
+        self.assertFalse(cache._texts)
+
+    def test_top_follows_data_version(self):
+        db = bot.FastDataManager(-100)
+        db._mark_ready(*db.READY_PARTS)
+        db.track_messages({1: [10, 5, "a", "A"]}, noon())
+
+        with patch.object(bot, 'screens', bot.RenderCache(10)):
+            text = bot.get_top_text(db)
+            self.assertIs(bot.get_top_text(db), text)
+            self.assertEqual(bot.screens.hits, 1)
+
+            db.track_messages({2: [1, 9, "b", "B"]}, noon())
+            changed = bot.get_top_text(db)
+            self.assertNotEqual(changed, text)
+            self.assertIn("@b", changed)
+            self.assertEqual(bot.screens.misses, 2)
+
+
+class Outbox:
+    def __init__(self, error: Exception = None):
+        self.sent = []
+        self.error = error
+
+    async def send(self, method):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(method)
+
+
+class ShowTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.outbox = Outbox()
+        for patcher in (patch.object(bot, 'screens', bot.RenderCache(10)), patch.object(bot, 'outbox', self.outbox)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def callback(self, message_id: int = 5) -> SimpleNamespace:
+        answered = []
+
+        async def answer(*args, **kwargs):
+            answered.append(args)
+
+        message = SimpleNamespace(
+            chat=SimpleNamespace(id=-100), message_id=message_id,
+            edit_text=lambda text, reply_markup=None: EditMessageText(text=text, chat_id=-100, message_id=message_id)
+        )
+        return SimpleNamespace(message=message, answer=answer, answered=answered)
+
+    async def test_same_content_is_not_edited(self):
+        c = self.callback()
+        await bot.show(c, "топ", 'refresh_top')
+        await bot.show(c, "топ", 'refresh_top')
+        self.assertEqual(len(self.outbox.sent), 1)
+        self.assertEqual(len(c.answered), 1)
+
+        # Другой текст, другая клавиатура или другое сообщение — правка уходит
+        await bot.show(c, "топ 2", 'refresh_top')
+        await bot.show(c, "топ 2", 'back')
+        await bot.show(self.callback(6), "топ 2", 'back')
+        self.assertEqual(len(self.outbox.sent), 4)
+        self.assertEqual(bot.screens.stats['edits'], 4)
+        self.assertEqual(bot.screens.stats['edits_skipped'], 1)
+
+    async def test_not_modified_from_telegram(self):
+        """После рестарта память пуста — ответ «not modified» запоминается как показанный текст"""
+        c = self.callback()
+        method = EditMessageText(text="x", chat_id=-100, message_id=5)
+        self.outbox.error = TelegramBadRequest(method, "Bad Request: message is not modified")
+        await bot.show(c, "топ", 'refresh_top')
+        self.assertEqual(len(c.answered), 1)
+        self.assertTrue(bot.screens.is_shown((-100, 5), ("топ", 'refresh_top')))
+
+        self.outbox.error = TelegramBadRequest(method, "Bad Request: message to edit not found")
+        with self.assertRaises(TelegramBadRequest):
+            await bot.show(c, "другой", 'refresh_top')
+        self.assertFalse(bot.screens.is_shown((-100, 5), ("другой", 'refresh_top')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Реплики над одной папкой: вклады сливаются в одно и то же состояние в любом порядке"""
+import random
+import unittest
+from unittest.mock import patch
+
+from tests import bot, temp_root
+
+CHAT_ID = -100
+
+
+def view(db: 'bot.FastDataManager') -> dict:
+    """Объединённый вид раздела — у всех реплик после слияния он одинаков"""
+    return {
+        'users': {uid: bot.user_row(user)[2:5] for uid, user in db.users.items()},
+        'total_messages': db.state['total_messages'],
+        'new_members': db.state['new_members'],
+        'windows': {name: dict((uid, points) for uid, _, points in db.get_window_top(name, 1000))
+                    for name in bot.config.TOP_WINDOWS},
+        'ranks': {uid: db.get_user_rank(uid) for uid in db.users}
+    }
+
+
+class ReplicaMergeTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.root = temp_root(self)
+        self.rnd = random.Random(23)
+        # uid → [сообщения, команды] по всем репликам
+        self.expected = {}
+
+    async def open(self, replica_id: str) -> 'bot.FastDataManager':
+        with patch.object(bot.config, 'REPLICA_ID', replica_id):
+            db = bot.FastDataManager(CHAT_ID, self.root)
+        await db.load()
+        return db
+
+    def traffic(self, db: 'bot.FastDataManager'):
+        for _ in range(40):
+            uid = self.rnd.randrange(1, 80)
+            counts = self.expected.setdefault(uid, [0, 0])
+            if self.rnd.random() < 0.85:
+                db.track_messages({uid: [1, self.rnd.choice((0, 0, 1, 3)), f"u{uid}", f"U{uid}"]}, int(bot.time()))
+                counts[0] += 1
+            else:
+                db.track_command(uid, "top")
+                counts[1] += 1
+        if self.rnd.random() < 0.3:
+            db.track_new_member(self.rnd.randrange(1000, 1100))
+
+    async def converge(self, replicas: list):
+        for db in replicas:
+            self.assertTrue(await db.save_all())
+        for db in replicas:
+            await db.merge_replicas()
+
+    def assert_converged(self, replicas: list):
+        views = [view(db) for db in replicas]
+        for other in views[1:]:
+            self.assertEqual(other, views[0])
+
+        users = views[0]['users']
+        self.assertEqual({uid: [messages, commands] for uid, (_, messages, commands) in users.items()},
+                         {uid: counts for uid, counts in self.expected.items()})
+        self.assertEqual(views[0]['total_messages'], sum(counts[0] for counts in self.expected.values()))
+
+    async def test_interleaved_saves_and_merges(self):
+        replicas = [await self.open(name) for name in ("a", "b", "c")]
+
+        for _ in range(15):
+            for db in self.rnd.sample(replicas, len(replicas)):
+                self.traffic(db)
+                if self.rnd.random() < 0.7:
+                    await db.save_all()
+                if self.rnd.random() < 0.5:
+                    await db.merge_replicas()
+
+        await self.converge(replicas)
+        self.assert_converged(replicas)
+
+        # Повторное слияние без новых строк ничего не прибавляет
+        before = view(replicas[0])
+        await replicas[0].merge_replicas()
+        self.assertEqual(view(replicas[0]), before)
+
+    async def test_compaction_and_restart(self):
+        """Свёртка журнала вклада в новое поколение и рестарт реплики посреди работы"""
+        replicas = [await self.open(name) for name in ("a", "b")]
+
+        with patch.object(bot.config, 'REPLICA_COMPACT_BYTES', 2048):
+            for step in range(12):
+                for db in replicas:
+                    self.traffic(db)
+                await self.converge(replicas)
+                if step == 6:
+                    replicas[1] = await self.open("b")
+
+        self.assertGreater(replicas[0].replica.generation, 0)
+        await self.converge(replicas)
+        self.assert_converged(replicas)
+
+        # Новая реплика видит всё, что записали остальные
+        late = await self.open("c")
+        self.assertEqual(view(late), view(replicas[0]))
+
+    async def test_failed_save_is_rewritten_whole(self):
+        replicas = [await self.open(name) for name in ("a", "b")]
+        self.traffic(replicas[0])
+        with patch.object(bot.ReplicaLog, 'append', side_effect=OSError("диск полон")):
+            self.assertFalse(await replicas[0].save_all())
+        self.assertTrue(replicas[0].replica.compact_due)
+
+        self.traffic(replicas[1])
+        await self.converge(replicas)
+        self.assert_converged(replicas)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""MemberRoster: вход, выход и повторный вход, бывшие до бота через base, отток и удержание"""
+import unittest
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import GetChatMemberCount
+
+from tests import bot, noon, temp_root
+
+MONDAY = date(2024, 5, 6).toordinal()
+
+
+class MemberRosterTest(unittest.TestCase):
+
+    def test_join_leave_rejoin(self):
+        roster = bot.MemberRoster()
+        self.assertTrue(roster.join(1, MONDAY))
+        # Служебное сообщение и chat_member об одном входе — одно событие
+        self.assertFalse(roster.join(1, MONDAY))
+        self.assertTrue(roster.join(2, MONDAY + 1))
+        self.assertTrue(roster.leave(1, MONDAY + 2))
+        self.assertFalse(roster.leave(1, MONDAY + 2))
+        self.assertTrue(roster.join(1, MONDAY + 8))
+
+        self.assertEqual(roster.rows(), [(1, MONDAY + 8), (2, MONDAY + 1)])
+        self.assertEqual(roster._present, 2)
+        self.assertEqual(roster.flow(3, MONDAY + 2), (2, 1))
+        self.assertEqual(roster.flow(30, MONDAY + 8), (3, 1))
+        # Вошедшие на первой неделе: двое, остался один; повторный вход — уже вторая неделя
+        self.assertEqual(roster._cohorts, {MONDAY: [2, 1], MONDAY + 7: [1, 1]})
+        self.assertEqual(roster.retention(14, MONDAY + 8), 2 / 3)
+        self.assertEqual(roster.changed, {1, 2})
+
+    def test_members_before_bot(self):
+        roster = bot.MemberRoster()
+        self.assertIsNone(roster.count)
+        self.assertTrue(roster.leave(9, MONDAY))
+        self.assertIsNone(roster.base)
+
+        roster.join(1, MONDAY)
+        roster.sync(100, 1000)
+        self.assertEqual((roster.base, roster.count, roster.synced, roster.resynced), (99, 100, 1000, True))
+
+        # Ушёл тот, кто был ещё до бота, — из base; вошёл новый — поверх
+        roster.leave(8, MONDAY + 1)
+        roster.join(2, MONDAY + 1)
+        self.assertEqual((roster.base, roster.count), (98, 100))
+        self.assertEqual(roster.churn(2, MONDAY + 1), 2 / 100)
+
+        roster.sync(1, 2000)
+        self.assertEqual((roster.base, roster.count), (0, 2))
+        self.assertIsNone(bot.MemberRoster().churn(7, MONDAY))
+        self.assertIsNone(bot.MemberRoster().retention(7, MONDAY))
+
+    def test_json_round_trip(self):
+        roster = bot.MemberRoster()
+        for uid in range(1, 6):
+            roster.join(uid, MONDAY + uid)
+        roster.leave(2, MONDAY + 9)
+        roster.sync(40, 1000)
+
+        copy = bot.MemberRoster()
+        copy.load_json(roster.to_json())
+        self.assertEqual(copy.to_json(), roster.to_json())
+        self.assertEqual(copy.count, 40)
+
+        # Счётчики отдельно от участников, участники — частями
+        partial = bot.MemberRoster()
+        partial.load_json(roster.to_json(members=False))
+        partial.load_json(roster.to_json({2, 3}))
+        self.assertEqual(partial.rows(), [(2, -(MONDAY + 9)), (3, MONDAY + 3)])
+        self.assertEqual(partial.flow(30, MONDAY + 9), roster.flow(30, MONDAY + 9))
+
+
+class RosterPersistenceTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_events_survive_journal(self):
+        root = temp_root(self)
+        db = bot.FastDataManager(-100, root)
+        await db.load()
+        db.sync_member_count(50)
+        self.assertTrue(db.track_new_member(1, noon(-10)))
+        self.assertFalse(db.track_new_member(1, noon(-10)))
+        db.track_new_member(2, noon(-1))
+        db.track_left_member(1, noon())
+        self.assertTrue(await db.save_all())
+        self.assertEqual(db.save_stats['kind'], 'journal')
+
+        reloaded = bot.FastDataManager(-100, root)
+        await reloaded.load()
+        self.assertEqual(reloaded.roster.to_json(), db.roster.to_json())
+        self.assertEqual((reloaded.roster.count, db.roster.count), (51, 51))
+        self.assertEqual(reloaded.state['new_members'], 2)
+
+
+class SyncMemberCountTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.counts = [120]
+
+        async def get_chat_member_count(chat_id):
+            count = self.counts.pop(0)
+            if isinstance(count, Exception):
+                raise count
+            return count
+
+        patcher = patch.object(bot, 'bot', SimpleNamespace(get_chat_member_count=get_chat_member_count))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = bot.FastDataManager(-100)
+
+    async def test_sync(self):
+        self.db.track_new_member(1, noon())
+        await bot.sync_member_count(self.db)
+        self.assertEqual((self.db.roster.base, self.db.roster.count), (119, 120))
+
+        # До следующего срока Telegram не спрашиваем
+        self.counts = [200]
+        await bot.sync_member_count(self.db)
+        self.assertEqual(self.db.roster.count, 120)
+
+    async def test_unavailable(self):
+        self.counts = [TelegramBadRequest(GetChatMemberCount(chat_id=-100), "Bad Request: chat not found")]
+        await bot.sync_member_count(self.db)
+        self.assertIsNone(self.db.roster.count)
+        self.assertGreater(self.db.roster.synced, 0)
+        self.assertEqual(self.counts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
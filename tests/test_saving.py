@@ -0,0 +1,109 @@
+"""Сохранение вне цикла событий: запись в потоке, copy-on-write и атомарная подмена файла"""
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from tests import bot, noon, snapshot, temp_root
+
+CHAT_ID = -100
+
+
+class OffloadedSaveTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.root = temp_root(self)
+        self.db = bot.FastDataManager(CHAT_ID, self.root)
+        await self.db.load()
+        self.db.track_messages({uid: [uid, uid % 3, f"u{uid}", "Имя"] for uid in range(1, 40)}, noon())
+
+    def reopen(self) -> 'bot.FastDataManager':
+        fresh = bot.FastDataManager(CHAT_ID, self.root)
+        fresh._load_all()
+        return fresh
+
+    async def test_snapshot_is_written_in_a_worker_thread(self):
+        loop_thread = threading.get_ident()
+        threads = []
+        write = bot.FastDataManager._atomic_write
+
+        def slow_write(filename, chunks, binary=False):
+            threads.append(threading.get_ident())
+            time.sleep(0.05)
+            return write(filename, chunks, binary)
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        self.db._snapshot_due = True
+        with patch.object(bot.FastDataManager, '_atomic_write', staticmethod(slow_write)):
+            self.assertTrue(await self.db.save_all())
+        task.cancel()
+
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+        # Пока файлы писались, цикл продолжал крутиться
+        self.assertGreater(ticks, 5)
+        self.assertEqual(snapshot(self.reopen()), snapshot(self.db))
+
+    async def test_changes_during_write_stay_out_of_the_snapshot(self):
+        """Copy-on-write: строки, изменённые после точки снимка, пишутся в прежнем виде"""
+        for fmt in ("json", "binary"):
+            with self.subTest(fmt=fmt), patch.object(bot.config, 'SNAPSHOT_FORMAT', fmt):
+                expected = {uid: bot.user_row(user) for uid, user in self.db.users.items()}
+                base, frozen, state = self.db._begin_snapshot()
+
+                self.db.track_messages({1: [5, 5, "", ""], 2: [1, 0, "", ""]}, noon())
+                self.db.track_command(3, "top")
+                self.db._write_snapshot(base, frozen, state)
+                self.db._cow = None
+
+                written = bot.FastDataManager(CHAT_ID, self.root)
+                written._load_users()
+                # Журнал не пишется в этом тесте — на диске ровно точка снимка
+                self.assertEqual({uid: bot.user_row(user) for uid, user in written.users.items()}, expected)
+                self.assertNotEqual(bot.user_row(self.db.users[1]), expected[1])
+                written.close()
+
+    async def test_concurrent_changes_survive_the_next_save(self):
+        self.db._snapshot_due = True
+        save = asyncio.create_task(self.db.save_all())
+        await asyncio.sleep(0)
+        self.db.track_messages({7: [3, 1, "", ""], 100: [1, 0, "new", "Новый"]}, noon())
+        self.assertTrue(await save)
+        self.assertTrue(await self.db.save_all())
+        self.assertEqual(snapshot(self.reopen()), snapshot(self.db))
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+    def test_failed_write_keeps_the_old_file(self):
+        path = str(temp_root(self) / "state.json")
+        bot.FastDataManager._atomic_write(path, [json.dumps({'v': 1})])
+
+        def chunks():
+            yield '{"v": '
+            raise OSError("диск полон")
+
+        with self.assertRaises(OSError):
+            bot.FastDataManager._atomic_write(path, chunks())
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'v': 1})
+
+    def test_returns_bytes_written(self):
+        path = str(temp_root(self) / "users.json")
+        written = bot.FastDataManager._atomic_write(path, ['{"ключ":', ' 1}'])
+        with open(path, 'rb') as f:
+            self.assertEqual(written, len(f.read()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Бинарный снимок users.bin: запись и чтение, поиск по uid, повреждённые файлы"""
+import os
+import random
+import unittest
+
+from tests import bot, temp_root
+
+
+def make_rows(n: int, seed: int = 3) -> list:
+    rnd = random.Random(seed)
+    uids = sorted(rnd.sample(range(-10 ** 12, 10 ** 12), n))
+    names = ["", "Արամ", "Анна", "Ẓoë 🎮", "x" * 300, "bob"]
+    return [(uid, (rnd.choice(names), rnd.choice(("", "user", "ник_1")), rnd.randint(0, 10 ** 6),
+                   rnd.randint(0, 2 ** 40), rnd.randint(0, 100), rnd.randint(0, 2 ** 33), rnd.randint(0, 2 ** 33)))
+            for uid in uids]
+
+
+class BinarySnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = str(temp_root(self) / "users.bin")
+
+    def open(self) -> 'bot.BinarySnapshot':
+        snapshot = bot.BinarySnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_round_trip(self):
+        rows = make_rows(500)
+        written = bot.BinarySnapshot.write(self.path, rows)
+        snapshot = self.open()
+
+        self.assertEqual(snapshot.count, len(rows))
+        self.assertEqual(written, os.path.getsize(self.path))
+        for i, (uid, row) in enumerate(rows):
+            self.assertEqual(snapshot.find(uid), i)
+            self.assertEqual(snapshot.row(i), row)
+            self.assertEqual(bot.user_row(snapshot.record(i)), row)
+
+    def test_missing_uids(self):
+        rows = make_rows(50)
+        bot.BinarySnapshot.write(self.path, rows)
+        snapshot = self.open()
+        present = {uid for uid, _ in rows}
+
+        for uid in (rows[0][0] - 1, rows[-1][0] + 1, 0, 10 ** 13):
+            if uid not in present:
+                self.assertEqual(snapshot.find(uid), -1)
+
+    def test_empty(self):
+        bot.BinarySnapshot.write(self.path, [])
+        snapshot = self.open()
+        self.assertEqual(snapshot.count, 0)
+        self.assertEqual(snapshot.find(1), -1)
+
+    def test_truncated_and_foreign_files(self):
+        bot.BinarySnapshot.write(self.path, make_rows(20))
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        for broken in (data[:-1], data[:bot.BinarySnapshot.HEADER.size + 8], b'JSON' + data[4:]):
+            with self.subTest(size=len(broken)):
+                with open(self.path, 'wb') as f:
+                    f.write(broken)
+                with self.assertRaises(ValueError):
+                    bot.BinarySnapshot(self.path)
+
+    def test_user_table_over_snapshot(self):
+        """UserTable: строки снимка, изменения в live и новые пользователи — как у dict"""
+        rows = make_rows(30)
+        bot.BinarySnapshot.write(self.path, rows)
+        table = bot.UserTable(self.open())
+
+        uid, row = rows[7]
+        table[uid].points += 5
+        table[1] = bot.UserRecord("new", "", 1, 1, 0, 10, 10)
+
+        self.assertEqual(len(table), len(rows) + 1)
+        self.assertEqual(table.row(uid)[2], row[2] + 5)
+        self.assertEqual(table.row(rows[8][0]), rows[8][1])
+        self.assertIn(1, table)
+        self.assertEqual(sorted(table), sorted([uid for uid, _ in rows] + [1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""SQLite: перенос из JSON (строки 'state' и 'history'), сброс перед запросом и откат пакетного upsert"""
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+from tests import bot, chats_root, noon
+
+CHAT_ID = -100
+
+
+def stored(db: 'bot.SqliteDataManager', uids) -> dict:
+    """То, что должно пережить перенос и перезагрузку, — в том же виде, что у snapshot()"""
+    return {
+        'users': {uid: bot.user_row(db.peek_user(uid)) for uid in uids if db.peek_user(uid)},
+        'total_messages': db.state['total_messages'],
+        'new_members': db.state['new_members'],
+        'windows': sorted(db._windows.cells()),
+        'ranks': {uid: db.get_user_rank(uid) for uid in uids},
+        'daily_active': db._activity.history_json(),
+        'roster': db.roster.to_json()
+    }
+
+
+class FailingConnection:
+    """Обёртка соединения: executemany с заданным запросом падает посреди транзакции"""
+
+    def __init__(self, conn: sqlite3.Connection, failing: str):
+        self.conn = conn
+        self.failing = failing
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, sql, rows):
+        if sql == self.failing:
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.executemany(sql, rows)
+
+
+class SqliteTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.root = chats_root(self)
+        self.uids = list(range(1, 30))
+        patcher = patch.object(bot.config, 'CHAT_ID', CHAT_ID)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_sqlite(self) -> 'bot.SqliteDataManager':
+        db = bot.SqliteDataManager(CHAT_ID, self.root / bot.config.CHATS_DIR / str(CHAT_ID))
+        db._load_all()
+        self.addCleanup(db.close)
+        return db
+
+    async def fill_json(self) -> 'bot.FastDataManager':
+        db = bot.open_chats().get(CHAT_ID)
+        await db.wait_ready('activity')
+        db.track_messages({uid: [uid, uid % 4, f"u{uid}", "Имя"] for uid in self.uids}, noon(-1))
+        db.track_messages({uid: [1, 1, "", ""] for uid in self.uids[:5]}, noon())
+        db.sync_member_count(120)
+        for uid in self.uids[:6]:
+            db.track_new_member(uid, noon(-1))
+        db.track_left_member(self.uids[0], noon())
+        self.assertTrue(await db.save_all())
+        db.close()
+        return db
+
+    async def test_migration_round_trip(self):
+        source = await self.fill_json()
+        bot.migrate_json_to_sqlite()
+
+        db = self.open_sqlite()
+        self.assertEqual(db.total_users, len(self.uids))
+        self.assertEqual(stored(db, self.uids), stored(source, self.uids))
+        self.assertEqual(db.roster.base, 120)
+
+    async def test_migrated_history_survives_a_flush_before_query(self):
+        """Сброс перед запросом переписывает только 'state' — история из переноса остаётся"""
+        await self.fill_json()
+        bot.migrate_json_to_sqlite()
+
+        db = self.open_sqlite()
+        expected = stored(db, self.uids)
+        messages = db.peek_user(self.uids[1]).messages
+        db.track_messages({self.uids[1]: [1, 0, "", ""]}, noon())
+        db.get_top_users()
+        self.assertFalse(db._dirty_users)
+        db.close()
+
+        reopened = self.open_sqlite()
+        counters = {key: value for key, value in expected['roster'].items() if key != 'members'}
+        self.assertEqual(reopened.roster.to_json(members=False), counters)
+        self.assertEqual(reopened._activity.history_json(), expected['daily_active'])
+        self.assertEqual(reopened.peek_user(self.uids[1]).messages, messages + 1)
+
+    async def test_failed_flush_rolls_back_and_keeps_changes(self):
+        await self.fill_json()
+        bot.migrate_json_to_sqlite()
+
+        db = self.open_sqlite()
+        before = stored(db, self.uids)
+        conn = db._conn
+        db.track_messages({uid: [2, 3, "", ""] for uid in self.uids[:3]}, noon())
+        db.track_messages({1000: [1, 1, "new", "Новый"]}, noon())
+        db.track_new_member(1000, noon())
+        dirty = (set(db._dirty_users), set(db.roster.changed), set(db._dirty_windows))
+
+        for failing in (bot.SQLITE_UPSERT_MEMBER, bot.SQLITE_UPSERT_WINDOW):
+            with self.subTest(failing=failing):
+                db._conn = FailingConnection(conn, failing)
+                self.assertFalse(await db.save_all())
+                db._conn = conn
+
+                self.assertTrue(db._dirty)
+                self.assertEqual((db._dirty_users, db.roster.changed, db._dirty_windows), dirty)
+                # Строки пользователей из той же транзакции откатились
+                self.assertIsNone(conn.execute("SELECT uid FROM users WHERE uid = 1000").fetchone())
+                self.assertEqual(conn.execute("SELECT points FROM users WHERE uid = 1").fetchone()[0],
+                                 before['users'][1][2])
+
+        self.assertTrue(await db.save_all())
+        expected = stored(db, self.uids + [1000])
+        db.close()
+        self.assertEqual(stored(self.open_sqlite(), self.uids + [1000]), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
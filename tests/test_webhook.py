@@ -0,0 +1,112 @@
+"""WebhookServer: секретный токен, лимит обработчиков в работе с 503 и дожидание принятого при остановке"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from tests import bot
+
+SECRET = "s3cret"
+
+
+class FakeDispatcher:
+    """Обработка апдейта держится, пока тест не отпустит release"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = []
+        self.finished = []
+
+    async def feed_update(self, bot, update):
+        self.started.append(update.update_id)
+        await self.release.wait()
+        self.finished.append(update.update_id)
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.dp = FakeDispatcher()
+        for patcher in (patch.object(bot, 'dp', self.dp),
+                        patch.object(bot.config, 'WEBHOOK_SECRET', SECRET),
+                        patch.object(bot.config, 'WEBHOOK_MAX_IN_FLIGHT', 2),
+                        patch.object(bot.config, 'WEBHOOK_ACCEPT_TIMEOUT', 0.05)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.server = bot.WebhookServer()
+        app = web.Application()
+        app.router.add_post(bot.config.WEBHOOK_PATH, self.server.handle)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def post(self, update_id: int, secret: str = SECRET, body=None) -> int:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret is not None else {}
+        response = await self.client.post(bot.config.WEBHOOK_PATH, headers=headers,
+                                          json={"update_id": update_id} if body is None else body)
+        return response.status
+
+    async def settle(self):
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def test_secret_token(self):
+        self.assertEqual(await self.post(1, secret=None), 401)
+        self.assertEqual(await self.post(2, secret="wrong"), 401)
+        self.assertEqual(await self.post(3), 200)
+        await self.settle()
+        self.assertEqual(self.dp.started, [3])
+
+        with patch.object(bot.config, 'WEBHOOK_SECRET', ""):
+            self.assertEqual(await self.post(4, secret=None), 200)
+        self.dp.release.set()
+
+    async def test_malformed_update(self):
+        self.assertEqual(await self.post(1, body={"message": "нет update_id"}), 400)
+        self.assertEqual(self.server.accepted, 0)
+
+    async def test_in_flight_limit(self):
+        """Сверх WEBHOOK_MAX_IN_FLIGHT запрос ждёт места и получает 503 — Telegram повторит"""
+        self.assertEqual([await self.post(1), await self.post(2)], [200, 200])
+        self.assertEqual(await self.post(3), 503)
+        self.assertEqual(self.server.in_flight, 2)
+        self.assertEqual((self.server.accepted, self.server.rejected), (2, 1))
+
+        # Запрос, дождавшийся свободного места, принимается
+        waiting = asyncio.create_task(self.post(4))
+        await self.settle()
+        self.dp.release.set()
+        self.assertEqual(await waiting, 200)
+        await self.server.drain(1)
+        self.assertEqual(sorted(self.dp.finished), [1, 2, 4])
+
+    async def test_handler_errors_free_the_slot(self):
+        async def broken(bot, update):
+            raise RuntimeError("сбой обработчика")
+
+        self.dp.feed_update = broken
+        for update_id in range(5):
+            self.assertEqual(await self.post(update_id), 200)
+            await self.settle()
+        self.assertEqual(self.server.in_flight, 0)
+
+    async def test_drain_waits_for_accepted(self):
+        await self.post(1)
+        await self.post(2)
+        await self.settle()
+
+        # Зависший обработчик не держит остановку дольше таймаута
+        await self.server.drain(0.05)
+        self.assertEqual(self.dp.finished, [])
+
+        asyncio.get_running_loop().call_later(0.05, self.dp.release.set)
+        await self.server.drain(5)
+        self.assertEqual(sorted(self.dp.finished), [1, 2])
+        self.assertEqual(self.server.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
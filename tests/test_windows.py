@@ -0,0 +1,121 @@
+"""Рейтинги за период: смена суток, пропуск нескольких дней, начисления задним числом"""
+import random
+import unittest
+from datetime import date
+
+from tests import Clock, bot, noon, temp_root
+
+DAY = 86400
+WINDOWS = {'day': 1, 'week': 7, 'month': 30}
+
+
+def ordinal(now: int) -> int:
+    return date.fromtimestamp(now).toordinal()
+
+
+def expected(events: list, today: int, length: int) -> dict:
+    """Очки за окно полным пересчётом: дни (today - length, today]"""
+    totals = {}
+    for day, uid, points in events:
+        if today - length < day <= today:
+            totals[uid] = totals.get(uid, 0) + points
+    return {uid: points for uid, points in totals.items() if points > 0}
+
+
+class WindowRolloverTest(unittest.TestCase):
+
+    def assert_windows(self, board: 'bot.WindowedLeaderboard', events: list, today: int):
+        for name, length in WINDOWS.items():
+            want = expected(events, today, length)
+            got = dict(board.top(name, 1000))
+            self.assertEqual(got, want, f"окно {name}, день {today}")
+            for uid, points in want.items():
+                rank = 1 + sum(1 for other in want.values() if other > points)
+                self.assertEqual(board.rank(name, uid), rank)
+
+    def test_random_days_with_gaps(self):
+        """Сутки сменяются по одной и прыжками через несколько дней, в том числе через всё окно"""
+        rnd = random.Random(17)
+        clock = Clock(self, noon())
+        board = bot.WindowedLeaderboard(WINDOWS)
+        events = []
+        offset = 0
+
+        for _ in range(120):
+            offset += rnd.choice((0, 0, 1, 1, 2, 3, 8, 31))
+            clock.now = noon(offset) + rnd.randint(-3 * 3600, 3 * 3600)
+            for _ in range(rnd.randint(1, 6)):
+                uid, points = rnd.randrange(20), rnd.randint(1, 5)
+                # Изредка — начисление задним числом (очередь простоя)
+                sent = clock.now - rnd.choice((0, 0, 0, DAY, 5 * DAY, 40 * DAY))
+                day = board.add(uid, points, sent)
+                self.assertEqual(day, ordinal(sent))
+                if day >= board.first_day:
+                    events.append((day, uid, points))
+            self.assert_windows(board, events, ordinal(clock.now))
+
+    def test_idle_skip_resets_every_window(self):
+        clock = Clock(self, noon())
+        board = bot.WindowedLeaderboard(WINDOWS)
+        board.add(1, 10, clock.now)
+        board.add(2, 3, clock.now)
+
+        clock.now = noon(6)
+        self.assertEqual(board.points('week', 1), 10)
+        self.assertEqual(board.points('day', 1), 0)
+
+        clock.now = noon(7)
+        self.assertEqual(board.top('week', 10), [])
+        self.assertEqual(board.points('month', 1), 10)
+
+        clock.now = noon(45)
+        for name in WINDOWS:
+            self.assertEqual(board.top(name, 10), [])
+        self.assertEqual(list(board.cells()), [])
+
+    def test_reload_after_several_days(self):
+        """Сохранённые по дням очки, загруженные через несколько суток, дают те же окна"""
+        clock = Clock(self, noon())
+        board = bot.WindowedLeaderboard(WINDOWS)
+        events = []
+        for offset in (0, 2, 5, 9):
+            clock.now = noon(offset)
+            for uid in range(5):
+                board.add(uid, uid + offset, clock.now)
+                events.append((ordinal(clock.now), uid, uid + offset))
+
+        saved = board.to_json()
+        clock.now = noon(12)
+        restored = bot.WindowedLeaderboard(WINDOWS)
+        restored.load_json(saved)
+        self.assert_windows(restored, events, ordinal(clock.now))
+        self.assert_windows(board, events, ordinal(clock.now))
+
+
+class ManagerRolloverTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_saved_windows_survive_days_off(self):
+        """Раздел сохранён, бот лежит несколько дней — окна считаются от сегодняшнего дня"""
+        root = temp_root(self)
+        clock = Clock(self, noon())
+        db = bot.FastDataManager(-100, root)
+        await db.load()
+
+        for offset in range(4):
+            clock.now = noon(offset)
+            db.track_messages({1: [1, 5, "", "A"], 2: [1, 2 + offset, "", "B"]}, clock.now)
+            await db.save_all()
+
+        clock.now = noon(9)
+        fresh = bot.FastDataManager(-100, root)
+        fresh._load_all()
+        # Дни 3..9: у первого остались очки за день 3, день 0..2 из недели выпали
+        self.assertEqual(fresh.get_window_points('week', 1), 5)
+        self.assertEqual(fresh.get_window_points('week', 2), 5)
+        self.assertEqual(fresh.get_window_points('month', 1), 20)
+        self.assertEqual(fresh.get_window_points('day', 1), 0)
+        self.assertEqual([uid for uid, _, _ in fresh.get_window_top('month')], [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()